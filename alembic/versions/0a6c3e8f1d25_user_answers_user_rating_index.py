@@ -0,0 +1,29 @@
+"""User answers user rating index
+
+Revision ID: 0a6c3e8f1d25
+Revises: f5a8d2c4b913
+Create Date: 2026-10-18 22:14:39.106527
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0a6c3e8f1d25'
+down_revision: Union[str, None] = 'f5a8d2c4b913'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Составной индекс покрывает и выборки по одному user_id
+    op.create_index('ix_user_answers_user_rating', 'user_answers', ['user_id', 'rating_id'], unique=False)
+    op.drop_index(op.f('ix_user_answers_user_id'), table_name='user_answers')
+
+
+def downgrade() -> None:
+    op.create_index(op.f('ix_user_answers_user_id'), 'user_answers', ['user_id'], unique=False)
+    op.drop_index('ix_user_answers_user_rating', table_name='user_answers')
@@ -0,0 +1,34 @@
+"""User rating totals
+
+Revision ID: 1b7d4f9a2e36
+Revises: 0a6c3e8f1d25
+Create Date: 2026-10-18 23:02:51.740318
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '1b7d4f9a2e36'
+down_revision: Union[str, None] = '0a6c3e8f1d25'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Заполняется командой python -m scripts.backfill_rating_totals
+    op.create_table('user_rating_totals',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('metric', sa.String(length=32), nullable=False),
+    sa.Column('total', sa.BigInteger(), server_default='0', nullable=False),
+    sa.Column('count', sa.Integer(), server_default='0', nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('user_id', 'metric')
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('user_rating_totals')
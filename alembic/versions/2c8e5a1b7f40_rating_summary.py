@@ -0,0 +1,33 @@
+"""Rating summary
+
+Revision ID: 2c8e5a1b7f40
+Revises: 1b7d4f9a2e36
+Create Date: 2026-10-18 23:41:27.385902
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '2c8e5a1b7f40'
+down_revision: Union[str, None] = '1b7d4f9a2e36'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Пустая таблица заполняется первым пересчётом при старте приложения
+    op.create_table('rating_summary',
+    sa.Column('metric', sa.String(length=32), nullable=False),
+    sa.Column('total', sa.BigInteger(), server_default='0', nullable=False),
+    sa.Column('count', sa.Integer(), server_default='0', nullable=False),
+    sa.Column('refreshed_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('metric')
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('rating_summary')
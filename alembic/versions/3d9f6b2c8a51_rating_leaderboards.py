@@ -0,0 +1,42 @@
+"""Rating leaderboards
+
+Revision ID: 3d9f6b2c8a51
+Revises: 2c8e5a1b7f40
+Create Date: 2026-10-19 00:18:05.624173
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3d9f6b2c8a51'
+down_revision: Union[str, None] = '2c8e5a1b7f40'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # best, school_class и гистограмма заполняются командой python -m scripts.backfill_rating_totals
+    op.add_column('user_rating_totals', sa.Column('best', sa.Integer(), nullable=True))
+    op.add_column('user_rating_totals', sa.Column('school_class', sa.Integer(), nullable=True))
+    op.create_index('ix_user_rating_totals_leaderboard', 'user_rating_totals',
+                    ['metric', sa.text('best DESC'), 'user_id'], unique=False)
+    op.create_index('ix_user_rating_totals_class_leaderboard', 'user_rating_totals',
+                    ['metric', 'school_class', sa.text('best DESC'), 'user_id'], unique=False)
+    op.create_table('rating_score_counts',
+    sa.Column('metric', sa.String(length=32), nullable=False),
+    sa.Column('score', sa.Integer(), nullable=False),
+    sa.Column('users', sa.Integer(), server_default='0', nullable=False),
+    sa.PrimaryKeyConstraint('metric', 'score')
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('rating_score_counts')
+    op.drop_index('ix_user_rating_totals_class_leaderboard', table_name='user_rating_totals')
+    op.drop_index('ix_user_rating_totals_leaderboard', table_name='user_rating_totals')
+    op.drop_column('user_rating_totals', 'school_class')
+    op.drop_column('user_rating_totals', 'best')
@@ -0,0 +1,31 @@
+"""Answer submission id
+
+Revision ID: 4e1a7c3d9b62
+Revises: 3d9f6b2c8a51
+Create Date: 2026-10-19 10:12:44.918370
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '4e1a7c3d9b62'
+down_revision: Union[str, None] = '3d9f6b2c8a51'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # У старых ответов экзамен неизвестен: submission_id остаётся NULL, рейтинг по ним не создаётся
+    op.add_column('user_answers', sa.Column('submission_id', sa.String(length=32), nullable=True))
+    op.create_index('ix_user_answers_user_submission', 'user_answers', ['user_id', 'submission_id'], unique=False)
+    op.drop_index('ix_user_answers_user_rating', table_name='user_answers')
+
+
+def downgrade() -> None:
+    op.create_index('ix_user_answers_user_rating', 'user_answers', ['user_id', 'rating_id'], unique=False)
+    op.drop_index('ix_user_answers_user_submission', table_name='user_answers')
+    op.drop_column('user_answers', 'submission_id')
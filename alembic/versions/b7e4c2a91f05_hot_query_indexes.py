@@ -0,0 +1,40 @@
+"""Hot query indexes
+
+Revision ID: b7e4c2a91f05
+Revises: 9e2d41b7c0a3
+Create Date: 2026-10-18 14:20:05.118342
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b7e4c2a91f05'
+down_revision: Union[str, None] = '9e2d41b7c0a3'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index('ix_tests_level_id', 'tests', ['level', 'id'], unique=False)
+    op.create_index('ix_tests_level_test_type', 'tests', ['level', 'test_type'], unique=False)
+    op.create_index(op.f('ix_test_attempts_test_id'), 'test_attempts', ['test_id'], unique=False)
+    op.create_index(op.f('ix_test_attempts_user_id'), 'test_attempts', ['user_id'], unique=False)
+    op.create_index('ix_user_answers_test_id_attempt', 'user_answers', ['test_id', 'attempt'], unique=False)
+    op.create_index(op.f('ix_user_answers_user_id'), 'user_answers', ['user_id'], unique=False)
+    op.create_index(op.f('ix_user_answers_rating_id'), 'user_answers', ['rating_id'], unique=False)
+    op.create_index(op.f('ix_test_rating_user_id'), 'test_rating', ['user_id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_test_rating_user_id'), table_name='test_rating')
+    op.drop_index(op.f('ix_user_answers_rating_id'), table_name='user_answers')
+    op.drop_index(op.f('ix_user_answers_user_id'), table_name='user_answers')
+    op.drop_index('ix_user_answers_test_id_attempt', table_name='user_answers')
+    op.drop_index(op.f('ix_test_attempts_user_id'), table_name='test_attempts')
+    op.drop_index(op.f('ix_test_attempts_test_id'), table_name='test_attempts')
+    op.drop_index('ix_tests_level_test_type', table_name='tests')
+    op.drop_index('ix_tests_level_id', table_name='tests')
@@ -0,0 +1,49 @@
+"""Attempt counter per user and test
+
+Revision ID: c3d8f5a0e6b1
+Revises: b7e4c2a91f05
+Create Date: 2026-10-18 16:05:41.507213
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c3d8f5a0e6b1'
+down_revision: Union[str, None] = 'b7e4c2a91f05'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Отдельная таблица счётчиков; test_attempts остаётся журналом попыток без изменений
+    op.create_table('user_test_counters',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('test_id', sa.Integer(), nullable=False),
+    sa.Column('attempt_number', sa.Integer(), server_default='0', nullable=False),
+    sa.Column('last_attempt_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['test_id'], ['tests.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('user_id', 'test_id')
+    )
+    # Счётчик начинается с числа уже сохранённых ответов пары (user_id, test_id), а не
+    # с max(attempt) - старые номера попыток считались по тесту без учёта пользователя
+    op.execute("""
+        INSERT INTO user_test_counters (user_id, test_id, attempt_number, last_attempt_at)
+        SELECT user_id, test_id, count(*), max(answered_at)
+        FROM user_answers
+        WHERE user_id IS NOT NULL AND test_id IS NOT NULL
+        GROUP BY user_id, test_id
+    """)
+    op.create_index(op.f('ix_user_test_counters_test_id'), 'user_test_counters', ['test_id'], unique=False)
+    # Поиск последней попытки по user_answers заменён счётчиком
+    op.drop_index('ix_user_answers_test_id_attempt', table_name='user_answers')
+
+
+def downgrade() -> None:
+    op.create_index('ix_user_answers_test_id_attempt', 'user_answers', ['test_id', 'attempt'], unique=False)
+    op.drop_index(op.f('ix_user_test_counters_test_id'), table_name='user_test_counters')
+    op.drop_table('user_test_counters')
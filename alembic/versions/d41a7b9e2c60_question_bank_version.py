@@ -0,0 +1,31 @@
+"""Question bank version
+
+Revision ID: d41a7b9e2c60
+Revises: c3d8f5a0e6b1
+Create Date: 2026-10-18 17:12:09.664830
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd41a7b9e2c60'
+down_revision: Union[str, None] = 'c3d8f5a0e6b1'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('question_bank_version',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('version', sa.Integer(), server_default='0', nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.execute("INSERT INTO question_bank_version (id, version) VALUES (1, 0)")
+
+
+def downgrade() -> None:
+    op.drop_table('question_bank_version')
@@ -0,0 +1,44 @@
+"""Test attempt totals
+
+Revision ID: e92f3c1d7a48
+Revises: d41a7b9e2c60
+Create Date: 2026-10-18 18:31:52.271904
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e92f3c1d7a48'
+down_revision: Union[str, None] = 'd41a7b9e2c60'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('test_attempt_totals',
+    sa.Column('test_id', sa.Integer(), nullable=False),
+    sa.Column('level', postgresql.ENUM('LEVEL_1', 'LEVEL_2', 'LEVEL_3', name='testlevel', create_type=False),
+              nullable=False),
+    sa.Column('attempt_count', sa.Integer(), server_default='0', nullable=False),
+    sa.ForeignKeyConstraint(['test_id'], ['tests.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('test_id')
+    )
+    # Начальные значения - сумма счётчиков пользователей; тесты без попыток получают 0
+    op.execute("""
+        INSERT INTO test_attempt_totals (test_id, level, attempt_count)
+        SELECT tests.id, COALESCE(tests.level, 'LEVEL_1'), COALESCE(sum(user_test_counters.attempt_number), 0)
+        FROM tests LEFT JOIN user_test_counters ON user_test_counters.test_id = tests.id
+        GROUP BY tests.id, tests.level
+    """)
+    op.create_index('ix_test_attempt_totals_level_count', 'test_attempt_totals',
+                    ['level', 'attempt_count', 'test_id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_test_attempt_totals_level_count', table_name='test_attempt_totals')
+    op.drop_table('test_attempt_totals')
@@ -0,0 +1,67 @@
+"""Spaced repetition state
+
+Revision ID: f5a8d2c4b913
+Revises: e92f3c1d7a48
+Create Date: 2026-10-18 21:07:14.583016
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f5a8d2c4b913'
+down_revision: Union[str, None] = 'e92f3c1d7a48'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('user_review_states',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('test_id', sa.Integer(), nullable=False),
+    sa.Column('box', sa.Integer(), server_default='0', nullable=False),
+    sa.Column('review_due', sa.Integer(), server_default='0', nullable=False),
+    sa.ForeignKeyConstraint(['test_id'], ['tests.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('user_id', 'test_id')
+    )
+    # box 0 и review_due 0: всё решённое до миграции сразу попадает в повторение
+    op.execute("""
+        INSERT INTO user_review_states (user_id, test_id, box, review_due)
+        SELECT DISTINCT user_id, test_id, 0, 0
+        FROM user_answers
+        WHERE user_id IS NOT NULL AND test_id IS NOT NULL
+    """)
+    op.create_index('ix_user_review_states_user_due', 'user_review_states', ['user_id', 'review_due'], unique=False)
+    op.create_index(op.f('ix_user_review_states_test_id'), 'user_review_states', ['test_id'], unique=False)
+
+    op.create_table('user_skill_stats',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('level', postgresql.ENUM('LEVEL_1', 'LEVEL_2', 'LEVEL_3', name='testlevel', create_type=False),
+              nullable=False),
+    sa.Column('test_type', postgresql.ENUM('TYPE_1', 'TYPE_2', 'TYPE_3', name='testtype', create_type=False),
+              nullable=False),
+    sa.Column('answered', sa.Integer(), server_default='0', nullable=False),
+    sa.Column('correct', sa.Integer(), server_default='0', nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('user_id', 'level', 'test_type')
+    )
+    # Единственный проход по истории ответов; дальше таблицу ведут сервисы сохранения ответов
+    op.execute("""
+        INSERT INTO user_skill_stats (user_id, level, test_type, answered, correct)
+        SELECT user_answers.user_id, tests.level, tests.test_type, count(*), count(*) FILTER (WHERE user_answers.correctness)
+        FROM user_answers JOIN tests ON tests.id = user_answers.test_id
+        WHERE user_answers.user_id IS NOT NULL AND tests.level IS NOT NULL AND tests.test_type IS NOT NULL
+        GROUP BY user_answers.user_id, tests.level, tests.test_type
+    """)
+
+
+def downgrade() -> None:
+    op.drop_table('user_skill_stats')
+    op.drop_index(op.f('ix_user_review_states_test_id'), table_name='user_review_states')
+    op.drop_index('ix_user_review_states_user_due', table_name='user_review_states')
+    op.drop_table('user_review_states')
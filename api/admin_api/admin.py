@@ -1,6 +1,22 @@
-from fastapi import APIRouter, HTTPException
+import asyncio
+from typing import Optional
+
+from fastapi import APIRouter, HTTPException, Depends, File, Query, UploadFile
 from pydantic import BaseModel
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import get_async_db
 from database.adminservice import *
+from api.bulk_upload import BulkReport, detect_format, insert_batch, iter_records, validate_record
+from auth.hashing import password_hasher, hash_password_async
+from auth.token_cache import token_cache
+from auth.principal_cache import principal_cache
+from auth.token_versions import token_versions
+from auth.throttle import login_throttle
+from database.pool_metrics import pool_metrics
+from database.question_bank import question_bank
+from database.rating_summary import rating_summary
+from database.request_stats import request_stats_summary, route_sql_stats
+from database.routing import routing_stats
 from logging_config import logger
 
 
@@ -48,12 +64,13 @@ admin_router = APIRouter(prefix='/admins', tags=['Админы'])
 
 
 @admin_router.post('/admin_registration')
-async def register_admin(admin: AdminCreate):
-    result = admin_registration_db(
+async def register_admin(admin: AdminCreate, db: AsyncSession = Depends(get_async_db)):
+    result = await admin_registration_db(
+        db,
         admin.admin_first_name,
         admin.admin_last_name,
         admin.number,
-        admin.password
+        await hash_password_async(admin.password)
     )
     if result:
         logger.info(f"Админ {admin.number} зарегистрирован успешно.")
@@ -62,8 +79,8 @@ async def register_admin(admin: AdminCreate):
 
 
 @admin_router.delete('/{admin_id}')
-async def delete_admin(admin_id: int):
-    result = admin_delete_db(admin_id)
+async def delete_admin(admin_id: int, db: AsyncSession = Depends(get_async_db)):
+    result = await admin_delete_db(db, admin_id)
     if result:
         logger.info(f"Админ с id {admin_id} удалён.")
         return {'status': 1, 'message': f'Админ с id {admin_id} удалён'}
@@ -71,8 +88,9 @@ async def delete_admin(admin_id: int):
 
 
 @admin_router.put('/{admin_id}')
-async def update_admin(admin_id: int, admin_data: ChangeAdminData):
-    result = change_admin_data_db(
+async def update_admin(admin_id: int, admin_data: ChangeAdminData, db: AsyncSession = Depends(get_async_db)):
+    result = await change_admin_data_db(
+        db,
         admin_id,
         admin_data.admin_first_name,
         admin_data.admin_last_name,
@@ -85,8 +103,9 @@ async def update_admin(admin_id: int, admin_data: ChangeAdminData):
 
 
 @admin_router.post('/user_registration')
-async def register_user(user: UserCreate):
-    result = user_registration_db(
+async def register_user(user: UserCreate, db: AsyncSession = Depends(get_async_db)):
+    result = await user_registration_db(
+        db,
         user_first_name=user.user_first_name,
         user_last_name=user.user_last_name,
         number=user.number,
@@ -97,40 +116,101 @@ async def register_user(user: UserCreate):
         school_class=user.school_class,
         university=user.university,
         group_number=user.group_number,
-        password=user.password
+        hashed_password=await hash_password_async(user.password)
     )
     if result:
         return {'status': 1, 'message': 'Пользователь зарегистрирован успешно'}
     raise HTTPException(status_code=400, detail='Ошибка регистрации пользователя')
 
 
+async def _register_users_batch(db: AsyncSession, batch, report: BulkReport, mode: str):
+    existing = await existing_user_numbers_db(db, [user.number for _, user in batch])
+    fresh = []
+    for number, user in batch:
+        if user.number in existing:
+            report.add_error(number, [{'field': 'number', 'message': 'Пользователь с таким номером уже существует'}])
+        else:
+            fresh.append((number, user))
+    if not fresh or (mode == 'atomic' and report.failed):
+        return
+    # Все пароли пачки уходят в пул хеширования разом и считаются на всех воркерах
+    hashes = await asyncio.gather(*(hash_password_async(user.password) for _, user in fresh))
+    rows = [dict(user.model_dump(exclude={'password'}), password=hashed_password)
+            for (_, user), hashed_password in zip(fresh, hashes)]
+    await insert_batch(db, add_users_batch_db, rows, [number for number, _ in fresh], report, mode)
+
+
+async def import_roster(db: AsyncSession, records, mode: str, batch_size: int) -> BulkReport:
+    # Общая часть для POST /admins/user_registration/bulk и scripts/import_roster.py
+    report = BulkReport(mode)
+    seen_numbers = set()
+    batch = []
+    for number, record in records:
+        user = validate_record(UserCreate, number, record, report)
+        if user is None:
+            continue
+        if user.number in seen_numbers:
+            report.add_error(number, [{'field': 'number', 'message': 'Номер повторяется в файле'}])
+            continue
+        seen_numbers.add(user.number)
+        # В режиме atomic после первой ошибки только проверяем строки для отчёта
+        if mode == 'atomic' and report.failed:
+            continue
+        batch.append((number, user))
+        if len(batch) >= batch_size:
+            await _register_users_batch(db, batch, report, mode)
+            batch = []
+    if batch and not (mode == 'atomic' and report.failed):
+        await _register_users_batch(db, batch, report, mode)
+    if mode == 'atomic' and report.failed:
+        report.inserted = 0
+    return report
+
+
+@admin_router.post('/user_registration/bulk')
+async def register_users_bulk(file: UploadFile = File(...),
+                              file_format: Optional[str] = Query(None, alias='format'),
+                              mode: str = Query('atomic', pattern='^(atomic|chunked)$'),
+                              batch_size: int = Query(200, ge=1, le=2000),
+                              db: AsyncSession = Depends(get_async_db)):
+    # Импорт списка учеников (CSV или NDJSON с полями UserCreate)
+    file_format = detect_format(file, file_format)
+    report = await import_roster(db, iter_records(file.file, file_format), mode, batch_size)
+    if mode == 'atomic' and report.failed:
+        logger.info(f"Импорт пользователей отменён: ошибок в строках {report.failed}")
+        raise HTTPException(status_code=422, detail=report.as_dict())
+    logger.info(f"Импортировано пользователей: {report.inserted}, ошибок: {report.failed}")
+    return {'status': 1, 'data': report.as_dict()}
+
+
 @admin_router.delete('/user_del/{user_id}')
-async def delete_user(user_id: int):
-    result = user_delete_db(user_id)
+async def delete_user(user_id: int, db: AsyncSession = Depends(get_async_db)):
+    result = await user_delete_db(db, user_id)
     if result:
         return {'status': 1, 'message': f'Пользователь с id {user_id} удалён'}
     raise HTTPException(status_code=404, detail='Пользователь не найден или ошибка удаления')
 
 
 @admin_router.post('/user_block/{user_id}/block')
-async def block_user(user_id: int):
-    result = block_user_db(user_id)
+async def block_user(user_id: int, db: AsyncSession = Depends(get_async_db)):
+    result = await block_user_db(db, user_id)
     if result:
         return {'status': 1, 'message': f'Пользователь с id {user_id} заблокирован'}
     raise HTTPException(status_code=400, detail='Ошибка блокировки пользователя')
 
 
 @admin_router.post('/user_unblock/{user_id}')
-async def unblock_user(user_id: int):
-    result = unblock_user_db(user_id)
+async def unblock_user(user_id: int, db: AsyncSession = Depends(get_async_db)):
+    result = await unblock_user_db(db, user_id)
     if result:
         return {'status': 1, 'message': f'Пользователь с id {user_id} разблокирован'}
     raise HTTPException(status_code=400, detail='Ошибка разблокировки пользователя')
 
 
 @admin_router.put('/user_update/{user_id}')
-async def update_user(user_id: int, user_data: ChangeUserData):
-    result = change_user_data_db(
+async def update_user(user_id: int, user_data: ChangeUserData, db: AsyncSession = Depends(get_async_db)):
+    result = await change_user_data_db(
+        db,
         user_id,
         user_first_name=user_data.user_first_name,
         user_last_name=user_data.user_last_name,
@@ -149,24 +229,79 @@ async def update_user(user_id: int, user_data: ChangeUserData):
 
 
 @admin_router.get('/user_test/{total_rating_id}')
-async def get_user_test_statistic(total_rating_id: int):
-    result = get_user_test_statistic_db(total_rating_id)
+async def get_user_test_statistic(total_rating_id: int, db: AsyncSession = Depends(get_async_db)):
+    result = await get_user_test_statistic_db(db, total_rating_id)
     if result:
         return {'status': 1, 'data': result}
     raise HTTPException(status_code=404, detail='Статистика теста не найдена')
 
 
 @admin_router.get('/user/{user_id}')
-async def get_user_statistic(user_id: int):
-    result = get_user_statistic_db(user_id)
+async def get_user_statistic(user_id: int, db: AsyncSession = Depends(get_async_db)):
+    result = await get_user_statistic_db(db, user_id)
     if result:
         return {'status': 1, 'data': result}
     raise HTTPException(status_code=404, detail='Статистика пользователя не найдена')
 
 
 @admin_router.get('/full')
-async def get_full_statistic():
-    result = get_full_statistic_db()
+async def get_full_statistic(db: AsyncSession = Depends(get_async_db)):
+    result = await get_full_statistic_db(db)
     if result:
         return {'status': 1, 'data': result}
     raise HTTPException(status_code=404, detail='Общая статистика не найдена')
+
+
+@admin_router.get('/metrics/hashing')
+async def get_hashing_metrics():
+    return {'status': 1, 'data': password_hasher.stats()}
+
+
+@admin_router.get('/metrics/token_cache')
+async def get_token_cache_metrics():
+    return {'status': 1, 'data': token_cache.stats()}
+
+
+@admin_router.get('/metrics/principal_cache')
+async def get_principal_cache_metrics():
+    return {'status': 1, 'data': principal_cache.stats()}
+
+
+@admin_router.get('/metrics/token_versions')
+async def get_token_versions_metrics():
+    return {'status': 1, 'data': token_versions.stats()}
+
+
+@admin_router.get('/metrics/login_throttle')
+async def get_login_throttle_metrics():
+    return {'status': 1, 'data': login_throttle.stats()}
+
+
+@admin_router.get('/metrics/db_pool')
+async def get_db_pool_metrics():
+    return {'status': 1, 'data': {name: metrics.stats() for name, metrics in pool_metrics.items()}}
+
+
+@admin_router.get('/metrics/db_requests')
+async def get_db_requests_metrics():
+    return {'status': 1, 'data': request_stats_summary()}
+
+
+@admin_router.get('/metrics/db_routing')
+async def get_db_routing_metrics():
+    return {'status': 1, 'data': routing_stats()}
+
+
+@admin_router.get('/metrics/sql')
+async def get_sql_metrics():
+    return {'status': 1, 'data': route_sql_stats()}
+
+
+@admin_router.get('/metrics/question_bank')
+async def get_question_bank_metrics():
+    return {'status': 1, 'data': question_bank.stats()}
+
+
+@admin_router.get('/metrics/rating_summary')
+async def get_rating_summary_metrics():
+    return {'status': 1, 'data': rating_summary.stats()}
@@ -0,0 +1,119 @@
+import csv
+import io
+import json
+import time
+from typing import Optional
+
+from fastapi import HTTPException, UploadFile
+from pydantic import BaseModel, ValidationError
+
+# Сколько ошибочных строк возвращать в отчёте; остальные только считаются
+MAX_REPORTED_ERRORS = 100
+
+FORMATS = ('csv', 'ndjson')
+
+
+def detect_format(upload: UploadFile, file_format: Optional[str]) -> str:
+    if file_format:
+        if file_format not in FORMATS:
+            raise HTTPException(status_code=400, detail=f'Неизвестный формат {file_format}, нужен csv или ndjson')
+        return file_format
+    name = (upload.filename or '').lower()
+    content_type = (upload.content_type or '').lower()
+    if name.endswith('.csv') or 'csv' in content_type:
+        return 'csv'
+    if name.endswith(('.ndjson', '.jsonl')) or 'ndjson' in content_type or 'jsonl' in content_type:
+        return 'ndjson'
+    raise HTTPException(status_code=400, detail='Не удалось определить формат файла, укажите format=csv|ndjson')
+
+
+def iter_records(binary_file, file_format: str):
+    # Загруженный файл уже лежит во временном файле (в памяти только первый
+    # мегабайт), читаем его построчно: (номер записи, dict) или (номер, текст ошибки)
+    text = io.TextIOWrapper(binary_file, encoding='utf-8-sig', newline='')
+    try:
+        if file_format == 'csv':
+            reader = csv.DictReader(text)
+            for number, row in enumerate(reader, start=1):
+                if None in row:
+                    yield number, 'Лишние значения в строке'
+                    continue
+                # Пустые ячейки считаем отсутствующими полями
+                yield number, {key: value for key, value in row.items() if value not in ('', None)}
+        else:
+            for number, line in enumerate(text, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError as e:
+                    yield number, f'Некорректный JSON: {e}'
+                    continue
+                if not isinstance(record, dict):
+                    yield number, 'Ожидается JSON-объект'
+                    continue
+                yield number, record
+    except (UnicodeDecodeError, csv.Error) as e:
+        yield None, f'Файл не удалось прочитать: {e}'
+    finally:
+        # Не закрываем файл вместе с обёрткой - им владеет вызывающий код
+        text.detach()
+
+
+class BulkReport:
+    def __init__(self, mode: str):
+        self.mode = mode
+        self.received = 0
+        self.inserted = 0
+        self.failed = 0
+        self.batches = 0
+        self.errors = []
+        self.started = time.perf_counter()
+
+    def add_error(self, number, errors):
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'row': number, 'errors': errors})
+
+    def as_dict(self) -> dict:
+        elapsed = time.perf_counter() - self.started
+        return {
+            'mode': self.mode,
+            'received': self.received,
+            'inserted': self.inserted,
+            'failed': self.failed,
+            'batches': self.batches,
+            'elapsed_ms': round(elapsed * 1000, 1),
+            'rows_per_second': round(self.inserted / elapsed, 1) if elapsed > 0 else None,
+            'errors': self.errors,
+            'errors_truncated': self.failed > len(self.errors),
+        }
+
+
+def validate_record(model: type[BaseModel], number, record, report: BulkReport):
+    # Возвращает провалидированную модель или None (ошибка уже записана в отчёт)
+    report.received += 1
+    if isinstance(record, str):
+        report.add_error(number, [{'field': None, 'message': record}])
+        return None
+    try:
+        return model(**record)
+    except ValidationError as e:
+        report.add_error(number, [{'field': '.'.join(str(part) for part in error['loc']),
+                                   'message': error['msg']} for error in e.errors()])
+        return None
+
+
+async def insert_batch(db, insert_db, rows, numbers, report: BulkReport, mode: str):
+    # atomic - пачка остаётся в транзакции запроса, ошибка БД отменяет весь импорт;
+    # chunked - пачка коммитится сразу, при ошибке БД её строки попадают в отчёт
+    if await insert_db(db, rows):
+        if mode == 'chunked':
+            await db.commit()
+        report.inserted += len(rows)
+        report.batches += 1
+        return
+    if mode == 'atomic':
+        raise HTTPException(status_code=500, detail='Ошибка при сохранении, ничего не добавлено')
+    for number in numbers:
+        report.add_error(number, [{'field': None, 'message': 'Ошибка при сохранении пачки'}])
@@ -1,7 +1,11 @@
-from fastapi import APIRouter, HTTPException, Query
-from pydantic import BaseModel
-from typing import List
+from fastapi import APIRouter, HTTPException, Depends, File, Query, UploadFile
+from pydantic import BaseModel, Field
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import get_async_db
+from typing import List, Optional
 from database.testservice import *
+from database.trainerservice import *
+from api.bulk_upload import BulkReport, detect_format, insert_batch, iter_records, validate_record
 from logging_config import logger
 
 
@@ -35,6 +39,20 @@ class TestUpdate(BaseModel):
         orm_mode = True
 
 
+class BlueprintCell(BaseModel):
+    level: TestLevel
+    # Без типа - любой вопрос уровня
+    test_type: Optional[TestType] = None
+    count: int = Field(..., ge=1)
+
+
+class ExamBlueprint(BaseModel):
+    cells: List[BlueprintCell] = Field(..., min_length=1)
+    user_id: Optional[int] = None
+    # Не давать вопросы, на которые пользователь отвечал за последние N дней
+    exclude_recent_days: Optional[float] = Field(None, gt=0)
+
+
 class TestsResponse(BaseModel):
     status: int
     message: List[TestCreate]
@@ -48,8 +66,9 @@ test_router = APIRouter(prefix='/tests', tags=['Тесты'])
 
 
 @test_router.post('/', response_model=dict)
-async def create_test(test: TestCreate):
-    result = add_test_db(
+async def create_test(test: TestCreate, db: AsyncSession = Depends(get_async_db)):
+    result = await add_test_db(
+        db,
         question=test.question,
         var_1=test.var_1,
         var_2=test.var_2,
@@ -67,9 +86,40 @@ async def create_test(test: TestCreate):
     raise HTTPException(status_code=400, detail="Ошибка при добавлении теста.")
 
 
+@test_router.post('/bulk', response_model=dict)
+async def bulk_create_tests(file: UploadFile = File(...),
+                            file_format: Optional[str] = Query(None, alias='format'),
+                            mode: str = Query('atomic', pattern='^(atomic|chunked)$'),
+                            batch_size: int = Query(500, ge=1, le=5000),
+                            db: AsyncSession = Depends(get_async_db)):
+    # atomic - всё в одной транзакции, при любой ошибке не сохраняется ничего;
+    # chunked - каждая пачка коммитится отдельно, ошибочные строки пропускаются
+    file_format = detect_format(file, file_format)
+    report = BulkReport(mode)
+    batch, numbers = [], []
+    for number, record in iter_records(file.file, file_format):
+        test = validate_record(TestCreate, number, record, report)
+        # В режиме atomic после первой ошибки только проверяем строки для отчёта
+        if test is None or (mode == 'atomic' and report.failed):
+            continue
+        batch.append(test.model_dump())
+        numbers.append(number)
+        if len(batch) >= batch_size:
+            await insert_batch(db, add_tests_batch_db, batch, numbers, report, mode)
+            batch, numbers = [], []
+    if batch and not (mode == 'atomic' and report.failed):
+        await insert_batch(db, add_tests_batch_db, batch, numbers, report, mode)
+    if mode == 'atomic' and report.failed:
+        report.inserted = 0
+        logger.info(f"Импорт тестов отменён: ошибок в строках {report.failed}")
+        raise HTTPException(status_code=422, detail=report.as_dict())
+    logger.info(f"Импортировано тестов: {report.inserted}, ошибок: {report.failed}")
+    return {"status": 1, "data": report.as_dict()}
+
+
 @test_router.delete('/{test_id}', response_model=dict)
-async def delete_test(test_id: int):
-    result = delete_test_db(test_id)
+async def delete_test(test_id: int, db: AsyncSession = Depends(get_async_db)):
+    result = await delete_test_db(db, test_id)
     if result:
         logger.info(f"Тест с id {test_id} успешно удалён.")
         return {"status": 1, "message": f"Тест с id {test_id} удалён."}
@@ -78,8 +128,9 @@ async def delete_test(test_id: int):
 
 
 @test_router.put('/{test_id}', response_model=TestUpdate)
-async def update_test(test_id: int, data: TestUpdate):
-    result = change_test_db(
+async def update_test(test_id: int, data: TestUpdate, db: AsyncSession = Depends(get_async_db)):
+    result = await change_test_db(
+        db,
         test_id,
         question=data.question,
         var_1=data.var_1,
@@ -99,24 +150,29 @@ async def update_test(test_id: int, data: TestUpdate):
 
 
 @test_router.get('/', response_model=TestsResponse)
-async def get_all_tests():
-    tests = all_tests_db()
+async def get_all_tests(db: AsyncSession = Depends(get_async_db)):
+    tests = await all_tests_db(db)
     if tests:
         return {"status": 1, "message": tests}
     raise HTTPException(status_code=404, detail="Тесты не найдены")
 
 
 @test_router.get('/level/{level}', response_model=TestsResponse)
-async def get_tests_by_level(level: TestLevel):
-    tests = all_level_tests_db(level)
+async def get_tests_by_level(level: TestLevel, db: AsyncSession = Depends(get_async_db)):
+    tests = await all_level_tests_db(db, level)
     if tests:
         return {"status": 1, "message": tests}
     raise HTTPException(status_code=404, detail="Тесты не найдены.")
 
 
 @test_router.get('/train/{level}', response_model=TestsResponse)
-async def get_train_tests(level: TestLevel):
-    result = get_30_tests_train_db(level)
+async def get_train_tests(level: TestLevel, user_id: Optional[int] = Query(None),
+                          db: AsyncSession = Depends(get_async_db)):
+    # С user_id - интервальные повторения и слабые темы этого пользователя
+    if user_id is not None:
+        result = await adaptive_train_tests_db(db, user_id, level)
+    else:
+        result = await get_30_tests_train_db(db, level)
     if isinstance(result, str):
         logger.info(result)
         raise HTTPException(status_code=400, detail=result)
@@ -127,9 +183,23 @@ async def get_train_tests(level: TestLevel):
 async def get_exam_tests(
     num_level_1: int = Query(15, ge=0),
     num_level_2: int = Query(10, ge=0),
-    num_level_3: int = Query(5, ge=0)
+    num_level_3: int = Query(5, ge=0),
+    db: AsyncSession = Depends(get_async_db)
 ):
-    result = get_30_tests_exam_db(num_level_1, num_level_2, num_level_3)
+    result = await get_30_tests_exam_db(db, num_level_1, num_level_2, num_level_3)
+    if isinstance(result, str):
+        logger.info(result)
+        raise HTTPException(status_code=400, detail=result)
+    return {"status": 1, "message": result}
+
+
+@test_router.post('/exam', response_model=TestsResponse)
+async def assemble_exam(blueprint: ExamBlueprint, db: AsyncSession = Depends(get_async_db)):
+    total = sum(cell.count for cell in blueprint.cells)
+    if total > 200:
+        raise HTTPException(status_code=400, detail=f'Слишком много вопросов в экзамене: {total}, максимум 200')
+    result = await assemble_exam_db(db, [(cell.level, cell.test_type, cell.count) for cell in blueprint.cells],
+                                    blueprint.user_id, blueprint.exclude_recent_days)
     if isinstance(result, str):
         logger.info(result)
         raise HTTPException(status_code=400, detail=result)
@@ -1,17 +1,30 @@
-from fastapi import APIRouter, HTTPException, Query
-from pydantic import BaseModel
+from fastapi import APIRouter, HTTPException, Depends, Query
+from typing import Optional
+from pydantic import BaseModel, Field
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import get_async_db
 from database.userservice import *
+from database.rankingservice import *
 from logging_config import logger
 
 user_router = APIRouter(prefix="/ratings", tags=["Test Ratings"])
 
 
-class AnswerSubmission(BaseModel):
+class ExamAnswer(BaseModel):
     test_id: int
     timer: int
     user_response: str
 
 
+class AnswerSubmission(ExamAnswer):
+    user_id: int
+
+
+class ExamSubmission(BaseModel):
+    user_id: int
+    answers: list[ExamAnswer] = Field(..., min_length=1, max_length=500)
+
+
 class RatingCreate(BaseModel):
     correct_all: int
     category_objects_type1: int
@@ -26,26 +39,42 @@ class RatingCreate(BaseModel):
 
 
 @user_router.post("/answer")
-async def submit_answer(answer: AnswerSubmission):
-    result = user_get_answer_db(answer.test_id, answer.timer, answer.user_response)
+async def submit_answer(answer: AnswerSubmission, db: AsyncSession = Depends(get_async_db)):
+    result = await user_get_answer_db(db, answer.user_id, answer.test_id, answer.timer, answer.user_response)
     if result:
         return {"status": 1, "message": "Ответ сохранен."}
     logger.error(f"Ошибка при сохранении ответа для теста {answer.test_id}.")
     raise HTTPException(status_code=400, detail="Ошибка сохранения ответа.")
 
 
+@user_router.post("/answers")
+async def submit_answers(submission: ExamSubmission, db: AsyncSession = Depends(get_async_db)):
+    result = await user_get_answers_db(db, submission.user_id,
+                                       [answer.model_dump() for answer in submission.answers])
+    if result is None:
+        raise HTTPException(status_code=404, detail="Тест не найден, ответы не сохранены.")
+    if result:
+        return {"status": 1, "message": "Ответы сохранены.", "data": result}
+    logger.error("Ошибка при сохранении ответов экзамена.")
+    raise HTTPException(status_code=400, detail="Ошибка сохранения ответов.")
+
+
 @user_router.post("/test_rating")
-async def user_create_test_rating(rating_id: int):
-    result = user_create_test_rating_db(rating_id)
+async def user_create_test_rating(user_id: int,
+                                  submission_id: str = Query(..., description="submission_id из POST /ratings/answers"),
+                                  db: AsyncSession = Depends(get_async_db)):
+    result = await user_create_test_rating_db(db, user_id, submission_id)
+    if isinstance(result, str):
+        raise HTTPException(status_code=400, detail=result)
     if result:
-        return {"status": 1, "message": "Ответ сохранен."}
-    logger.error(f"Ошибка при сохранении ответа для теста {rating_id}.")
-    raise HTTPException(status_code=400, detail="Ошибка сохранения ответа.")
+        return {"status": 1, "message": "Рейтинг сохранен.", "data": result}
+    logger.error(f"Ошибка при создании рейтинга пользователя {user_id}.")
+    raise HTTPException(status_code=400, detail="Ошибка сохранения рейтинга.")
 
 
 @user_router.get("/user/{user_id}")
-async def get_user_ratings(user_id: int):
-    result = user_test_rating_db(user_id)
+async def get_user_ratings(user_id: int, db: AsyncSession = Depends(get_async_db)):
+    result = await user_test_rating_db(db, user_id)
     if isinstance(result, str):
         raise HTTPException(status_code=404, detail=result)
     return {"status": 1, "data": result}
@@ -54,8 +83,9 @@ async def get_user_ratings(user_id: int):
 @user_router.get("/user/{user_id}/{test_rating_id}/category")
 async def get_category_rating(user_id: int, test_rating_id: int,
                               level: str = Query(..., description="Уровень теста (например, objects, actions, skills)"),
-                              test_type: str = Query(..., description="Тип теста (например, type1, type2, type3)")):
-    result = user_category_test_rating_db(user_id, test_rating_id, level, test_type)
+                              test_type: str = Query(..., description="Тип теста (например, type1, type2, type3)"),
+                              db: AsyncSession = Depends(get_async_db)):
+    result = await user_category_test_rating_db(db, user_id, test_rating_id, level, test_type)
     if result is None:
         raise HTTPException(status_code=404, detail="Не найден рейтинг для данной категории.")
     return {"status": 1, "data": result}
@@ -64,17 +94,56 @@ async def get_category_rating(user_id: int, test_rating_id: int,
 @user_router.get("/user/{user_id}/average")
 async def get_user_average_rating(user_id: int,
                                   level: str = Query(..., description="Уровень теста"),
-                                  test_type: str = Query(..., description="Тип теста")):
-    result = user_all_tests_rating_db(user_id, level, test_type)
+                                  test_type: str = Query(..., description="Тип теста"),
+                                  db: AsyncSession = Depends(get_async_db)):
+    result = await user_all_tests_rating_db(db, user_id, level, test_type)
     if result is None:
         raise HTTPException(status_code=404, detail="Среднее значение рейтинга не найдено.")
     return {"status": 1, "data": result}
 
 
+@user_router.get("/user/{user_id}/averages")
+async def get_user_averages(user_id: int, db: AsyncSession = Depends(get_async_db)):
+    result = await user_rating_averages_db(db, user_id)
+    if result is None:
+        raise HTTPException(status_code=404, detail="Средние значения рейтинга не найдены.")
+    return {"status": 1, "data": result}
+
+
 @user_router.get("/all/average")
 async def get_all_users_average_rating(level: str = Query(..., description="Уровень теста"),
-                                       test_type: str = Query(..., description="Тип теста")):
-    result = all_users_tests_rating_db(level, test_type)
+                                       test_type: str = Query(..., description="Тип теста"),
+                                       db: AsyncSession = Depends(get_async_db)):
+    result = await all_users_tests_rating_db(db, level, test_type)
     if result is None:
         raise HTTPException(status_code=404, detail="Среднее значение рейтинга по всем пользователям не найдено.")
+    # Значение из сводки: freshness - когда она пересчитана
+    return {"status": 1, "data": result['average'], "ratings": result['ratings'], "freshness": result['freshness']}
+
+
+@user_router.get("/all/averages")
+async def get_all_users_averages(db: AsyncSession = Depends(get_async_db)):
+    result = await all_users_rating_averages_db(db)
+    if result is None:
+        raise HTTPException(status_code=404, detail="Средние значения рейтинга по всем пользователям не найдены.")
+    return {"status": 1, "data": result['averages'], "freshness": result['freshness']}
+
+
+@user_router.get("/user/{user_id}/percentiles")
+async def get_user_percentiles(user_id: int, db: AsyncSession = Depends(get_async_db)):
+    result = await user_percentiles_db(db, user_id)
+    if result is None:
+        raise HTTPException(status_code=404, detail="Результаты пользователя не найдены.")
+    return {"status": 1, "data": result}
+
+
+@user_router.get("/leaderboard")
+async def get_leaderboard(level: str = Query(..., description="Уровень теста"),
+                          test_type: str = Query(..., description="Тип теста"),
+                          limit: int = Query(10, ge=1, le=LEADERBOARD_MAX),
+                          school_class: Optional[int] = Query(None, description="Только этот класс"),
+                          db: AsyncSession = Depends(get_async_db)):
+    result = await leaderboard_db(db, level, test_type, limit, school_class)
+    if result is None:
+        raise HTTPException(status_code=404, detail="Таблица лидеров не найдена.")
     return {"status": 1, "data": result}
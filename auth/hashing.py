@@ -0,0 +1,190 @@
+import asyncio
+import math
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import bcrypt
+
+from config import hash_pool_kind, hash_pool_workers, bcrypt_rounds, bcrypt_rehash_slack
+from logging_config import logger
+
+
+# Функции ниже выполняются внутри воркеров пула, поэтому они должны быть
+# на уровне модуля (их нужно уметь передать в другой процесс).
+def _hash_job(password: str, rounds: int):
+    started_at = time.monotonic()
+    salt = bcrypt.gensalt(rounds=rounds)
+    hashed = bcrypt.hashpw(password.encode('utf-8'), salt)
+    return hashed.decode('utf-8'), started_at
+
+
+def _verify_job(password: str, hashed_password: str):
+    started_at = time.monotonic()
+    result = bcrypt.checkpw(password.encode('utf-8'), hashed_password.encode('utf-8'))
+    return result, started_at
+
+
+def hash_rounds(hashed_password: str) -> int:
+    # Формат bcrypt: $2b$<cost>$<salt+hash>
+    return int(hashed_password.split('$')[2])
+
+
+def calibrate_rounds(target_ms: float, min_rounds: int, max_rounds: int):
+    # Замер на минимальной стоимости (лучший из трёх); каждый следующий раунд
+    # удваивает время. Вызывается один раз скриптом scripts/calibrate_bcrypt.py,
+    # результат записывается в BCRYPT_ROUNDS и общий для всех воркеров
+    probe_ms = None
+    for _ in range(3):
+        probe_started = time.monotonic()
+        bcrypt.hashpw(b'calibration', bcrypt.gensalt(rounds=min_rounds))
+        elapsed_ms = (time.monotonic() - probe_started) * 1000
+        probe_ms = elapsed_ms if probe_ms is None else min(probe_ms, elapsed_ms)
+    probe_ms = max(probe_ms, 0.001)
+    rounds = min_rounds + round(math.log2(target_ms / probe_ms))
+    return min(max(rounds, min_rounds), max_rounds), probe_ms
+
+
+class PasswordHasher:
+    # Отдельный пул для bcrypt, чтобы проверка пароля не блокировала event loop.
+    # По умолчанию пул процессов, при невозможности его создать - пул потоков
+    # (bcrypt отпускает GIL, поэтому потоки тоже работают параллельно).
+
+    def __init__(self, kind: str = 'process', workers: int = 2, rounds: int = 12):
+        self.kind = kind
+        self.workers = max(1, workers)
+        self.rounds = rounds
+        self.rehashes = 0
+        self._executor = None
+        self._lock = threading.Lock()
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.in_flight = 0
+        self.max_queue_depth = 0
+        self.wait_ms_total = 0.0
+        self.wait_ms_max = 0.0
+        self.run_ms_total = 0.0
+
+    def _create_executor(self):
+        if self.kind == 'process':
+            try:
+                executor = ProcessPoolExecutor(max_workers=self.workers)
+                logger.info(f"Пул хеширования паролей: процессы, воркеров: {self.workers}")
+                return executor
+            except (OSError, NotImplementedError, ImportError):
+                logger.error("Не удалось создать пул процессов для bcrypt, используется пул потоков",
+                             exc_info=True)
+                self.kind = 'thread'
+        logger.info(f"Пул хеширования паролей: потоки, воркеров: {self.workers}")
+        return ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='bcrypt')
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = self._create_executor()
+            return self._executor
+
+    def _fallback_to_threads(self, broken):
+        with self._lock:
+            if self._executor is broken:
+                logger.error("Пул процессов bcrypt сломан, переключение на пул потоков")
+                broken.shutdown(wait=False)
+                self.kind = 'thread'
+                self._executor = self._create_executor()
+
+    def start(self):
+        self._get_executor()
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+    def queue_depth(self) -> int:
+        # Задачи сверх числа воркеров ждут своей очереди
+        return max(0, self.in_flight - self.workers)
+
+    async def run(self, job, *args):
+        loop = asyncio.get_running_loop()
+        executor = self._get_executor()
+        submitted_at = time.monotonic()
+        self.submitted += 1
+        self.in_flight += 1
+        self.max_queue_depth = max(self.max_queue_depth, self.queue_depth())
+        try:
+            try:
+                result, started_at = await loop.run_in_executor(executor, job, *args)
+            except BrokenProcessPool:
+                self._fallback_to_threads(executor)
+                result, started_at = await loop.run_in_executor(self._get_executor(), job, *args)
+        except Exception:
+            self.failed += 1
+            raise
+        finally:
+            self.in_flight -= 1
+        finished_at = time.monotonic()
+        wait_ms = max(0.0, started_at - submitted_at) * 1000
+        self.completed += 1
+        self.wait_ms_total += wait_ms
+        self.wait_ms_max = max(self.wait_ms_max, wait_ms)
+        self.run_ms_total += max(0.0, finished_at - started_at) * 1000
+        return result
+
+    def stats(self) -> dict:
+        completed = self.completed or 1
+        return {
+            'kind': self.kind,
+            'workers': self.workers,
+            'rounds': self.rounds,
+            'rehashes': self.rehashes,
+            'submitted': self.submitted,
+            'completed': self.completed,
+            'failed': self.failed,
+            'in_flight': self.in_flight,
+            'queue_depth': self.queue_depth(),
+            'max_queue_depth': self.max_queue_depth,
+            'wait_ms_avg': round(self.wait_ms_total / completed, 3),
+            'wait_ms_max': round(self.wait_ms_max, 3),
+            'run_ms_avg': round(self.run_ms_total / completed, 3),
+        }
+
+
+password_hasher = PasswordHasher(hash_pool_kind, hash_pool_workers, bcrypt_rounds)
+_rehash_tasks = set()
+
+
+async def hash_password_async(password: str) -> str:
+    return await password_hasher.run(_hash_job, password, password_hasher.rounds)
+
+
+async def verify_password_async(password: str, hashed_password: str) -> bool:
+    return await password_hasher.run(_verify_job, password, hashed_password)
+
+
+def needs_rehash(hashed_password: str) -> bool:
+    # Стоимость одна на все воркеры (BCRYPT_ROUNDS), хеш приводится к ней в обе стороны.
+    # Разница в BCRYPT_REHASH_SLACK раундов допускается, чтобы после перекалибровки
+    # на соседнее значение хеши не пересчитывались при каждом входе
+    return abs(hash_rounds(hashed_password) - password_hasher.rounds) > bcrypt_rehash_slack
+
+
+async def _rehash(password: str, old_hash: str, save):
+    try:
+        new_hash = await hash_password_async(password)
+        if await save(old_hash, new_hash):
+            password_hasher.rehashes += 1
+    except Exception:
+        logger.error("Ошибка при перехешировании пароля", exc_info=True)
+
+
+def rehash_in_background(password: str, old_hash: str, save):
+    # Вызывается после успешного входа: пароль в открытом виде есть только сейчас.
+    # await save(old_hash, new_hash) сохраняет новый хеш, если старый не успел измениться.
+    if not needs_rehash(old_hash):
+        return
+    task = asyncio.get_running_loop().create_task(_rehash(password, old_hash, save))
+    _rehash_tasks.add(task)
+    task.add_done_callback(_rehash_tasks.discard)
@@ -0,0 +1,156 @@
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from itertools import chain
+from typing import Optional
+
+from sqlalchemy import event, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from auth.token_cache import token_cache
+from config import principal_cache_max_size
+from database import AsyncSessionLocal
+from database.models import Admin, User
+
+
+# Снимок пользователя/админа, которого достаточно для авторизации.
+# Не ORM-объект, поэтому его можно безопасно отдавать между запросами и потоками.
+@dataclass(frozen=True)
+class PrincipalSnapshot:
+    role: str
+    id: int
+    number: str
+    first_name: Optional[str]
+    last_name: Optional[str]
+    is_blocked: bool = False
+    token_version: int = 0
+
+
+# Пользователь, восстановленный из claims токена без обращения к БД
+@dataclass(frozen=True)
+class TokenPrincipal:
+    role: str
+    id: int
+    number: str
+    token_version: int
+
+
+def make_snapshot(row) -> PrincipalSnapshot:
+    if isinstance(row, User):
+        return PrincipalSnapshot('user', row.id, row.number, row.user_first_name,
+                                 row.user_last_name, bool(row.is_blocked), row.token_version)
+    return PrincipalSnapshot('admin', row.id, row.number, row.admin_first_name,
+                             row.admin_last_name, token_version=row.token_version)
+
+
+class PrincipalCache:
+    # Кэш снимков по (role, number). Сбрасывается хуками сессии ниже при коммите
+    # любых изменений строк users/admins в этом процессе.
+
+    def __init__(self, max_size: int = 10000):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._numbers = {}
+        self._generation = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    async def get(self, role: str, number: str, db: Optional[AsyncSession] = None) -> Optional[PrincipalSnapshot]:
+        key = (role, number)
+        with self._lock:
+            snapshot = self._entries.get(key)
+            if snapshot is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return snapshot
+            self.misses += 1
+            generation = self._generation
+        snapshot = await self._load(role, number, db)
+        if snapshot is not None:
+            self._put(snapshot, generation)
+        return snapshot
+
+    @staticmethod
+    async def _load(role: str, number: str, db: Optional[AsyncSession] = None) -> Optional[PrincipalSnapshot]:
+        # В запросе загружаем через его сессию, чтобы не занимать второе соединение
+        model = User if role == 'user' else Admin
+        if db is None:
+            async with AsyncSessionLocal() as db:
+                row = await db.scalar(select(model).filter(model.number == number))
+        else:
+            row = await db.scalar(select(model).filter(model.number == number))
+        return make_snapshot(row) if row else None
+
+    def _put(self, snapshot: PrincipalSnapshot, generation: int):
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            # Пока шла загрузка, строку могли изменить - такой снимок не кэшируем
+            if generation != self._generation:
+                return
+            key = (snapshot.role, snapshot.number)
+            self._entries[key] = snapshot
+            self._entries.move_to_end(key)
+            self._numbers[(snapshot.role, snapshot.id)] = snapshot.number
+            while len(self._entries) > self.max_size:
+                old_key, old = self._entries.popitem(last=False)
+                self._numbers.pop((old.role, old.id), None)
+                self.evictions += 1
+
+    def invalidate(self, role: str, principal_id: int):
+        with self._lock:
+            self._generation += 1
+            number = self._numbers.pop((role, principal_id), None)
+            if number is not None and self._entries.pop((role, number), None) is not None:
+                self.invalidations += 1
+        token_cache.invalidate(role, principal_id)
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+            self._numbers.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+            }
+
+
+principal_cache = PrincipalCache(principal_cache_max_size)
+
+
+# Изменённые в сессии users/admins собираются при flush и сбрасываются из кэшей
+# только после успешного коммита (block_user_db, change_user_data_db и т.д.).
+@event.listens_for(Session, 'after_flush')
+def _collect_changed_principals(session, flush_context):
+    changed = session.info.setdefault('changed_principals', set())
+    for obj in chain(session.new, session.dirty, session.deleted):
+        if isinstance(obj, User):
+            changed.add(('user', obj.id))
+        elif isinstance(obj, Admin):
+            changed.add(('admin', obj.id))
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_changed_principals(session):
+    for role, principal_id in session.info.pop('changed_principals', ()):
+        principal_cache.invalidate(role, principal_id)
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _forget_changed_principals(session, previous_transaction):
+    if previous_transaction.parent is None:
+        session.info.pop('changed_principals', None)
@@ -0,0 +1,126 @@
+import math
+import threading
+import time
+from collections import OrderedDict
+
+from config import (login_window_seconds, login_max_attempts_per_ip,
+                    login_max_failures_per_number, login_throttle_max_keys)
+
+
+class SlidingWindowCounter:
+    # Скользящее окно по двум соседним фиксированным окнам: предыдущее окно
+    # учитывается с весом, убывающим по мере прохождения текущего.
+    # На ключ хранится три числа, число ключей ограничено, старые вытесняются первыми.
+
+    def __init__(self, limit: int, window_seconds: int, max_keys: int):
+        # При лимите 0 вход невозможен вовсе, а retry_after делил бы на ноль
+        if limit < 1:
+            raise ValueError(f"Лимит попыток должен быть не меньше 1, получено {limit}")
+        if window_seconds < 1:
+            raise ValueError(f"Окно должно быть не меньше 1 секунды, получено {window_seconds}")
+        self.limit = limit
+        self.window_seconds = window_seconds
+        self.max_keys = max_keys
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def _entry(self, key, now: float):
+        window = int(now // self.window_seconds)
+        entry = self._entries.get(key)
+        if entry is None:
+            return [window, 0, 0]
+        if entry[0] == window - 1:
+            return [window, entry[2], 0]
+        if entry[0] != window:
+            return [window, 0, 0]
+        return entry
+
+    def _estimate(self, entry, now: float) -> float:
+        elapsed = now / self.window_seconds - entry[0]
+        return entry[1] * (1 - elapsed) + entry[2]
+
+    def retry_after(self, key, now: float = None) -> int:
+        # Сколько секунд ждать, пока оценка не опустится ниже лимита (0 - можно сейчас)
+        now = time.time() if now is None else now
+        with self._lock:
+            window, previous, current = self._entry(key, now)
+        elapsed = now / self.window_seconds - window
+        if previous * (1 - elapsed) + current < self.limit:
+            return 0
+        if current < self.limit:
+            wait = (1 - (self.limit - current) / previous) - elapsed
+        else:
+            wait = (1 - elapsed) + (1 - self.limit / current)
+        return max(1, math.ceil(wait * self.window_seconds))
+
+    def hit(self, key, now: float = None):
+        now = time.time() if now is None else now
+        with self._lock:
+            entry = self._entry(key, now)
+            entry[2] += 1
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_keys:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def reset(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class LoginThrottle:
+    # Отсекает перебор паролей до проверки bcrypt: лимит на все попытки входа
+    # с одного IP и на неудачные попытки для одного номера.
+
+    def __init__(self, window_seconds: int, max_attempts_per_ip: int,
+                 max_failures_per_number: int, max_keys: int):
+        self.by_ip = SlidingWindowCounter(max_attempts_per_ip, window_seconds, max_keys)
+        self.by_number = SlidingWindowCounter(max_failures_per_number, window_seconds, max_keys)
+        self.allowed = 0
+        self.rejected_ip = 0
+        self.rejected_number = 0
+        self.failures = 0
+
+    def check(self, ip: str, number_key: str) -> int:
+        retry_ip = self.by_ip.retry_after(ip)
+        retry_number = self.by_number.retry_after(number_key)
+        if retry_ip:
+            self.rejected_ip += 1
+        elif retry_number:
+            self.rejected_number += 1
+        else:
+            self.allowed += 1
+            self.by_ip.hit(ip)
+        return max(retry_ip, retry_number)
+
+    def record_failure(self, number_key: str):
+        self.failures += 1
+        self.by_number.hit(number_key)
+
+    def record_success(self, number_key: str):
+        self.by_number.reset(number_key)
+
+    def stats(self) -> dict:
+        return {
+            'window_seconds': self.by_ip.window_seconds,
+            'ip_limit': self.by_ip.limit,
+            'number_limit': self.by_number.limit,
+            'allowed': self.allowed,
+            'rejected_ip': self.rejected_ip,
+            'rejected_number': self.rejected_number,
+            'failures': self.failures,
+            'tracked_ips': len(self.by_ip),
+            'tracked_numbers': len(self.by_number),
+            'max_keys': self.by_ip.max_keys,
+            'evicted_ips': self.by_ip.evictions,
+            'evicted_numbers': self.by_number.evictions,
+        }
+
+
+login_throttle = LoginThrottle(login_window_seconds, login_max_attempts_per_ip,
+                               login_max_failures_per_number, login_throttle_max_keys)
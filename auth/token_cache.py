@@ -0,0 +1,100 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from config import token_cache_max_size, token_cache_ttl_seconds
+
+
+class TokenCache:
+    # LRU-кэш расшифрованных access-токенов. Ключ - sha256 от токена (сам токен
+    # в памяти не храним), запись живёт до exp токена или ttl, что наступит раньше.
+
+    def __init__(self, max_size: int = 10000, ttl_seconds: int = 60):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._by_principal = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def digest(token: str) -> str:
+        return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+    def get(self, role: str, token: str):
+        key = (role, self.digest(token))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            principal, principal_key, expires_at = entry
+            if expires_at <= time.monotonic():
+                self._remove(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return principal
+
+    def put(self, role: str, token: str, principal, exp=None):
+        if self.max_size <= 0:
+            return
+        ttl = self.ttl_seconds
+        if exp is not None:
+            ttl = min(ttl, exp - time.time())
+        if ttl <= 0:
+            return
+        key = (role, self.digest(token))
+        principal_key = (role, principal.id)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (principal, principal_key, time.monotonic() + ttl)
+            self._by_principal.setdefault(principal_key, set()).add(key)
+            while len(self._entries) > self.max_size:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _remove(self, key):
+        principal, principal_key, expires_at = self._entries.pop(key)
+        keys = self._by_principal.get(principal_key)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._by_principal[principal_key]
+
+    def invalidate(self, role: str, principal_id: int) -> int:
+        # Вызывается при блокировке, удалении и изменении данных пользователя/админа
+        with self._lock:
+            keys = self._by_principal.pop((role, principal_id), set())
+            for key in keys:
+                self._entries.pop(key, None)
+            self.invalidations += len(keys)
+            return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._by_principal.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'ttl_seconds': self.ttl_seconds,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+            }
+
+
+token_cache = TokenCache(token_cache_max_size, token_cache_ttl_seconds)
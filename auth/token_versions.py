@@ -0,0 +1,136 @@
+import asyncio
+import threading
+import time
+from typing import Optional
+
+from sqlalchemy import event, select
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from config import token_version_refresh_seconds
+from database import AsyncSessionLocal
+from database.models import Admin, User
+from database.request_stats import background_run
+from logging_config import logger
+
+_MODELS = {'user': User, 'admin': Admin}
+
+
+class TokenVersionMap:
+    # Актуальные token_version всех пользователей и админов: (role, id) -> version.
+    # Изменения из этого процесса применяются сразу после коммита, изменения
+    # из других воркеров подтягиваются фоновым обновлением раз в refresh_seconds.
+
+    def __init__(self, refresh_seconds: int = 5):
+        self.refresh_seconds = refresh_seconds
+        self._versions = {}
+        self._lock = threading.Lock()
+        self.loaded_at = None
+        self.refreshes = 0
+        self.row_loads = 0
+        self.stale_rejections = 0
+
+    async def refresh(self):
+        versions = {}
+        async with AsyncSessionLocal() as db:
+            for role, model in _MODELS.items():
+                for principal_id, version in await db.execute(select(model.id, model.token_version)):
+                    versions[(role, principal_id)] = version
+        with self._lock:
+            # Версии только растут: не откатываем то, что успели применить локально
+            for key, version in versions.items():
+                current = self._versions.get(key)
+                if current is not None and current > version:
+                    versions[key] = current
+            self._versions = versions
+            self.loaded_at = time.time()
+            self.refreshes += 1
+
+    async def _load_one(self, role: str, principal_id: int, db: Optional[AsyncSession] = None) -> Optional[int]:
+        model = _MODELS[role]
+        query = select(model.token_version).filter(model.id == principal_id)
+        if db is None:
+            async with AsyncSessionLocal() as db:
+                row = (await db.execute(query)).first()
+        else:
+            row = (await db.execute(query)).first()
+        self.row_loads += 1
+        if row is None:
+            return None
+        with self._lock:
+            version = max(row[0], self._versions.get((role, principal_id), row[0]))
+            self._versions[(role, principal_id)] = version
+            return version
+
+    async def current(self, role: str, principal_id: int, db: Optional[AsyncSession] = None) -> Optional[int]:
+        version = self._versions.get((role, principal_id))
+        if version is None:
+            # Новый пользователь, зарегистрированный после последнего обновления
+            version = await self._load_one(role, principal_id, db)
+        return version
+
+    async def is_current(self, role: str, principal_id: int, token_version: int,
+                         db: Optional[AsyncSession] = None) -> bool:
+        version = await self.current(role, principal_id, db)
+        if version is None or token_version < version:
+            self.stale_rejections += 1
+            return False
+        return True
+
+    def apply(self, role: str, principal_id: int, version: Optional[int]):
+        with self._lock:
+            if version is None:
+                self._versions.pop((role, principal_id), None)
+            else:
+                current = self._versions.get((role, principal_id), version)
+                self._versions[(role, principal_id)] = max(current, version)
+
+    async def run_refresher(self):
+        while True:
+            try:
+                with background_run('token_versions'):
+                    await self.refresh()
+            except SQLAlchemyError:
+                logger.error("Ошибка при обновлении версий токенов", exc_info=True)
+            await asyncio.sleep(self.refresh_seconds)
+
+    def stats(self) -> dict:
+        return {
+            'size': len(self._versions),
+            'refresh_seconds': self.refresh_seconds,
+            'loaded_at': self.loaded_at,
+            'refreshes': self.refreshes,
+            'row_loads': self.row_loads,
+            'stale_rejections': self.stale_rejections,
+        }
+
+
+token_versions = TokenVersionMap(token_version_refresh_seconds)
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_token_versions(session, flush_context):
+    changed = session.info.setdefault('changed_token_versions', {})
+    for obj in session.dirty:
+        if isinstance(obj, User):
+            changed[('user', obj.id)] = obj.token_version
+        elif isinstance(obj, Admin):
+            changed[('admin', obj.id)] = obj.token_version
+    for obj in session.deleted:
+        if isinstance(obj, User):
+            changed[('user', obj.id)] = None
+        elif isinstance(obj, Admin):
+            changed[('admin', obj.id)] = None
+
+
+@event.listens_for(Session, 'after_commit')
+def _apply_token_versions(session):
+    for (role, principal_id), version in session.info.pop('changed_token_versions', {}).items():
+        token_versions.apply(role, principal_id, version)
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _forget_token_versions(session, previous_transaction):
+    if previous_transaction.parent is None:
+        session.info.pop('changed_token_versions', None)
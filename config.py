@@ -5,3 +5,47 @@ config_values = dotenv_values(".env")
 algorithm = config_values["ALGORITHM"]
 secret_key = config_values["SECRET_KEY"]
 access_token_exp_minutes = int(config_values["ACCESS_TOKEN_EXPIRE_MINUTES"])
+refresh_token_exp_days = int(config_values.get("REFRESH_TOKEN_EXPIRE_DAYS", 14))
+
+hash_pool_kind = config_values.get("HASH_POOL_KIND", "process")
+hash_pool_workers = int(config_values.get("HASH_POOL_WORKERS", 2))
+
+token_cache_max_size = int(config_values.get("TOKEN_CACHE_MAX_SIZE", 10000))
+token_cache_ttl_seconds = int(config_values.get("TOKEN_CACHE_TTL_SECONDS", 60))
+principal_cache_max_size = int(config_values.get("PRINCIPAL_CACHE_MAX_SIZE", 10000))
+token_version_refresh_seconds = int(config_values.get("TOKEN_VERSION_REFRESH_SECONDS", 5))
+# Как часто проверять версию банка вопросов, изменённую другими воркерами
+question_bank_refresh_seconds = float(config_values.get("QUESTION_BANK_REFRESH_SECONDS", 5))
+# Как часто пересчитывать средние по всем рейтингам (/ratings/all/average)
+rating_summary_refresh_seconds = float(config_values.get("RATING_SUMMARY_REFRESH_SECONDS", 60))
+
+login_window_seconds = int(config_values.get("LOGIN_WINDOW_SECONDS", 60))
+login_max_attempts_per_ip = int(config_values.get("LOGIN_MAX_ATTEMPTS_PER_IP", 30))
+login_max_failures_per_number = int(config_values.get("LOGIN_MAX_FAILURES_PER_NUMBER", 5))
+login_throttle_max_keys = int(config_values.get("LOGIN_THROTTLE_MAX_KEYS", 100000))
+
+bcrypt_rounds = int(config_values.get("BCRYPT_ROUNDS", 12))
+bcrypt_target_ms = float(config_values.get("BCRYPT_TARGET_MS", 100))
+bcrypt_min_rounds = int(config_values.get("BCRYPT_MIN_ROUNDS", 10))
+bcrypt_max_rounds = int(config_values.get("BCRYPT_MAX_ROUNDS", 14))
+bcrypt_rehash_slack = int(config_values.get("BCRYPT_REHASH_SLACK", 1))
+
+db_user = config_values.get("DB_USER", "postgres")
+db_password = config_values.get("DB_PASSWORD", "admin")
+db_host = config_values.get("DB_HOST", "localhost")
+db_port = config_values.get("DB_PORT", "5432")
+db_name = config_values.get("DB_NAME", "postgres")
+db_pool_size = int(config_values.get("DB_POOL_SIZE", 5))
+db_max_overflow = int(config_values.get("DB_MAX_OVERFLOW", 10))
+db_pool_timeout = float(config_values.get("DB_POOL_TIMEOUT", 30))
+db_pool_recycle = int(config_values.get("DB_POOL_RECYCLE", 1800))
+db_pool_pre_ping = config_values.get("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+# Асинхронные URI реплик через запятую (postgresql+asyncpg://...), пусто - без реплик
+db_replica_uris = [uri.strip() for uri in config_values.get("DB_REPLICA_URIS", "").split(",") if uri.strip()]
+db_sticky_seconds = float(config_values.get("DB_STICKY_SECONDS", 5))
+
+# В режиме отладки ответы получают заголовки X-SQL-Count и X-SQL-Time-ms
+debug = config_values.get("DEBUG", "false").lower() in ("1", "true", "yes")
+sql_slow_query_ms = float(config_values.get("SQL_SLOW_QUERY_MS", 200))
+sql_n_plus_one_threshold = int(config_values.get("SQL_N_PLUS_ONE_THRESHOLD", 5))
+slow_query_log_path = config_values.get("SLOW_QUERY_LOG_PATH", "slow_queries.log")
@@ -1,14 +1,51 @@
+from contextlib import asynccontextmanager
+
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.orm import declarative_base, sessionmaker
 
-DB_USER = "postgres"
-DB_PASSWORD = "admin"
-DB_HOST = "localhost"
-DB_PORT = "5432"
-DB_NAME = "postgres"
+from config import (db_user, db_password, db_host, db_port, db_name, db_pool_size,
+                    db_max_overflow, db_pool_timeout, db_pool_recycle, db_pool_pre_ping,
+                    db_replica_uris)
+from database import routing
+from database.pool_metrics import InstrumentedAsyncQueuePool, InstrumentedQueuePool, instrument_engine
+
+DB_USER = db_user
+DB_PASSWORD = db_password
+DB_HOST = db_host
+DB_PORT = db_port
+DB_NAME = db_name
 SQLALCHEMY_DATABASE_URI = f'postgresql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}'
-engine = create_engine(SQLALCHEMY_DATABASE_URI)
+SQLALCHEMY_ASYNC_DATABASE_URI = f'postgresql+asyncpg://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}'
+
+POOL_OPTIONS = {
+    'pool_size': db_pool_size,
+    'max_overflow': db_max_overflow,
+    'pool_timeout': db_pool_timeout,
+    'pool_recycle': db_pool_recycle,
+    'pool_pre_ping': db_pool_pre_ping,
+}
+
+# Синхронный движок остаётся для Alembic и скриптов
+engine = create_engine(SQLALCHEMY_DATABASE_URI, poolclass=InstrumentedQueuePool, **POOL_OPTIONS)
 SessionLocal = sessionmaker(bind=engine)
+instrument_engine(engine, 'sync')
+
+# Приложение работает через асинхронный движок, чтобы запросы не блокировали event loop
+async_engine = create_async_engine(SQLALCHEMY_ASYNC_DATABASE_URI, poolclass=InstrumentedAsyncQueuePool,
+                                   **POOL_OPTIONS)
+instrument_engine(async_engine.sync_engine, 'async')
+
+# Реплики только для чтения; какие запросы на них уходят, решает routing.RoutingSession
+replica_engines = []
+for index, replica_uri in enumerate(db_replica_uris):
+    replica_engine = create_async_engine(replica_uri, poolclass=InstrumentedAsyncQueuePool, **POOL_OPTIONS)
+    instrument_engine(replica_engine.sync_engine, f'replica_{index}')
+    replica_engines.append(replica_engine)
+routing.replica_engines[:] = [replica_engine.sync_engine for replica_engine in replica_engines]
+
+AsyncSessionLocal = async_sessionmaker(bind=async_engine, sync_session_class=routing.RoutingSession,
+                                       expire_on_commit=False)
 
 Base = declarative_base()
 
@@ -22,3 +59,25 @@ def get_db():
         raise
     finally:
         db.close()
+
+
+@asynccontextmanager
+async def unit_of_work():
+    # Одна сессия и одна транзакция: коммит при успехе, откат при любой ошибке.
+    # Соединение берётся из пула при первом запросе и возвращается при закрытии.
+    db = AsyncSessionLocal()
+    try:
+        yield db
+        await db.commit()
+    except BaseException:
+        await db.rollback()
+        raise
+    finally:
+        await db.close()
+
+
+async def get_async_db():
+    # Зависимость FastAPI кэшируется в пределах запроса, поэтому авторизация
+    # и эндпоинт получают одну и ту же сессию
+    async with unit_of_work() as db:
+        yield db
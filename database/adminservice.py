@@ -1,191 +1,236 @@
-from database import get_db
-from database.models import Admin, User, TestRating
+from sqlalchemy.ext.asyncio import AsyncSession
+from database.routing import replica_read
+from database.models import Admin, User, TestRating, UserRatingTotal
+from database.rankingservice import forget_user_scores_db
+from database.tokenservice import revoke_refresh_tokens_db
+from sqlalchemy import insert, select, update
 from sqlalchemy.exc import SQLAlchemyError
-import bcrypt
 from logging_config import logger
 
 
-def hash_password(password: str) -> str:
-    salt = bcrypt.gensalt(rounds=12)
-    hashed = bcrypt.hashpw(password.encode('utf-8'), salt)
-    return hashed.decode('utf-8')
-
-
-def admin_registration_db(admin_first_name, admin_last_name, number, password):
-    hashed_password = hash_password(password)
+# Пароль хешируется заранее, в пуле auth.hashing, чтобы не блокировать event loop
+async def admin_registration_db(db: AsyncSession, admin_first_name, admin_last_name, number,
+                                hashed_password):
     try:
-        with next(get_db()) as db:
-            logger.info(f"Проверка существования админа с номером: '{number}'")
-            existing_admin = db.query(Admin).filter_by(number=number).first()
-            if existing_admin:
-                logger.info(f"Админ с номером: {number} уже существует.")
-                return False
-            admin = Admin(
-                admin_first_name=admin_first_name,
-                admin_last_name=admin_last_name,
-                number=number,
-                password=hashed_password
-            )
-            db.add(admin)
-            db.commit()
-            logger.info(f"Регистрация админа {number} прошла успешно.")
-            return True
+        logger.info(f"Проверка существования админа с номером: '{number}'")
+        existing_admin = await db.scalar(select(Admin).filter_by(number=number))
+        if existing_admin:
+            logger.info(f"Админ с номером: {number} уже существует.")
+            return False
+        admin = Admin(
+            admin_first_name=admin_first_name,
+            admin_last_name=admin_last_name,
+            number=number,
+            password=hashed_password
+        )
+        db.add(admin)
+        await db.flush()
+        logger.info(f"Регистрация админа {number} прошла успешно.")
+        return True
     except SQLAlchemyError as e:
         logger.error("Error in admin_registration, performing rollback", exc_info=True)
-        db.rollback()
+        await db.rollback()
         return False
 
 
-def user_registration_db(user_first_name, user_last_name, number,
-                         par_first_name, par_last_name, par_number,
-                         birthday, school_class, university, group_number, password):
-    hashed_password = hash_password(password)
+async def user_registration_db(db: AsyncSession, user_first_name, user_last_name, number,
+                               par_first_name, par_last_name, par_number,
+                               birthday, school_class, university, group_number, hashed_password):
     try:
-        with next(get_db()) as db:
-            existing_user = db.query(User).filter_by(number=number).first()
-            if existing_user:
-                logger.info(f"Пользователь с номером {number} уже существует.")
-                return False
-            user = User(
-                user_first_name=user_first_name,
-                user_last_name=user_last_name,
-                number=number,
-                par_first_name=par_first_name,
-                par_last_name=par_last_name,
-                par_number=par_number,
-                birthday=birthday,
-                school_class=school_class,
-                university=university,
-                group_number=group_number,
-                password=hashed_password
-            )
-            db.add(user)
-            db.commit()
-            return True
+        existing_user = await db.scalar(select(User).filter_by(number=number))
+        if existing_user:
+            logger.info(f"Пользователь с номером {number} уже существует.")
+            return False
+        user = User(
+            user_first_name=user_first_name,
+            user_last_name=user_last_name,
+            number=number,
+            par_first_name=par_first_name,
+            par_last_name=par_last_name,
+            par_number=par_number,
+            birthday=birthday,
+            school_class=school_class,
+            university=university,
+            group_number=group_number,
+            password=hashed_password
+        )
+        db.add(user)
+        await db.flush()
+        return True
     except SQLAlchemyError as e:
         logger.error("Ошибка регистрации", exc_info=True)
-        db.rollback()
+        await db.rollback()
         return False
 
 
-def admin_delete_db(admin_id):
+async def existing_user_numbers_db(db: AsyncSession, numbers):
+    # Один запрос на всю пачку вместо проверки каждого номера отдельно
+    if not numbers:
+        return set()
+    result = await db.scalars(select(User.number).where(User.number.in_(numbers)))
+    return set(result)
+
+
+async def add_users_batch_db(db: AsyncSession, users):
+    # Пароли в users уже захешированы
     try:
-        with next(get_db()) as db:
-            admin = db.query(Admin).filter_by(id=admin_id).first()
-            if not admin:
-                logger.info(f"Админ с ID: {admin_id} не найден.")
-                return False
-            db.delete(admin)
-            db.commit()
-            return True
+        await db.execute(insert(User), users)
+        return True
+    except SQLAlchemyError as e:
+        logger.error("Ошибка пакетной регистрации пользователей", exc_info=True)
+        await db.rollback()
+        return False
+
+
+async def admin_delete_db(db: AsyncSession, admin_id):
+    try:
+        admin = await db.scalar(select(Admin).filter_by(id=admin_id))
+        if not admin:
+            logger.info(f"Админ с ID: {admin_id} не найден.")
+            return False
+        if not await revoke_refresh_tokens_db(db, "admin", admin_id):
+            return False
+        await db.delete(admin)
+        await db.flush()
+        return True
     except SQLAlchemyError as e:
         logger.error("Error in admin_delete, performing rollback", exc_info=True)
-        db.rollback()
+        await db.rollback()
         return False
 
 
-def user_delete_db(user_id):
+async def user_delete_db(db: AsyncSession, user_id):
     try:
-        with next(get_db()) as db:
-            user = db.query(User).filter_by(id=user_id).first()
-            if not user:
-                logger.info(f"Пользователь с ID: {user_id} не найден.")
-                return False
-            db.delete(user)
-            db.commit()
-            return True
+        user = await db.scalar(select(User).filter_by(id=user_id))
+        if not user:
+            logger.info(f"Пользователь с ID: {user_id} не найден.")
+            return False
+        await forget_user_scores_db(db, user_id)
+        if not await revoke_refresh_tokens_db(db, "user", user_id):
+            return False
+        await db.delete(user)
+        await db.flush()
+        return True
     except SQLAlchemyError as e:
         logger.error("Ошибка при удалении пользователя", exc_info=True)
-        db.rollback()
+        await db.rollback()
         return False
 
 
-def block_user_db(user_id):
+async def block_user_db(db: AsyncSession, user_id):
     try:
-        with next(get_db()) as db:
-            user = db.query(User).filter_by(id=user_id).first()
-            if not user:
-                logger.info(f"Пользователь с ID: {user_id} не найден.")
-                return False
-            user.is_blocked = True
-            db.commit()
-            return True
+        user = await db.scalar(select(User).filter_by(id=user_id))
+        if not user:
+            logger.info(f"Пользователь с ID: {user_id} не найден.")
+            return False
+        user.is_blocked = True
+        # Выданные ранее токены перестают приниматься, refresh-токены отзываются
+        user.token_version += 1
+        if not await revoke_refresh_tokens_db(db, "user", user_id):
+            return False
+        await db.flush()
+        return True
     except SQLAlchemyError as e:
         logger.error("Ошибка во время блокировки пользователя", exc_info=True)
-        db.rollback()
+        await db.rollback()
         return False
 
 
-def unblock_user_db(user_id):
+async def unblock_user_db(db: AsyncSession, user_id):
     try:
-        with next(get_db()) as db:
-            user = db.query(User).filter_by(id=user_id).first()
-            if not user:
-                logger.info(f"Пользователь с ID: {user_id} для разблокировки не найден.")
-                return False
-            user.is_blocked = False
-            db.commit()
-            return True
+        user = await db.scalar(select(User).filter_by(id=user_id))
+        if not user:
+            logger.info(f"Пользователь с ID: {user_id} для разблокировки не найден.")
+            return False
+        user.is_blocked = False
+        await db.flush()
+        return True
     except SQLAlchemyError as e:
         logger.error("Ошибка во время разблокировки пользователя", exc_info=True)
-        db.rollback()
+        await db.rollback()
         return False
 
 
-def change_user_data_db(user_id, user_first_name=None, user_last_name=None,
-                        number=None, par_first_name=None, par_last_name=None,
-                        par_number=None, birthday=None, school_class=None,
-                        university=None, group_number=None):
+async def change_user_data_db(db: AsyncSession, user_id, user_first_name=None, user_last_name=None,
+                              number=None, par_first_name=None, par_last_name=None,
+                              par_number=None, birthday=None, school_class=None,
+                              university=None, group_number=None):
     try:
-        with next(get_db()) as db:
-            user = db.query(User).filter_by(id=user_id).first()
-            if not user:
-                logger.info(f"Пользователь с ID: {user_id} для обновления данных не найден.")
+        user = await db.scalar(select(User).filter_by(id=user_id))
+        if not user:
+            logger.info(f"Пользователь с ID: {user_id} для обновления данных не найден.")
+            return False
+        user_change_data = {
+            'user_first_name': user_first_name,
+            'user_last_name': user_last_name,
+            'number': number,
+            'par_first_name': par_first_name,
+            'par_last_name': par_last_name,
+            'par_number': par_number,
+            'birthday': birthday,
+            'school_class': school_class,
+            'university': university,
+            'group_number': group_number
+        }
+        if number is not None and number != user.number:
+            user.token_version += 1
+            if not await revoke_refresh_tokens_db(db, "user", user_id):
                 return False
-            user_change_data = {
-                'user_first_name': user_first_name,
-                'user_last_name': user_last_name,
-                'number': number,
-                'par_first_name': par_first_name,
-                'par_last_name': par_last_name,
-                'par_number': par_number,
-                'birthday': birthday,
-                'school_class': school_class,
-                'university': university,
-                'group_number': group_number
-            }
-            for key, value in user_change_data.items():
-                if value is not None:
-                    setattr(user, key, value)
-            db.commit()
-            return True
+        if school_class is not None and school_class != user.school_class:
+            # Копия класса для таблиц лидеров по классу
+            await db.execute(update(UserRatingTotal).where(UserRatingTotal.user_id == user_id)
+                             .values(school_class=school_class))
+        for key, value in user_change_data.items():
+            if value is not None:
+                setattr(user, key, value)
+        await db.flush()
+        return True
     except SQLAlchemyError as e:
         logger.error("Ошибка при обновлении данных пользователя", exc_info=True)
-        db.rollback()
+        await db.rollback()
         return False
 
 
-def change_admin_data_db(admin_id, admin_first_name=None, admin_last_name=None,
-                         number=None):
+async def change_admin_data_db(db: AsyncSession, admin_id, admin_first_name=None,
+                               admin_last_name=None, number=None):
     try:
-        with next(get_db()) as db:
-            admin = db.query(Admin).filter_by(id=admin_id).first()
-            if not admin:
-                logger.info(f"Админ с ID: {admin_id} для обновления данных не найден.")
+        admin = await db.scalar(select(Admin).filter_by(id=admin_id))
+        if not admin:
+            logger.info(f"Админ с ID: {admin_id} для обновления данных не найден.")
+            return False
+        admin_change_data = {
+            'admin_first_name': admin_first_name,
+            'admin_last_name': admin_last_name,
+            'number': number
+        }
+        if number is not None and number != admin.number:
+            admin.token_version += 1
+            if not await revoke_refresh_tokens_db(db, "admin", admin_id):
                 return False
-            admin_change_data = {
-                'admin_first_name': admin_first_name,
-                'admin_last_name': admin_last_name,
-                'number': number
-            }
-            for key, value in admin_change_data.items():
-                if value is not None:
-                    setattr(admin, key, value)
-            db.commit()
-            return True
+        for key, value in admin_change_data.items():
+            if value is not None:
+                setattr(admin, key, value)
+        await db.flush()
+        return True
     except SQLAlchemyError as e:
         logger.error("Ошибка при обновлении данных админа", exc_info=True)
-        db.rollback()
+        await db.rollback()
+        return False
+
+
+async def rehash_password_db(db: AsyncSession, model, principal_id, old_hash, new_hash):
+    # Обновляем хеш, только если пароль не поменяли, пока считался новый хеш
+    try:
+        result = await db.execute(
+            update(model)
+            .where(model.id == principal_id, model.password == old_hash)
+            .values(password=new_hash)
+        )
+        await db.flush()
+        return result.rowcount == 1
+    except SQLAlchemyError as e:
+        logger.error("Ошибка при перехешировании пароля", exc_info=True)
+        await db.rollback()
         return False
 
 
@@ -196,20 +241,18 @@ def serialize_total_rating_db(total_rating):
         return {col.name: getattr(total_rating, col.name) for col in total_rating.__table__.columns}
 
 
-def get_user_test_statistic_db(total_rating_id):
-    with next(get_db()) as db:
-        test_statistic = db.query(TestRating).filter_by(id=total_rating_id).first()
-        return serialize_total_rating_db(test_statistic) if test_statistic else {}
+async def get_user_test_statistic_db(db: AsyncSession, total_rating_id):
+    test_statistic = await db.scalar(select(TestRating).filter_by(id=total_rating_id))
+    return serialize_total_rating_db(test_statistic) if test_statistic else {}
 
 
-def get_user_statistic_db(user_id):
-    with next(get_db()) as db:
-        user_statistic = db.query(TestRating).filter_by(user_id=user_id).first()
-        return serialize_total_rating_db(user_statistic) if user_statistic else {}
+async def get_user_statistic_db(db: AsyncSession, user_id):
+    user_statistic = await db.scalar(select(TestRating).filter_by(user_id=user_id))
+    return serialize_total_rating_db(user_statistic) if user_statistic else {}
 
 
-def get_full_statistic_db():
-    with next(get_db()) as db:
-        full_statistic = db.query(TestRating).all()
-        return [serialize_total_rating_db(stat) for stat in full_statistic]
+@replica_read
+async def get_full_statistic_db(db: AsyncSession):
+    full_statistic = (await db.scalars(select(TestRating))).all()
+    return [serialize_total_rating_db(stat) for stat in full_statistic]
     
\ No newline at end of file
@@ -1,6 +1,6 @@
 from datetime import datetime
 from sqlalchemy import (
-    Column, Integer, String, Boolean, ForeignKey, DateTime, Enum as SAEnum
+    Column, Integer, BigInteger, String, Boolean, ForeignKey, DateTime, Index, Enum as SAEnum
 )
 import enum
 from sqlalchemy.orm import relationship
@@ -29,6 +29,7 @@ class Admin(Base):
     admin_last_name = Column(String)
     number = Column(String, unique=True)
     password = Column(String)
+    token_version = Column(Integer, default=0, server_default='0', nullable=False)
     reg_date = Column(DateTime, default=datetime.now())
 
 
@@ -48,6 +49,7 @@ class User(Base):
     group_number = Column(String, nullable=True)
     password = Column(String)
     is_blocked = Column(Boolean, default=False)
+    token_version = Column(Integer, default=0, server_default='0', nullable=False)
     reg_date = Column(DateTime, default=datetime.now())
 
     test_attempts = relationship(
@@ -80,6 +82,12 @@ class Test(Base):
     level = Column(SAEnum(TestLevel), default=TestLevel.LEVEL_1)
     test_type = Column(SAEnum(TestType), default=TestType.TYPE_1)
 
+    # Выборки по уровню упорядочены по id (экзамен берёт первые N тестов уровня)
+    __table_args__ = (
+        Index('ix_tests_level_id', 'level', 'id'),
+        Index('ix_tests_level_test_type', 'level', 'test_type'),
+    )
+
     test_attempts = relationship(
         "TestAttempt",
         back_populates="test",
@@ -90,20 +98,54 @@ class Test(Base):
         back_populates="test",
         cascade="all, delete-orphan"
     )
+    attempt_total = relationship(
+        "TestAttemptTotal",
+        cascade="all, delete-orphan",
+        uselist=False
+    )
+
+
+# Версия банка вопросов (одна строка). Увеличивается в той же транзакции, что и
+# любое изменение tests, по ней воркеры узнают, что кэш вопросов устарел.
+class QuestionBankVersion(Base):
+    __tablename__ = 'question_bank_version'
+    id = Column(Integer, primary_key=True)
+    version = Column(Integer, default=0, server_default='0', nullable=False)
+
+
+# Сколько всего попыток по тесту у всех пользователей. Строка создаётся вместе с тестом
+# и увеличивается вместе со счётчиками user_test_counters; уровень продублирован из tests,
+# чтобы «наименее решаемые тесты уровня» читались из одного индекса.
+class TestAttemptTotal(Base):
+    __tablename__ = 'test_attempt_totals'
+    test_id = Column(
+        Integer,
+        ForeignKey('tests.id', ondelete="CASCADE"),
+        primary_key=True
+    )
+    level = Column(SAEnum(TestLevel), nullable=False)
+    attempt_count = Column(Integer, default=0, server_default='0', nullable=False)
+
+    __table_args__ = (
+        Index('ix_test_attempt_totals_level_count', 'level', 'attempt_count', 'test_id'),
+    )
 
 
+# Журнал попыток: строка на каждый ответ, attempt_number берётся из user_test_counters
 class TestAttempt(Base):
     __tablename__ = 'test_attempts'
     id = Column(Integer, autoincrement=True, primary_key=True)
     user_id = Column(
         Integer,
         ForeignKey('users.id', ondelete="CASCADE"),
-        nullable=False
+        nullable=False,
+        index=True
     )
     test_id = Column(
         Integer,
         ForeignKey('tests.id', ondelete="CASCADE"),
-        nullable=False
+        nullable=False,
+        index=True
     )
     attempt_number = Column(Integer, default=1, nullable=False)
     created_at = Column(DateTime, default=datetime.now)
@@ -112,6 +154,63 @@ class TestAttempt(Base):
     test = relationship("Test", back_populates="test_attempts")
 
 
+# Счётчик попыток: одна строка на пару (пользователь, тест), attempt_number - номер
+# последней выданной попытки. Увеличивается upsert ... RETURNING при сохранении ответа
+class UserTestCounter(Base):
+    __tablename__ = 'user_test_counters'
+    user_id = Column(
+        Integer,
+        ForeignKey('users.id', ondelete="CASCADE"),
+        primary_key=True
+    )
+    test_id = Column(
+        Integer,
+        ForeignKey('tests.id', ondelete="CASCADE"),
+        primary_key=True,
+        index=True
+    )
+    attempt_number = Column(Integer, default=0, server_default='0', nullable=False)
+    last_attempt_at = Column(DateTime, default=datetime.now)
+
+
+# Состояние интервального повторения вопроса у пользователя (database/trainerservice.py):
+# box - ячейка Лейтнера, review_due - unix-время следующего повтора. Уровень вопроса
+# не копируется - выборка по уровню соединяется с tests по первичному ключу
+class UserReviewState(Base):
+    __tablename__ = 'user_review_states'
+    user_id = Column(
+        Integer,
+        ForeignKey('users.id', ondelete="CASCADE"),
+        primary_key=True
+    )
+    test_id = Column(
+        Integer,
+        ForeignKey('tests.id', ondelete="CASCADE"),
+        primary_key=True,
+        index=True
+    )
+    box = Column(Integer, default=0, server_default='0', nullable=False)
+    review_due = Column(Integer, default=0, server_default='0', nullable=False)
+
+    __table_args__ = (
+        Index('ix_user_review_states_user_due', 'user_id', 'review_due'),
+    )
+
+
+# Ответы пользователя по ячейкам (уровень, тип): из них тренажёр считает слабые темы
+class UserSkillStat(Base):
+    __tablename__ = 'user_skill_stats'
+    user_id = Column(
+        Integer,
+        ForeignKey('users.id', ondelete="CASCADE"),
+        primary_key=True
+    )
+    level = Column(SAEnum(TestLevel), primary_key=True)
+    test_type = Column(SAEnum(TestType), primary_key=True)
+    answered = Column(Integer, default=0, server_default='0', nullable=False)
+    correct = Column(Integer, default=0, server_default='0', nullable=False)
+
+
 class UserAnswer(Base):
     __tablename__ = 'user_answers'
     id = Column(Integer, autoincrement=True, primary_key=True)
@@ -130,7 +229,15 @@ class UserAnswer(Base):
     )
     rating_id = Column(
         Integer,
-        ForeignKey('test_rating.id', ondelete="CASCADE")
+        ForeignKey('test_rating.id', ondelete="CASCADE"),
+        index=True
+    )
+    # Общий для всех ответов одного экзамена (POST /ratings/answers), у тренировочных - NULL
+    submission_id = Column(String(32), nullable=True)
+
+    # Ответы экзамена для рейтинга; префикс user_id покрывает выборки по пользователю
+    __table_args__ = (
+        Index('ix_user_answers_user_submission', 'user_id', 'submission_id'),
     )
 
     user = relationship("User", back_populates="answers")
@@ -154,7 +261,8 @@ class TestRating(Base):
     updated_at = Column(DateTime, default=datetime.now(), onupdate=datetime.now())
     user_id = Column(
         Integer,
-        ForeignKey('users.id', ondelete="CASCADE")
+        ForeignKey('users.id', ondelete="CASCADE"),
+        index=True
     )
 
     user = relationship("User", back_populates="ratings")
@@ -163,3 +271,62 @@ class TestRating(Base):
         back_populates="rating",
         cascade="all, delete-orphan"
     )
+
+
+# Суммы и количества значений test_rating по пользователю: одна строка на колонку
+# рейтинга (metric - имя колонки category_* или time). Ведётся вместе с вставкой
+# рейтинга, поэтому среднее - чтение одной строки по первичному ключу.
+class UserRatingTotal(Base):
+    __tablename__ = 'user_rating_totals'
+    user_id = Column(
+        Integer,
+        ForeignKey('users.id', ondelete="CASCADE"),
+        primary_key=True
+    )
+    metric = Column(String(32), primary_key=True)
+    total = Column(BigInteger, default=0, server_default='0', nullable=False)
+    count = Column(Integer, default=0, server_default='0', nullable=False)
+    # Лучший результат по колонке category_* (для time не ведётся) и копия
+    # users.school_class для таблиц лидеров по классу (database/rankingservice.py)
+    best = Column(Integer, nullable=True)
+    school_class = Column(Integer, nullable=True)
+
+    __table_args__ = (
+        Index('ix_user_rating_totals_leaderboard', 'metric', best.desc(), 'user_id'),
+        Index('ix_user_rating_totals_class_leaderboard', 'metric', 'school_class', best.desc(), 'user_id'),
+    )
+
+
+# Гистограмма лучших результатов: сколько пользователей имеют лучший результат
+# score по колонке metric. Ведётся вместе с user_rating_totals.best
+class RatingScoreCount(Base):
+    __tablename__ = 'rating_score_counts'
+    metric = Column(String(32), primary_key=True)
+    score = Column(Integer, primary_key=True)
+    users = Column(Integer, default=0, server_default='0', nullable=False)
+
+
+# Сумма и количество значений колонки test_rating по всем пользователям на момент
+# refreshed_at; пересчитывается по расписанию (database/rating_summary.py)
+class RatingSummaryRow(Base):
+    __tablename__ = 'rating_summary'
+    metric = Column(String(32), primary_key=True)
+    total = Column(BigInteger, default=0, server_default='0', nullable=False)
+    count = Column(Integer, default=0, server_default='0', nullable=False)
+    refreshed_at = Column(DateTime, nullable=False)
+
+
+# Refresh-токены хранятся только в виде sha256-хеша. Все токены, полученные
+# ротацией из одного входа, относятся к одному семейству (family_id).
+# Все времена токена - в UTC (datetime.utcnow), как и срок действия.
+class RefreshToken(Base):
+    __tablename__ = 'refresh_tokens'
+    id = Column(Integer, autoincrement=True, primary_key=True)
+    token_hash = Column(String(64), unique=True, nullable=False)
+    family_id = Column(String(32), index=True, nullable=False)
+    role = Column(String, nullable=False)
+    principal_id = Column(Integer, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    expires_at = Column(DateTime, nullable=False)
+    revoked_at = Column(DateTime, nullable=True)
+    replaced_by_id = Column(Integer, nullable=True)
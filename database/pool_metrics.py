@@ -0,0 +1,114 @@
+import bisect
+import threading
+import time
+
+from sqlalchemy import event
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+
+class PoolMetrics:
+    # Счётчики пула соединений: события пула SQLAlchemy плюс гистограмма
+    # времени ожидания соединения (от запроса до выдачи готового соединения).
+    BUCKETS_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+    def __init__(self, name: str):
+        self.name = name
+        self.pool = None
+        self._lock = threading.Lock()
+        self.created = 0
+        self.closed = 0
+        self.invalidated = 0
+        self.soft_invalidated = 0
+        self.checkouts = 0
+        self.checkins = 0
+        self.timeouts = 0
+        self.wait_ms_total = 0.0
+        self.wait_ms_max = 0.0
+        self.wait_histogram = [0] * (len(self.BUCKETS_MS) + 1)
+
+    def observe_wait(self, wait_ms: float):
+        with self._lock:
+            self.wait_histogram[bisect.bisect_left(self.BUCKETS_MS, wait_ms)] += 1
+            self.wait_ms_total += wait_ms
+            self.wait_ms_max = max(self.wait_ms_max, wait_ms)
+
+    def _count(self, attr: str):
+        with self._lock:
+            setattr(self, attr, getattr(self, attr) + 1)
+
+    def attach(self, pool):
+        self.pool = pool
+        pool.metrics = self
+        event.listen(pool, 'connect', lambda *args: self._count('created'))
+        event.listen(pool, 'close', lambda *args: self._count('closed'))
+        event.listen(pool, 'invalidate', lambda *args: self._count('invalidated'))
+        event.listen(pool, 'soft_invalidate', lambda *args: self._count('soft_invalidated'))
+        event.listen(pool, 'checkout', lambda *args: self._count('checkouts'))
+        event.listen(pool, 'checkin', lambda *args: self._count('checkins'))
+
+    def stats(self) -> dict:
+        pool = self.pool
+        with self._lock:
+            histogram = {f'le_{bound}ms': count for bound, count in zip(self.BUCKETS_MS, self.wait_histogram)}
+            histogram['inf'] = self.wait_histogram[-1]
+            waits = sum(self.wait_histogram)
+            return {
+                'name': self.name,
+                'size': pool.size() if pool is not None else None,
+                'checked_out': pool.checkedout() if pool is not None else None,
+                'checked_in': pool.checkedin() if pool is not None else None,
+                'overflow': pool.overflow() if pool is not None else None,
+                'created': self.created,
+                'closed': self.closed,
+                'invalidated': self.invalidated,
+                'soft_invalidated': self.soft_invalidated,
+                'checkouts': self.checkouts,
+                'checkins': self.checkins,
+                'timeouts': self.timeouts,
+                'wait_ms_avg': round(self.wait_ms_total / waits, 3) if waits else 0.0,
+                'wait_ms_max': round(self.wait_ms_max, 3),
+                'wait_histogram': histogram,
+            }
+
+
+class _InstrumentedPoolMixin:
+    # Событий «начали ждать соединение» у пула нет, поэтому ожидание
+    # измеряется вокруг connect(); события connect/checkout идут через attach()
+
+    def connect(self):
+        started = time.perf_counter()
+        try:
+            return super().connect()
+        except PoolTimeoutError:
+            if getattr(self, 'metrics', None) is not None:
+                self.metrics._count('timeouts')
+            raise
+        finally:
+            if getattr(self, 'metrics', None) is not None:
+                self.metrics.observe_wait((time.perf_counter() - started) * 1000)
+
+    def recreate(self):
+        pool = super().recreate()
+        if getattr(self, 'metrics', None) is not None:
+            self.metrics.pool = pool
+            pool.metrics = self.metrics
+        return pool
+
+
+class InstrumentedQueuePool(_InstrumentedPoolMixin, QueuePool):
+    pass
+
+
+class InstrumentedAsyncQueuePool(_InstrumentedPoolMixin, AsyncAdaptedQueuePool):
+    pass
+
+
+pool_metrics = {}
+
+
+def instrument_engine(engine, name: str) -> PoolMetrics:
+    metrics = PoolMetrics(name)
+    metrics.attach(engine.pool)
+    pool_metrics[name] = metrics
+    return metrics
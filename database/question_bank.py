@@ -0,0 +1,263 @@
+import asyncio
+import math
+import random
+import sys
+import threading
+import time
+from dataclasses import dataclass, fields
+from typing import Optional
+
+from sqlalchemy import event, select, update
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from config import question_bank_refresh_seconds
+from database import AsyncSessionLocal
+from database.models import QuestionBankVersion, Test, TestLevel, TestType
+from database.request_stats import background_run
+from logging_config import logger
+
+
+# Вопрос из кэша. Не ORM-объект, поэтому один экземпляр отдаётся всем запросам.
+@dataclass(frozen=True, slots=True)
+class QuestionSnapshot:
+    id: int
+    question: str
+    var_1: str
+    var_2: str
+    var_3: str
+    var_4: str
+    correct_answer: str
+    timer: int
+    level: TestLevel
+    test_type: TestType
+
+
+class BankSnapshot:
+    # Неизменяемый снимок банка: при пересборке подменяется целиком, поэтому
+    # читатель, взявший ссылку, видит согласованные индексы
+
+    def __init__(self, version: int, questions):
+        self.version = version
+        self.all = tuple(questions)
+        self.by_id = {question.id: question for question in self.all}
+        by_level, by_level_type = {}, {}
+        for question in self.all:
+            by_level.setdefault(question.level, []).append(question)
+            by_level_type.setdefault((question.level, question.test_type), []).append(question)
+        self.by_level = {level: tuple(questions) for level, questions in by_level.items()}
+        self.by_level_type = {key: tuple(questions) for key, questions in by_level_type.items()}
+        # Множества id по ячейкам: пересечение с исключёнными считается в C
+        self.ids_by_level = {level: frozenset(question.id for question in questions)
+                             for level, questions in self.by_level.items()}
+        self.ids_by_level_type = {key: frozenset(question.id for question in questions)
+                                  for key, questions in self.by_level_type.items()}
+        self.memory_bytes = self._memory_bytes()
+
+    def level(self, level) -> tuple:
+        return self.by_level.get(TestLevel(level), ())
+
+    def level_type(self, level, test_type) -> tuple:
+        return self.by_level_type.get((TestLevel(level), TestType(test_type)), ())
+
+    def cell(self, level, test_type=None) -> tuple:
+        # Ячейка бланка экзамена: уровень и тип, либо весь уровень
+        return self.level(level) if test_type is None else self.level_type(level, test_type)
+
+    def cell_ids(self, level, test_type=None) -> frozenset:
+        if test_type is None:
+            return self.ids_by_level.get(TestLevel(level), frozenset())
+        return self.ids_by_level_type.get((TestLevel(level), TestType(test_type)), frozenset())
+
+    def sample(self, level, test_type, count: int, exclude=frozenset()) -> list:
+        # Равномерная выборка без повторов, без прохода по ячейке. Берём случайный набор
+        # с запасом на исключённые и отбрасываем их: первые count оставшихся - равномерная
+        # выборка из неисключённых. Запас считается по доле исключённых в ячейке; если
+        # его не хватило, берём с запасом на все исключённые. Если и так вопросов мало,
+        # недостающее добирается из исключённых (недавно виденное лучше, чем неполный экзамен).
+        questions = self.cell(level, test_type)
+        excluded = len(exclude & self.cell_ids(level, test_type)) if exclude else 0
+        if not excluded:
+            return random.sample(questions, min(len(questions), count))
+        fresh_share = 1 - excluded / len(questions)
+        size = count + excluded
+        if fresh_share > 0:
+            size = min(size, math.ceil((count + 2) / fresh_share * 1.25))
+        drawn = random.sample(questions, min(len(questions), size))
+        fresh = [question for question in drawn if question.id not in exclude]
+        if len(fresh) < count and size < count + excluded:
+            drawn = random.sample(questions, min(len(questions), count + excluded))
+            fresh = [question for question in drawn if question.id not in exclude]
+        if len(fresh) < count:
+            fresh += [question for question in drawn if question.id in exclude][:count - len(fresh)]
+        return fresh[:count]
+
+    def _memory_bytes(self) -> int:
+        # Оценка: снимки вопросов со строками плюс контейнеры индексов
+        # (enum-значения общие и не учитываются)
+        size = sys.getsizeof(self.all) + sys.getsizeof(self.by_id)
+        for index in (self.by_level, self.by_level_type, self.ids_by_level, self.ids_by_level_type):
+            size += sys.getsizeof(index) + sum(sys.getsizeof(questions) for questions in index.values())
+        for question in self.all:
+            size += sys.getsizeof(question)
+            size += sum(sys.getsizeof(getattr(question, field.name)) for field in fields(question)
+                        if isinstance(getattr(question, field.name), str))
+        return size
+
+
+class QuestionBank:
+    # Весь банк вопросов в памяти процесса. Изменения из этого процесса
+    # сбрасывают снимок сразу после коммита (хуки ниже), изменения из других
+    # воркеров замечаются фоновой проверкой версии раз в refresh_seconds.
+    # Проверка ответов (current) сверяет версию с базой на каждый запрос.
+
+    def __init__(self, refresh_seconds: float = 5):
+        self.refresh_seconds = refresh_seconds
+        self._snapshot: Optional[BankSnapshot] = None
+        self._generation = 0
+        self._lock = threading.Lock()
+        # Одна загрузка таблицы на воркер: одновременные промахи ждут её, а не читают tests каждый
+        self._rebuild_lock = asyncio.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.rebuilds = 0
+        self.invalidations = 0
+        self.version_checks = 0
+        self.loaded_at = None
+        self.rebuild_ms_last = None
+        self.rebuild_ms_max = 0.0
+
+    async def get(self, db: Optional[AsyncSession] = None) -> BankSnapshot:
+        snapshot = self._snapshot
+        if snapshot is not None:
+            self.hits += 1
+            return snapshot
+        self.misses += 1
+        async with self._rebuild_lock:
+            snapshot = self._snapshot
+            if snapshot is not None:
+                return snapshot
+            return await self.rebuild(db)
+
+    async def current(self, db: AsyncSession) -> BankSnapshot:
+        # Снимок, сверенный с версией в базе (чтение по первичному ключу): для проверки
+        # ответов правка вопроса в другом воркере видна сразу, а не через refresh_seconds
+        snapshot = await self.get(db)
+        version = await db.scalar(select(QuestionBankVersion.version).filter_by(id=1)) or 0
+        self.version_checks += 1
+        if snapshot.version == version:
+            return snapshot
+        self._discard(snapshot)
+        return await self.get(db)
+
+    async def rebuild(self, db: Optional[AsyncSession] = None) -> BankSnapshot:
+        # В запросе читаем через его сессию, чтобы не занимать второе соединение
+        if db is None:
+            async with AsyncSessionLocal() as db:
+                return await self._rebuild(db)
+        return await self._rebuild(db)
+
+    async def _rebuild(self, db: AsyncSession) -> BankSnapshot:
+        generation = self._generation
+        started = time.perf_counter()
+        # Версию читаем до вопросов: данные будут не старше версии, и следующая
+        # проверка в худшем случае пересоберёт банк лишний раз
+        version = await db.scalar(select(QuestionBankVersion.version).filter_by(id=1)) or 0
+        rows = await db.execute(select(Test.id, Test.question, Test.var_1, Test.var_2, Test.var_3, Test.var_4,
+                                       Test.correct_answer, Test.timer, Test.level, Test.test_type)
+                                .order_by(Test.id))
+        snapshot = BankSnapshot(version, (QuestionSnapshot(*row) for row in rows))
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        with self._lock:
+            self.rebuilds += 1
+            self.rebuild_ms_last = round(elapsed_ms, 3)
+            self.rebuild_ms_max = max(self.rebuild_ms_max, elapsed_ms)
+            # Пока читали, банк могли изменить - такой снимок отдаём, но не сохраняем
+            if generation == self._generation:
+                self._snapshot = snapshot
+                self.loaded_at = time.time()
+        logger.info(f"Банк вопросов загружен: версия {version}, вопросов {len(snapshot.all)}, "
+                    f"{elapsed_ms:.1f} мс, ~{snapshot.memory_bytes // 1024} КБ")
+        return snapshot
+
+    def invalidate(self):
+        with self._lock:
+            self._generation += 1
+            self._snapshot = None
+            self.invalidations += 1
+
+    def _discard(self, snapshot: BankSnapshot):
+        # Сброс устаревшего снимка; если его уже заменили более новым - ничего не делаем,
+        # чтобы параллельные запросы не сбрасывали снимок друг друга
+        with self._lock:
+            if self._snapshot is snapshot:
+                self._generation += 1
+                self._snapshot = None
+                self.invalidations += 1
+
+    async def check_version(self):
+        snapshot = self._snapshot
+        async with AsyncSessionLocal() as db:
+            version = await db.scalar(select(QuestionBankVersion.version).filter_by(id=1)) or 0
+            self.version_checks += 1
+            if snapshot is None or snapshot.version != version:
+                if snapshot is not None:
+                    self._discard(snapshot)
+                # Пересобираем сразу, чтобы запросы не ждали загрузки; если снимок
+                # уже загрузил запрос, пока ждали блокировку, повторно не читаем
+                async with self._rebuild_lock:
+                    if self._snapshot is None:
+                        await self._rebuild(db)
+
+    async def run_refresher(self):
+        while True:
+            try:
+                with background_run('question_bank'):
+                    await self.check_version()
+            except SQLAlchemyError:
+                logger.error("Ошибка при проверке версии банка вопросов", exc_info=True)
+            await asyncio.sleep(self.refresh_seconds)
+
+    def stats(self) -> dict:
+        snapshot = self._snapshot
+        return {
+            'loaded': snapshot is not None,
+            'version': snapshot.version if snapshot is not None else None,
+            'questions': len(snapshot.all) if snapshot is not None else 0,
+            'memory_bytes': snapshot.memory_bytes if snapshot is not None else 0,
+            'loaded_at': self.loaded_at,
+            'refresh_seconds': self.refresh_seconds,
+            'hits': self.hits,
+            'misses': self.misses,
+            'rebuilds': self.rebuilds,
+            'rebuild_ms_last': self.rebuild_ms_last,
+            'rebuild_ms_max': round(self.rebuild_ms_max, 3),
+            'invalidations': self.invalidations,
+            'version_checks': self.version_checks,
+        }
+
+
+question_bank = QuestionBank(question_bank_refresh_seconds)
+
+
+async def bump_question_bank_version(db: AsyncSession):
+    # Вызывается сервисами, меняющими tests, в их транзакции
+    result = await db.execute(update(QuestionBankVersion).where(QuestionBankVersion.id == 1)
+                              .values(version=QuestionBankVersion.version + 1))
+    if result.rowcount == 0:
+        db.add(QuestionBankVersion(id=1, version=1))
+        await db.flush()
+    db.info['question_bank_changed'] = True
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_question_bank(session):
+    if session.info.pop('question_bank_changed', False):
+        question_bank.invalidate()
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _forget_question_bank_change(session, previous_transaction):
+    if previous_transaction.parent is None:
+        session.info.pop('question_bank_changed', None)
@@ -0,0 +1,129 @@
+from sqlalchemy import delete, func, insert, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database.models import RatingScoreCount, User, UserRatingTotal
+from database.rating_summary import RATING_CATEGORIES
+from database.routing import replica_read
+from logging_config import logger
+
+# Колонки, по которым считаются процентили и таблицы лидеров
+RANKED_METRICS = tuple(RATING_CATEGORIES.values())
+LEADERBOARD_MAX = 100
+
+
+def best_score_deltas(previous: dict, rating: dict) -> dict:
+    # previous - {metric: прежний лучший результат или None}, rating - значения нового
+    # рейтинга. Возвращает изменения гистограммы {(metric, score): +-1}
+    deltas = {}
+    for metric in RANKED_METRICS:
+        value = rating.get(metric)
+        if value is None:
+            continue
+        old = previous.get(metric)
+        if old is not None and old >= value:
+            continue
+        if old is not None:
+            deltas[(metric, old)] = deltas.get((metric, old), 0) - 1
+        deltas[(metric, value)] = deltas.get((metric, value), 0) + 1
+    return deltas
+
+
+async def shift_score_counts_db(db: AsyncSession, deltas: dict):
+    # Одним upsert; строки по порядку ключа, чтобы параллельные транзакции
+    # блокировали корзины гистограммы в одном порядке
+    rows = [dict(metric=metric, score=score, users=delta) for (metric, score), delta in sorted(deltas.items())
+            if delta]
+    if not rows:
+        return
+    insert_for_dialect = sqlite_insert if db.bind.dialect.name == 'sqlite' else pg_insert
+    statement = insert_for_dialect(RatingScoreCount).values(rows)
+    await db.execute(statement.on_conflict_do_update(
+        index_elements=[RatingScoreCount.metric, RatingScoreCount.score],
+        set_={'users': RatingScoreCount.users + statement.excluded.users}
+    ))
+
+
+async def forget_user_scores_db(db: AsyncSession, user_id: int):
+    # Перед удалением пользователя: его лучшие результаты уходят из гистограммы
+    bests = (await db.execute(select(UserRatingTotal.metric, UserRatingTotal.best)
+                              .where(UserRatingTotal.user_id == user_id, UserRatingTotal.best.is_not(None)))).all()
+    await shift_score_counts_db(db, {(metric, best): -1 for metric, best in bests})
+
+
+async def rebuild_score_counts_db(db: AsyncSession):
+    # Полный пересчёт гистограммы по user_rating_totals.best
+    await db.execute(delete(RatingScoreCount))
+    await db.execute(insert(RatingScoreCount).from_select(
+        ['metric', 'score', 'users'],
+        select(UserRatingTotal.metric, UserRatingTotal.best, func.count())
+        .where(UserRatingTotal.best.is_not(None))
+        .group_by(UserRatingTotal.metric, UserRatingTotal.best)
+    ))
+
+
+@replica_read
+async def user_percentiles_db(db: AsyncSession, user_id: int):
+    # Лучшие результаты пользователя (до 8 строк по ключу) и гистограммы этих колонок:
+    # число строк - число разных баллов, от количества пользователей не зависит
+    try:
+        bests = dict((await db.execute(
+            select(UserRatingTotal.metric, UserRatingTotal.best)
+            .where(UserRatingTotal.user_id == user_id, UserRatingTotal.best.is_not(None))
+        )).all())
+        if not bests:
+            logger.info(f"У пользователя с ID {user_id} нет результатов для процентилей.")
+            return None
+        histograms = {}
+        for metric, score, users in await db.execute(
+            select(RatingScoreCount.metric, RatingScoreCount.score, RatingScoreCount.users)
+            .where(RatingScoreCount.metric.in_(list(bests)), RatingScoreCount.users > 0)
+        ):
+            histograms.setdefault(metric, []).append((score, users))
+        percentiles = {}
+        for metric, best in bests.items():
+            buckets = histograms.get(metric, [])
+            total = sum(users for _, users in buckets)
+            if not total:
+                continue
+            below = sum(users for score, users in buckets if score < best)
+            above = sum(users for score, users in buckets if score > best)
+            equal = total - below - above
+            percentiles[metric] = {
+                'best': best,
+                'users': total,
+                'rank': above + 1,
+                # Доля пользователей ниже, половина равных - в середине своей группы
+                'percentile': round((below + equal / 2) / total * 100, 2),
+                # "Входит в top_percent% лучших": доля тех, у кого результат не ниже
+                'top_percent': round((above + equal) / total * 100, 2),
+            }
+        return percentiles
+    except SQLAlchemyError as e:
+        logger.error("Ошибка при получении процентилей пользователя.", exc_info=True)
+        return None
+
+
+@replica_read
+async def leaderboard_db(db: AsyncSession, level: str, test_type: str, limit: int = 10, school_class=None):
+    # Первые limit строк индекса (metric, best DESC, user_id) или, для класса,
+    # (metric, school_class, best DESC, user_id)
+    try:
+        metric = f'category_{level}_{test_type}'
+        if metric not in RANKED_METRICS:
+            logger.info(f"Атрибут {metric} не найден в рейтинге.")
+            return None
+        query = select(UserRatingTotal.user_id, User.user_first_name, User.user_last_name,
+                       UserRatingTotal.school_class, UserRatingTotal.best, UserRatingTotal.count) \
+            .join(User, User.id == UserRatingTotal.user_id) \
+            .where(UserRatingTotal.metric == metric, UserRatingTotal.best.is_not(None))
+        if school_class is not None:
+            query = query.where(UserRatingTotal.school_class == school_class)
+        query = query.order_by(UserRatingTotal.best.desc(), UserRatingTotal.user_id) \
+            .limit(min(limit, LEADERBOARD_MAX))
+        return [dict(row._mapping) for row in await db.execute(query)]
+    except SQLAlchemyError as e:
+        logger.error("Ошибка при получении таблицы лидеров.", exc_info=True)
+        return None
@@ -0,0 +1,126 @@
+import asyncio
+import time
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import func, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config import rating_summary_refresh_seconds
+from database import AsyncSessionLocal
+from database.models import RatingSummaryRow, TestLevel, TestRating, TestType
+from database.request_stats import background_run
+from logging_config import logger
+
+# Колонка рейтинга для каждой ячейки (уровень, тип): category_objects_type1 и т.д.
+RATING_CATEGORIES = {
+    (level, test_type): f'category_{level.value}_{test_type.value}'
+    for level in TestLevel for test_type in TestType
+    if hasattr(TestRating, f'category_{level.value}_{test_type.value}')
+}
+# Колонки рейтинга, по которым ведутся суммы (user_rating_totals, rating_summary)
+RATING_METRICS = (*RATING_CATEGORIES.values(), 'time')
+
+
+class RatingSummary:
+    # Средние по всем рейтингам системы в таблице rating_summary. Пересчитываются
+    # одним агрегатом по test_rating раз в refresh_seconds; запрос читает готовую
+    # строку и получает время пересчёта. Каждый воркер запускает фоновый пересчёт,
+    # но пропускает его, если другой воркер уже обновил сводку в этом интервале.
+
+    def __init__(self, refresh_seconds: float = 60):
+        self.refresh_seconds = refresh_seconds
+        self.refreshes = 0
+        self.skipped = 0
+        self.refreshed_at = None
+        self.refresh_ms_last = None
+        self.refresh_ms_max = 0.0
+
+    async def refresh(self, db: Optional[AsyncSession] = None) -> dict:
+        # Возвращает {metric: (total, count, refreshed_at)} - то же, что записано в таблицу
+        if db is None:
+            async with AsyncSessionLocal() as db:
+                summary = await self._refresh(db)
+                await db.commit()
+            return summary
+        return await self._refresh(db)
+
+    async def _refresh(self, db: AsyncSession) -> dict:
+        started = time.perf_counter()
+        columns = [getattr(TestRating, metric) for metric in RATING_METRICS]
+        row = (await db.execute(select(
+            *[func.coalesce(func.sum(column), 0) for column in columns],
+            *[func.count(column) for column in columns]
+        ))).one()
+        now = datetime.now()
+        insert = sqlite_insert if db.bind.dialect.name == 'sqlite' else pg_insert
+        statement = insert(RatingSummaryRow).values([
+            dict(metric=metric, total=row[index], count=row[len(columns) + index], refreshed_at=now)
+            for index, metric in enumerate(RATING_METRICS)
+        ])
+        await db.execute(statement.on_conflict_do_update(
+            index_elements=[RatingSummaryRow.metric],
+            set_={'total': statement.excluded.total, 'count': statement.excluded.count,
+                  'refreshed_at': statement.excluded.refreshed_at}
+        ))
+        summary = {metric: (row[index], row[len(columns) + index], now) for index, metric in enumerate(RATING_METRICS)}
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        self.refreshes += 1
+        self.refreshed_at = now
+        self.refresh_ms_last = round(elapsed_ms, 3)
+        self.refresh_ms_max = max(self.refresh_ms_max, elapsed_ms)
+        logger.info(f"Сводка рейтингов пересчитана: {row[len(columns)]} рейтингов, {elapsed_ms:.1f} мс")
+        return summary
+
+    async def refresh_if_stale(self):
+        async with AsyncSessionLocal() as db:
+            refreshed_at = await db.scalar(select(func.min(RatingSummaryRow.refreshed_at)))
+            if refreshed_at is not None and \
+                    (datetime.now() - refreshed_at).total_seconds() < self.refresh_seconds:
+                self.skipped += 1
+                return
+            await self._refresh(db)
+            await db.commit()
+
+    async def run_refresher(self):
+        while True:
+            try:
+                with background_run('rating_summary'):
+                    await self.refresh_if_stale()
+            except SQLAlchemyError:
+                logger.error("Ошибка при пересчёте сводки рейтингов", exc_info=True)
+            await asyncio.sleep(self.refresh_seconds)
+
+    async def read(self, db: AsyncSession) -> dict:
+        # Сводка из таблицы; если её ещё ни разу не считали - считаем сейчас в той же
+        # сессии запроса: запись уйдёт на основную базу и закоммитится вместе с запросом
+        summary = {metric: (total, count, refreshed_at) for metric, total, count, refreshed_at in await db.execute(
+            select(RatingSummaryRow.metric, RatingSummaryRow.total, RatingSummaryRow.count,
+                   RatingSummaryRow.refreshed_at)
+        )}
+        if not summary:
+            summary = await self.refresh(db)
+        return summary
+
+    def freshness(self, refreshed_at: datetime) -> dict:
+        return {
+            'refreshed_at': refreshed_at.isoformat(),
+            'age_seconds': round((datetime.now() - refreshed_at).total_seconds(), 3),
+            'refresh_seconds': self.refresh_seconds,
+        }
+
+    def stats(self) -> dict:
+        return {
+            'refresh_seconds': self.refresh_seconds,
+            'refreshes': self.refreshes,
+            'skipped': self.skipped,
+            'refreshed_at': self.refreshed_at.isoformat() if self.refreshed_at else None,
+            'refresh_ms_last': self.refresh_ms_last,
+            'refresh_ms_max': round(self.refresh_ms_max, 3),
+        }
+
+
+rating_summary = RatingSummary(rating_summary_refresh_seconds)
@@ -0,0 +1,235 @@
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from config import debug, sql_slow_query_ms, sql_n_plus_one_threshold
+from database import async_engine, engine, replica_engines
+from logging_config import logger, slow_query_logger
+
+
+class RequestDbStats:
+    # Сколько сессий, транзакций, соединений и SQL-запросов использовал один
+    # HTTP-запрос. Больше одной сессии на запрос означает, что какой-то код
+    # открыл свою сессию в обход get_async_db.
+
+    def __init__(self):
+        self.session_ids = set()
+        self.transactions = 0
+        self.connections = 0
+        self.statements = 0
+        self.sql_ms = 0.0
+        self.slow_statements = 0
+        self.shapes = Counter()
+        self.route = None
+
+    @property
+    def sessions(self) -> int:
+        return len(self.session_ids)
+
+    def repeated_shapes(self, threshold: int):
+        return [(statement, count) for statement, count in self.shapes.items() if count >= threshold]
+
+
+class RouteSqlStats:
+    def __init__(self):
+        self.requests = 0
+        self.statements = 0
+        self.max_statements = 0
+        self.sql_ms = 0.0
+        self.max_sql_ms = 0.0
+        self.slow_statements = 0
+        self.n_plus_one_requests = 0
+
+    def add(self, stats: RequestDbStats, n_plus_one: bool):
+        self.requests += 1
+        self.statements += stats.statements
+        self.max_statements = max(self.max_statements, stats.statements)
+        self.sql_ms += stats.sql_ms
+        self.max_sql_ms = max(self.max_sql_ms, stats.sql_ms)
+        self.slow_statements += stats.slow_statements
+        self.n_plus_one_requests += n_plus_one
+
+    def as_dict(self) -> dict:
+        requests = self.requests or 1
+        return {
+            'requests': self.requests,
+            'statements_avg': round(self.statements / requests, 2),
+            'statements_max': self.max_statements,
+            'sql_ms_avg': round(self.sql_ms / requests, 3),
+            'sql_ms_max': round(self.max_sql_ms, 3),
+            'slow_statements': self.slow_statements,
+            'n_plus_one_requests': self.n_plus_one_requests,
+        }
+
+
+_request_stats: ContextVar[Optional[RequestDbStats]] = ContextVar('request_db_stats', default=None)
+
+requests_total = 0
+requests_with_extra_sessions = 0
+max_sessions_per_request = 0
+
+# Запросы вне HTTP учитываются под отдельным маршрутом: проход фоновой задачи
+# (background_run) - как один «запрос», прочие запросы к БД (скрипты) - каждый отдельно
+BACKGROUND_ROUTE = '<background>'
+_route_stats = {}
+_route_lock = threading.Lock()
+
+
+def current_request_stats() -> Optional[RequestDbStats]:
+    return _request_stats.get()
+
+
+@contextmanager
+def background_run(name: str):
+    # Один проход фонового обновления (кэш, сводка) - один «запрос» маршрута '<background> name'
+    stats = RequestDbStats()
+    stats.route = f'{BACKGROUND_ROUTE} {name}'
+    token = _request_stats.set(stats)
+    try:
+        yield stats
+    finally:
+        _request_stats.reset(token)
+        with _route_lock:
+            _route_stats.setdefault(stats.route, RouteSqlStats()).add(stats, False)
+
+
+@event.listens_for(Session, 'after_begin')
+def _count_transaction(session, transaction, connection):
+    stats = _request_stats.get()
+    if stats is not None:
+        stats.session_ids.add(id(session))
+        stats.transactions += 1
+
+
+def _count_checkout(dbapi_connection, connection_record, connection_proxy):
+    stats = _request_stats.get()
+    if stats is not None:
+        stats.connections += 1
+
+
+def _value_shape(value) -> str:
+    # В лог попадает только тип и длина параметра, без самих значений
+    if value is None:
+        return 'None'
+    if isinstance(value, (str, bytes)):
+        return f'{type(value).__name__}[{len(value)}]'
+    return type(value).__name__
+
+
+def parameter_shapes(parameters, executemany: bool) -> str:
+    if executemany:
+        rows = list(parameters)
+        return f"{len(rows)} x {parameter_shapes(rows[0], False) if rows else '()'}"
+    if isinstance(parameters, dict):
+        return '{' + ', '.join(f'{key}: {_value_shape(value)}' for key, value in parameters.items()) + '}'
+    if isinstance(parameters, (list, tuple)):
+        return '(' + ', '.join(_value_shape(value) for value in parameters) + ')'
+    return _value_shape(parameters)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('sql_started', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info['sql_started'].pop()
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    slow = elapsed_ms >= sql_slow_query_ms
+    stats = _request_stats.get()
+    if stats is not None:
+        stats.statements += 1
+        stats.sql_ms += elapsed_ms
+        stats.shapes[statement] += 1
+        stats.slow_statements += slow
+    else:
+        with _route_lock:
+            route_stats = _route_stats.setdefault(BACKGROUND_ROUTE, RouteSqlStats())
+            route_stats.requests += 1
+            route_stats.statements += 1
+            route_stats.max_statements = 1
+            route_stats.sql_ms += elapsed_ms
+            route_stats.max_sql_ms = max(route_stats.max_sql_ms, elapsed_ms)
+            route_stats.slow_statements += slow
+    if slow:
+        route = stats.route if stats is not None else BACKGROUND_ROUTE
+        slow_query_logger.warning(f"{elapsed_ms:.1f} мс [{route}] {' '.join(statement.split())} "
+                                  f"параметры: {parameter_shapes(parameters, executemany)}")
+
+
+def _forget_failed_statement(exception_context):
+    # after_cursor_execute для упавшего запроса не вызывается
+    connection = exception_context.connection
+    if connection is not None and connection.info.get('sql_started'):
+        connection.info['sql_started'].pop()
+
+
+def watch_engine(bind):
+    # Подключает учёт соединений и SQL к движку. Основной движок и реплики
+    # подключены ниже, движки, созданные в скриптах, подключаются явно.
+    sync_engine = getattr(bind, 'sync_engine', bind)
+    event.listen(sync_engine.pool, 'checkout', _count_checkout)
+    event.listen(sync_engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(sync_engine, 'after_cursor_execute', _after_cursor_execute)
+    event.listen(sync_engine, 'handle_error', _forget_failed_statement)
+
+
+for _engine in (engine, async_engine, *replica_engines):
+    watch_engine(_engine)
+
+
+def _route_name(request) -> str:
+    # Шаблон пути (/tests/{test_id}), а не сам путь, чтобы маршрутов было конечное число
+    route = request.scope.get('route')
+    if route is None:
+        return f'{request.method} <unmatched>'
+    return f'{request.method} {route.path}'
+
+
+async def db_request_stats_middleware(request, call_next):
+    global requests_total, requests_with_extra_sessions, max_sessions_per_request
+    stats = RequestDbStats()
+    stats.route = f'{request.method} {request.url.path}'
+    token = _request_stats.set(stats)
+    try:
+        response = await call_next(request)
+    finally:
+        _request_stats.reset(token)
+    route = _route_name(request)
+    requests_total += 1
+    max_sessions_per_request = max(max_sessions_per_request, stats.sessions)
+    # Соединений может быть два, если запрос читал с реплики и писал в основную базу
+    if stats.sessions > 1:
+        requests_with_extra_sessions += 1
+        logger.warning(f"{route}: сессий {stats.sessions}, "
+                       f"транзакций {stats.transactions}, соединений {stats.connections}")
+    repeated = stats.repeated_shapes(sql_n_plus_one_threshold)
+    for statement, count in repeated:
+        logger.warning(f"Возможный N+1 в {route}: один и тот же запрос выполнен {count} раз: "
+                       f"{' '.join(statement.split())[:300]}")
+    with _route_lock:
+        _route_stats.setdefault(route, RouteSqlStats()).add(stats, bool(repeated))
+    response.headers['X-DB-Sessions'] = str(stats.sessions)
+    response.headers['X-DB-Connections'] = str(stats.connections)
+    if debug:
+        response.headers['X-SQL-Count'] = str(stats.statements)
+        response.headers['X-SQL-Time-ms'] = f'{stats.sql_ms:.3f}'
+    return response
+
+
+def request_stats_summary() -> dict:
+    return {
+        'requests_total': requests_total,
+        'requests_with_extra_sessions': requests_with_extra_sessions,
+        'max_sessions_per_request': max_sessions_per_request,
+    }
+
+
+def route_sql_stats() -> dict:
+    with _route_lock:
+        return {route: route_stats.as_dict() for route, route_stats in sorted(_route_stats.items())}
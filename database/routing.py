@@ -0,0 +1,136 @@
+import functools
+import random
+import threading
+import time
+from contextvars import ContextVar
+from typing import Optional
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from config import db_sticky_seconds
+
+# Синхронные движки реплик (для AsyncEngine - его sync_engine), заполняются в database/__init__
+replica_engines = []
+
+_read_only: ContextVar[bool] = ContextVar('db_read_only', default=False)
+_actor: ContextVar[Optional[str]] = ContextVar('db_actor', default=None)
+
+
+class StickyWrites:
+    # Read-your-writes: после записи запросы того же пользователя (или IP)
+    # читают с основной базы sticky_seconds, пока реплика не догонит
+
+    def __init__(self, sticky_seconds: float = 5, max_keys: int = 100000):
+        self.sticky_seconds = sticky_seconds
+        self.max_keys = max_keys
+        self._until = {}
+        self._lock = threading.Lock()
+
+    def mark(self, actor: Optional[str]):
+        if actor is None or self.sticky_seconds <= 0:
+            return
+        now = time.monotonic()
+        with self._lock:
+            self._until[actor] = now + self.sticky_seconds
+            if len(self._until) > self.max_keys:
+                self._until = {key: until for key, until in self._until.items() if until > now}
+
+    def is_sticky(self, actor: Optional[str]) -> bool:
+        if actor is None:
+            return False
+        until = self._until.get(actor)
+        return until is not None and until > time.monotonic()
+
+    def __len__(self):
+        return len(self._until)
+
+
+sticky_writes = StickyWrites(db_sticky_seconds)
+
+# Счётчики по движку, на котором запрос действительно выполнен (before_cursor_execute);
+# sticky_statements - чтения внутри @replica_read, оставленные на основной базе
+replica_statements = 0
+sticky_statements = 0
+primary_statements = 0
+
+
+def _is_sticky(session) -> bool:
+    # Несохранённые записи этой же сессии реплика тоже не увидит
+    return session.info.get('has_writes') or sticky_writes.is_sticky(_actor.get())
+
+
+class RoutingSession(Session):
+    # Запись и всё, что идёт внутри flush, - на основную базу. Чтение внутри
+    # функций с @replica_read - на случайную реплику, если реплики настроены
+    # и текущий пользователь недавно ничего не писал.
+
+    def get_bind(self, mapper=None, clause=None, **kw):
+        if _read_only.get() and replica_engines and not self._flushing and \
+                (clause is None or getattr(clause, 'is_select', False)) and not _is_sticky(self):
+            return random.choice(replica_engines)
+        return super().get_bind(mapper=mapper, clause=clause, **kw)
+
+
+def replica_read(func):
+    # Помечает сервисную функцию как только читающую
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        token = _read_only.set(True)
+        try:
+            return await func(*args, **kwargs)
+        finally:
+            _read_only.reset(token)
+    return wrapper
+
+
+def set_actor(actor: Optional[str]):
+    _actor.set(actor)
+
+
+@event.listens_for(RoutingSession, 'after_flush')
+def _mark_flush(session, flush_context):
+    session.info['has_writes'] = True
+    sticky_writes.mark(_actor.get())
+
+
+@event.listens_for(RoutingSession, 'do_orm_execute')
+def _mark_bulk_write(orm_execute_state):
+    global sticky_statements
+    # update()/delete()/insert() через session.execute не проходят через flush
+    if not orm_execute_state.is_select:
+        orm_execute_state.session.info['has_writes'] = True
+        sticky_writes.mark(_actor.get())
+    elif _read_only.get() and replica_engines and _is_sticky(orm_execute_state.session):
+        sticky_statements += 1
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _count_statement(conn, cursor, statement, parameters, context, executemany):
+    global replica_statements, primary_statements
+    if conn.engine in replica_engines:
+        replica_statements += 1
+    else:
+        primary_statements += 1
+
+
+async def db_routing_middleware(request, call_next):
+    # По умолчанию «пользователь» для read-your-writes - IP; зависимости
+    # авторизации уточняют его до роли и id
+    token = _actor.set(f'ip:{request.client.host}' if request.client else None)
+    try:
+        return await call_next(request)
+    finally:
+        _actor.reset(token)
+
+
+def routing_stats() -> dict:
+    return {
+        'replicas': len(replica_engines),
+        'sticky_seconds': sticky_writes.sticky_seconds,
+        'sticky_actors': len(sticky_writes),
+        'replica_statements': replica_statements,
+        'sticky_statements': sticky_statements,
+        'primary_statements': primary_statements,
+    }
@@ -1,141 +1,195 @@
-from database import get_db
-from database.models import Test, TestLevel, TestType, TestAttempt
+from sqlalchemy.ext.asyncio import AsyncSession
+from database.question_bank import bump_question_bank_version, question_bank
+from database.models import Test, TestLevel, TestType, TestAttemptTotal, UserTestCounter
 import random
-from sqlalchemy import func
+from datetime import datetime, timedelta
+from sqlalchemy import insert, select, update
 from sqlalchemy.exc import SQLAlchemyError
 from logging_config import logger
 
 
-def add_test_db(question, var_1, var_2, var_3, var_4,
-                correct_answer, timer, level, test_type):
+async def add_test_db(db: AsyncSession, question, var_1, var_2, var_3, var_4,
+                      correct_answer, timer, level, test_type):
     try:
-        with next(get_db()) as db:
-            test = Test(
-                question=question,
-                var_1=var_1,
-                var_2=var_2,
-                var_3=var_3,
-                var_4=var_4,
-                correct_answer=correct_answer,
-                timer=timer,
-                level=TestLevel(level),
-                test_type=TestType(test_type)
-            )
-            db.add(test)
-            db.commit()
-            return True
+        test = Test(
+            question=question,
+            var_1=var_1,
+            var_2=var_2,
+            var_3=var_3,
+            var_4=var_4,
+            correct_answer=correct_answer,
+            timer=timer,
+            level=TestLevel(level),
+            test_type=TestType(test_type)
+        )
+        db.add(test)
+        await db.flush()
+        db.add(TestAttemptTotal(test_id=test.id, level=test.level))
+        await db.flush()
+        await bump_question_bank_version(db)
+        return True
     except SQLAlchemyError as e:
         logger.error("Ошибка при добавлении теста", exc_info=True)
-        db.rollback()
+        await db.rollback()
         return False
 
 
-def delete_test_db(test_id):
+async def add_tests_batch_db(db: AsyncSession, tests):
+    # Пачка тестов одним INSERT с executemany, без создания ORM-объектов;
+    # id новых тестов возвращаются тем же запросом для строк test_attempt_totals
     try:
-        with next(get_db()) as db:
-            test = db.query(Test).filter_by(id=test_id).first()
-            if not test:
-                logger.info(f"Тест с ID: {test_id} не найден.")
-                return False
-            db.delete(test)
-            db.commit()
-            return True
+        created = (await db.execute(insert(Test).returning(Test.id, Test.level), tests)).all()
+        await db.execute(insert(TestAttemptTotal), [dict(test_id=test_id, level=level) for test_id, level in created])
+        await bump_question_bank_version(db)
+        return True
+    except SQLAlchemyError as e:
+        logger.error("Ошибка при пакетном добавлении тестов", exc_info=True)
+        await db.rollback()
+        return False
+
+
+async def delete_test_db(db: AsyncSession, test_id):
+    try:
+        test = await db.scalar(select(Test).filter_by(id=test_id))
+        if not test:
+            logger.info(f"Тест с ID: {test_id} не найден.")
+            return False
+        await db.delete(test)
+        await db.flush()
+        await bump_question_bank_version(db)
+        return True
     except SQLAlchemyError as e:
         logger.error("Ошибка при удалении теста", exc_info=True)
-        db.rollback()
+        await db.rollback()
         return False
 
 
-def change_test_db(test_id, question=None, var_1=None, var_2=None, var_3=None,
-                   var_4=None, correct_answer=None, timer=None, level=None,
-                   test_type=None):
+async def change_test_db(db: AsyncSession, test_id, question=None, var_1=None, var_2=None,
+                         var_3=None, var_4=None, correct_answer=None, timer=None, level=None,
+                         test_type=None):
     try:
-        with next(get_db()) as db:
-            test = db.query(Test).filter_by(id=test_id).first()
-            if not test:
-                logger.info(f"Тест с ID {test_id} не найден для обновлений.")
-                return False
-            change_test = {
-                'question': question,
-                'var_1': var_1,
-                'var_2': var_2,
-                'var_3': var_3,
-                'var_4': var_4,
-                'correct_answer': correct_answer,
-                'timer': timer,
-                'level': TestLevel(level),
-                'test_type': TestType(test_type)
-            }
-            for key, value in change_test.items():
-                if value is not None:
-                    setattr(test, key, value)
-            db.commit()
-            return True
+        test = await db.scalar(select(Test).filter_by(id=test_id))
+        if not test:
+            logger.info(f"Тест с ID {test_id} не найден для обновлений.")
+            return False
+        change_test = {
+            'question': question,
+            'var_1': var_1,
+            'var_2': var_2,
+            'var_3': var_3,
+            'var_4': var_4,
+            'correct_answer': correct_answer,
+            'timer': timer,
+            'level': TestLevel(level) if level is not None else None,
+            'test_type': TestType(test_type) if test_type is not None else None
+        }
+        for key, value in change_test.items():
+            if value is not None:
+                setattr(test, key, value)
+        if level is not None:
+            await db.execute(update(TestAttemptTotal).where(TestAttemptTotal.test_id == test_id)
+                             .values(level=TestLevel(level)))
+        await db.flush()
+        await bump_question_bank_version(db)
+        return True
     except SQLAlchemyError as e:
         logger.error("Ошибка при изменении теста", exc_info=True)
-        db.rollback()
+        await db.rollback()
         return False
 
 
-def all_tests_db():
+async def all_tests_db(db: AsyncSession):
+    # Вопросы отдаются из кэша в памяти (database/question_bank.py)
     try:
-        with next(get_db()) as db:
-            all_tests = db.query(Test).all()
-            return all_tests
+        return list((await question_bank.get(db)).all)
     except SQLAlchemyError as e:
         logger.error("Ошибка при получении тестов из БД.", exc_info=True)
         return []
 
 
-def all_level_tests_db(level):
+async def all_level_tests_db(db: AsyncSession, level):
     try:
-        with next(get_db()) as db:
-            level_tests = db.query(Test).filter_by(level=TestLevel(level)).all()
-            return level_tests
+        return list((await question_bank.get(db)).level(level))
     except SQLAlchemyError as e:
         logger.error("Ошибка при получении тестов из БД.", exc_info=True)
         return []
 
 
-def get_30_tests_train_db(level):
+async def get_30_tests_train_db(db: AsyncSession, level):
+    # 30 наименее решаемых тестов уровня по общим счётчикам: чтение диапазона индекса
+    # (level, attempt_count, test_id) вместо GROUP BY по всей истории попыток.
+    # Тренировка под конкретного пользователя - adaptive_train_tests_db (database/trainerservice.py)
     try:
-        with (next(get_db()) as db):
-            subq = db.query(TestAttempt.test_id, func.count(TestAttempt.id).label("attempt_count")).group_by(TestAttempt.test_id).subquery()
-            tests = (db.query(Test)
-                     .outerjoin(subq, Test.id == subq.c.test_id)
-                     .filter(Test.level == TestLevel(level))
-                     .order_by(subq.c.attempt_count)
-                     .limit(30)
-                     .all())
-            if len(tests) < 30:
-                msg = 'Не достаточно тестов по этой теме для тренировки'
-                logger.info(msg)
-                return msg
-            return tests
+        bank = await question_bank.get(db)
+        ordered_ids = (await db.scalars(
+            select(TestAttemptTotal.test_id)
+            .where(TestAttemptTotal.level == TestLevel(level))
+            .order_by(TestAttemptTotal.attempt_count, TestAttemptTotal.test_id)
+            .limit(30)
+        )).all()
+        tests = [bank.by_id[test_id] for test_id in ordered_ids if test_id in bank.by_id]
+        if len(tests) < 30:
+            msg = 'Не достаточно тестов по этой теме для тренировки'
+            logger.info(msg)
+            return msg
+        return tests
     except SQLAlchemyError as e:
         logger.error("Ошибка при получении 30 тренировочных тестов", exc_info=True)
         return 'Ошибка при получении тестов'
 
 
-def get_30_tests_exam_db(num_level_1=15, num_level_2=10, num_level_3=5):
+async def recently_seen_tests_db(db: AsyncSession, user_id: int, days: float):
+    # По счётчикам попыток: диапазон по user_id в первичном ключе (user_id, test_id)
+    since = datetime.now() - timedelta(days=days)
+    return set(await db.scalars(select(UserTestCounter.test_id)
+                                .where(UserTestCounter.user_id == user_id, UserTestCounter.last_attempt_at >= since)))
+
+
+async def assemble_exam_db(db: AsyncSession, blueprint, user_id=None, exclude_recent_days=None):
+    # blueprint - список (level, test_type или None для всего уровня, количество).
+    # Вопросы тянутся случайно из ячеек банка в памяти, без ORDER BY random() по таблице.
     try:
-        total = num_level_1 + num_level_2 + num_level_3
-        if total != 30:
-            msg = (f'Вы должны указать такое количество тестов каждого типа, чтобы их сумма равнялась 30. '
-                   f'В вашем случае: 1: {num_level_1} + 2: {num_level_2} + 3: {num_level_3} = {total}')
-            logger.info(msg)
-            return msg
-        with next(get_db()) as db:
-            level_1 = db.query(Test).filter(Test.level == TestLevel.LEVEL_1).order_by(Test.id).limit(num_level_1).all()
-            level_2 = db.query(Test).filter(Test.level == TestLevel.LEVEL_2).order_by(Test.id).limit(num_level_2).all()
-            level_3 = db.query(Test).filter(Test.level == TestLevel.LEVEL_3).order_by(Test.id).limit(num_level_3).all()
-            tests = level_1 + level_2 + level_3
-            if len(tests) < 30:
-                msg = f'В базе недостаточно тестов: найдено только {len(tests)} из 30'
+        bank = await question_bank.get(db)
+        exclude = set()
+        if user_id is not None and exclude_recent_days:
+            exclude = await recently_seen_tests_db(db, user_id, exclude_recent_days)
+        # Одинаковые ячейки складываются, чтобы вопросы не повторялись между ними
+        cells = {}
+        for level, test_type, count in blueprint:
+            key = (TestLevel(level), TestType(test_type) if test_type is not None else None)
+            cells[key] = cells.get(key, 0) + count
+        tests, taken = [], set()
+        for (level, test_type), count in cells.items():
+            available = len(bank.cell(level, test_type))
+            if available < count:
+                cell_name = level.value if test_type is None else f'{level.value}/{test_type.value}'
+                msg = f'В базе недостаточно тестов {cell_name}: найдено только {available} из {count}'
                 logger.info(msg)
                 return msg
-            random.shuffle(tests)
-            return tests
+            # Ячейка-уровень и ячейка-тип внутри него пересекаются: уже взятые вопросы
+            # исключаются наравне с недавно виденными
+            drawn = bank.sample(level, test_type, count, exclude | taken)
+            if taken & {question.id for question in drawn}:
+                msg = f'Ячейки бланка пересекаются, в уровне {level.value} не хватает разных тестов'
+                logger.info(msg)
+                return msg
+            taken.update(question.id for question in drawn)
+            tests += drawn
+        random.shuffle(tests)
+        return tests
     except SQLAlchemyError as e:
-        logger.error("Ошибка при получении 30 экзаменационных тестов", exc_info=True)
+        logger.error("Ошибка при сборке экзамена", exc_info=True)
         return 'Ошибка при получении тестов для экзамена'
+
+
+async def get_30_tests_exam_db(db: AsyncSession, num_level_1=15, num_level_2=10, num_level_3=5):
+    total = num_level_1 + num_level_2 + num_level_3
+    if total != 30:
+        msg = (f'Вы должны указать такое количество тестов каждого типа, чтобы их сумма равнялась 30. '
+               f'В вашем случае: 1: {num_level_1} + 2: {num_level_2} + 3: {num_level_3} = {total}')
+        logger.info(msg)
+        return msg
+    blueprint = [(level, None, count) for level, count in
+                 ((TestLevel.LEVEL_1, num_level_1), (TestLevel.LEVEL_2, num_level_2), (TestLevel.LEVEL_3, num_level_3))
+                 if count]
+    return await assemble_exam_db(db, blueprint)
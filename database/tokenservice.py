@@ -0,0 +1,102 @@
+import hashlib
+import secrets
+from datetime import datetime, timedelta
+
+from sqlalchemy.ext.asyncio import AsyncSession
+from database.models import RefreshToken
+from sqlalchemy import select, update
+from sqlalchemy.exc import SQLAlchemyError
+from config import refresh_token_exp_days
+from logging_config import logger
+
+
+def hash_refresh_token(token: str) -> str:
+    # Токен случайный и длинный, поэтому достаточно быстрого sha256 без соли
+    return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+
+def _new_refresh_token(db, role, principal_id, family_id):
+    token = secrets.token_urlsafe(32)
+    now = datetime.utcnow()
+    refresh_token = RefreshToken(
+        token_hash=hash_refresh_token(token),
+        family_id=family_id,
+        role=role,
+        principal_id=principal_id,
+        created_at=now,
+        expires_at=now + timedelta(days=refresh_token_exp_days)
+    )
+    db.add(refresh_token)
+    return token, refresh_token
+
+
+async def create_refresh_token_db(db: AsyncSession, role, principal_id):
+    try:
+        token, refresh_token = _new_refresh_token(db, role, principal_id, secrets.token_hex(16))
+        await db.flush()
+        return token
+    except SQLAlchemyError as e:
+        logger.error("Ошибка при создании refresh-токена", exc_info=True)
+        await db.rollback()
+        return None
+
+
+async def rotate_refresh_token_db(db: AsyncSession, token):
+    # Возвращает (role, principal_id, новый токен) или None.
+    # Повторное предъявление уже использованного токена означает, что его украли:
+    # в этом случае отзывается всё семейство.
+    try:
+        current = await db.scalar(select(RefreshToken).filter_by(token_hash=hash_refresh_token(token)))
+        if not current:
+            logger.info("Refresh-токен не найден.")
+            return None
+        now = datetime.utcnow()
+        result = await db.execute(
+            update(RefreshToken)
+            .where(RefreshToken.id == current.id, RefreshToken.revoked_at.is_(None))
+            .values(revoked_at=now)
+        )
+        if not result.rowcount:
+            logger.info(f"Повторное использование refresh-токена, семейство {current.family_id} отозвано.")
+            await revoke_refresh_family(db, current.family_id, now)
+            # Запрос завершится 401 и транзакция запроса откатится, а отзыв
+            # семейства должен сохраниться - фиксируем его сразу
+            await db.commit()
+            return None
+        if current.expires_at <= now:
+            logger.info(f"Refresh-токен {current.id} просрочен.")
+            await db.commit()
+            return None
+        new_token, refresh_token = _new_refresh_token(db, current.role, current.principal_id,
+                                                      current.family_id)
+        await db.flush()
+        current.replaced_by_id = refresh_token.id
+        return current.role, current.principal_id, new_token
+    except SQLAlchemyError as e:
+        logger.error("Ошибка при обновлении refresh-токена", exc_info=True)
+        await db.rollback()
+        return None
+
+
+async def revoke_refresh_family(db, family_id, now=None):
+    await db.execute(
+        update(RefreshToken)
+        .where(RefreshToken.family_id == family_id, RefreshToken.revoked_at.is_(None))
+        .values(revoked_at=now or datetime.utcnow())
+    )
+
+
+async def revoke_refresh_tokens_db(db: AsyncSession, role, principal_id):
+    try:
+        await db.execute(
+            update(RefreshToken)
+            .where(RefreshToken.role == role, RefreshToken.principal_id == principal_id,
+                   RefreshToken.revoked_at.is_(None))
+            .values(revoked_at=datetime.utcnow())
+        )
+        await db.flush()
+        return True
+    except SQLAlchemyError as e:
+        logger.error("Ошибка при отзыве refresh-токенов", exc_info=True)
+        await db.rollback()
+        return False
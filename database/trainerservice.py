@@ -0,0 +1,130 @@
+import math
+import random
+import time
+
+from sqlalchemy import case, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.exc import SQLAlchemyError
+
+from database.question_bank import question_bank
+from database.models import Test, TestLevel, TestType, UserReviewState, UserSkillStat
+from logging_config import logger
+
+# Интервальное повторение по Лейтнеру: у каждой пары (пользователь, тест) есть ячейка box.
+# Верный ответ переносит вопрос в следующую ячейку, неверный - в нулевую; следующий
+# повтор через REVIEW_INTERVALS[box] секунд: 10 минут, 1, 3, 7, 16 и 35 дней.
+REVIEW_INTERVALS = (600, 86400, 3 * 86400, 7 * 86400, 16 * 86400, 35 * 86400)
+MAX_BOX = len(REVIEW_INTERVALS) - 1
+TRAIN_SIZE = 30
+# Потолок кандидатов на тип при поиске нерешённых: выбор не растёт вместе с банком
+NEW_CANDIDATES_MAX = 500
+
+
+def mastery_insert_values(last_correct: bool, now_ts: int) -> dict:
+    # Состояние для первого ответа на вопрос
+    box = 1 if last_correct else 0
+    return {'box': box, 'review_due': now_ts + REVIEW_INTERVALS[box]}
+
+
+def mastery_conflict_set(statement, now_ts: int) -> dict:
+    # SET для upsert в user_review_states. excluded.box > 0 - последний ответ верный.
+    # Справа в SET стоит ещё старая строка, поэтому обе колонки считаются от прежнего box.
+    box = case(
+        (statement.excluded.box > 0, case((UserReviewState.box >= MAX_BOX, MAX_BOX),
+                                          else_=UserReviewState.box + 1)),
+        else_=0
+    )
+    interval = case({index: seconds for index, seconds in enumerate(REVIEW_INTERVALS)}, value=box)
+    return {'box': box, 'review_due': now_ts + interval}
+
+
+def _split(total: int, weights: dict) -> dict:
+    # Делит total пропорционально весам методом наибольших остатков
+    weight_sum = sum(weights.values())
+    shares = {key: total * weight / weight_sum for key, weight in weights.items()}
+    quotas = {key: int(share) for key, share in shares.items()}
+    for key in sorted(shares, key=lambda key: shares[key] - quotas[key], reverse=True)[:total - sum(quotas.values())]:
+        quotas[key] += 1
+    return quotas
+
+
+async def adaptive_train_tests_db(db: AsyncSession, user_id: int, level, count: int = TRAIN_SIZE):
+    # Тренировка по состоянию пользователя, без чтения истории ответов:
+    # 1) все просроченные повторения, самые давние первыми - диапазон индекса
+    #    (user_id, review_due), уровень - по tests через первичный ключ;
+    #    просроченное не откладывается ради нового;
+    # 2) на оставшиеся места - новые вопросы по типам уровня, больше из тех, где
+    #    доля верных ответов (user_skill_stats, не больше трёх строк) ниже;
+    # 3) если новых не хватило - ближайшие по сроку повторения.
+    try:
+        bank = await question_bank.get(db)
+        level = TestLevel(level)
+        now_ts = int(time.time())
+
+        due_ids = (await db.scalars(
+            select(UserReviewState.test_id)
+            .join(Test, Test.id == UserReviewState.test_id)
+            .where(UserReviewState.user_id == user_id, UserReviewState.review_due <= now_ts, Test.level == level)
+            .order_by(UserReviewState.review_due)
+            .limit(count)
+        )).all()
+        chosen = [test_id for test_id in due_ids if test_id in bank.cell_ids(level)]
+
+        skills = {test_type: (answered, correct) for test_type, answered, correct in await db.execute(
+            select(UserSkillStat.test_type, UserSkillStat.answered, UserSkillStat.correct)
+            .where(UserSkillStat.user_id == user_id, UserSkillStat.level == level)
+        )}
+        types = [test_type for test_type in TestType if bank.cell_ids(level, test_type)]
+        # Слабость темы - доля ошибок со сглаживанием: у новой темы 0.5
+        weakness = {}
+        for test_type in types:
+            answered, correct = skills.get(test_type, (0, 0))
+            weakness[test_type] = 1 - (correct + 1) / (answered + 2)
+        quotas = _split(count - len(chosen), weakness) if types and len(chosen) < count else {}
+
+        # Кандидаты с запасом на уже решённые: число ответов по теме - верхняя оценка
+        # решённых вопросов; какие из кандидатов решены, узнаём одним IN по (user_id, test_id).
+        # Запас каждой темы - на все свободные места, чтобы недобор одной темы закрыть другой
+        remaining = count - len(chosen)
+        candidates = {}
+        for test_type in quotas:
+            cell = bank.cell(level, test_type)
+            seen_share = min(skills.get(test_type, (0, 0))[0] / len(cell), 0.9)
+            size = min(len(cell), NEW_CANDIDATES_MAX, math.ceil((remaining + 2) / (1 - seen_share) * 1.25))
+            candidates[test_type] = [question.id for question in random.sample(cell, size)]
+        candidate_ids = [test_id for ids in candidates.values() for test_id in ids]
+        seen = set()
+        if candidate_ids:
+            seen = set(await db.scalars(select(UserReviewState.test_id)
+                                        .where(UserReviewState.user_id == user_id,
+                                               UserReviewState.test_id.in_(candidate_ids))))
+        fresh = {test_type: [test_id for test_id in ids if test_id not in seen]
+                 for test_type, ids in candidates.items()}
+        for test_type, quota in quotas.items():
+            chosen += fresh[test_type][:quota]
+            fresh[test_type] = fresh[test_type][quota:]
+        # Недобор в одной теме закрываем нерешёнными из других, начиная со слабых
+        for test_type in sorted(fresh, key=weakness.get, reverse=True):
+            chosen += fresh[test_type][:count - len(chosen)]
+
+        if len(chosen) < count:
+            upcoming = (await db.scalars(
+                select(UserReviewState.test_id)
+                .join(Test, Test.id == UserReviewState.test_id)
+                .where(UserReviewState.user_id == user_id, UserReviewState.review_due > now_ts, Test.level == level)
+                .order_by(UserReviewState.review_due)
+                .limit(count - len(chosen))
+            )).all()
+            picked = set(chosen)
+            chosen += [test_id for test_id in upcoming if test_id in bank.cell_ids(level) and test_id not in picked]
+
+        if len(chosen) < count:
+            msg = 'Не достаточно тестов по этой теме для тренировки'
+            logger.info(msg)
+            return msg
+        tests = [bank.by_id[test_id] for test_id in chosen[:count]]
+        random.shuffle(tests)
+        return tests
+    except SQLAlchemyError as e:
+        logger.error("Ошибка при подборе тренировки пользователя", exc_info=True)
+        return 'Ошибка при получении тестов'
@@ -1,188 +1,386 @@
-from database import get_db
-from database.models import UserAnswer, TestRating, Test, TestLevel, TestType
+import secrets
+import time
+from collections import Counter
+from datetime import datetime
+from sqlalchemy.ext.asyncio import AsyncSession
+from database.routing import replica_read
+from database.question_bank import BankSnapshot, question_bank
+from database.rating_summary import RATING_CATEGORIES, RATING_METRICS, rating_summary
+from database.rankingservice import (RANKED_METRICS, best_score_deltas, rebuild_score_counts_db,
+                                     shift_score_counts_db)
+from database.trainerservice import mastery_conflict_set, mastery_insert_values
+from database.models import (UserAnswer, TestAttempt, TestAttemptTotal, TestRating, Test, User, UserReviewState,
+                             UserSkillStat, UserRatingTotal, UserTestCounter)
+from sqlalchemy import case, delete, func, insert, literal, null, select, text, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.exc import SQLAlchemyError
 from logging_config import logger
 
 
-def user_get_answer_db(test_id: int, timer: int, user_response: str):
+def _upsert(db: AsyncSession):
+    # INSERT ... ON CONFLICT есть и в PostgreSQL, и в SQLite (локальный запуск)
+    if db.bind.dialect.name == 'sqlite':
+        return sqlite_insert
+    return pg_insert
+
+
+async def reserve_attempts_db(db: AsyncSession, user_id: int, test_counts: dict, last_correct: dict,
+                              bank: BankSnapshot):
+    # Увеличивает счётчики попыток user_test_counters на test_counts[test_id] одним
+    # upsert ... RETURNING и возвращает {test_id: номер последней выданной попытки}.
+    # Строка счётчика остаётся заблокированной до конца транзакции, поэтому
+    # одновременные ответы одного пользователя получают разные номера.
+    # Вторым upsert по last_correct[test_id] (правильность последнего ответа)
+    # двигается состояние повторения вопроса (database/trainerservice.py),
+    # третьим увеличиваются общие счётчики тестов (test_attempt_totals).
+    # bank - снимок банка, по которому проверялись ответы (уровни вопросов).
+    # Строки идут по возрастанию test_id, чтобы параллельные транзакции брали
+    # блокировки в одном порядке и не попадали в deadlock.
+    now = datetime.now()
+    now_ts = int(time.time())
+    test_ids = sorted(test_counts)
+    statement = _upsert(db)(UserTestCounter).values([
+        dict(user_id=user_id, test_id=test_id, attempt_number=test_counts[test_id], last_attempt_at=now)
+        for test_id in test_ids
+    ])
+    statement = statement.on_conflict_do_update(
+        index_elements=[UserTestCounter.user_id, UserTestCounter.test_id],
+        set_={'attempt_number': UserTestCounter.attempt_number + statement.excluded.attempt_number,
+              'last_attempt_at': statement.excluded.last_attempt_at}
+    ).returning(UserTestCounter.test_id, UserTestCounter.attempt_number)
+    attempts = dict((await db.execute(statement)).all())
+
+    reviews = _upsert(db)(UserReviewState).values([
+        dict(user_id=user_id, test_id=test_id, **mastery_insert_values(last_correct[test_id], now_ts))
+        for test_id in test_ids
+    ])
+    await db.execute(reviews.on_conflict_do_update(
+        index_elements=[UserReviewState.user_id, UserReviewState.test_id],
+        set_=mastery_conflict_set(reviews, now_ts)
+    ))
+
+    totals = _upsert(db)(TestAttemptTotal).values([
+        dict(test_id=test_id, level=bank.by_id[test_id].level, attempt_count=test_counts[test_id])
+        for test_id in test_ids
+    ])
+    await db.execute(totals.on_conflict_do_update(
+        index_elements=[TestAttemptTotal.test_id],
+        set_={'attempt_count': TestAttemptTotal.attempt_count + totals.excluded.attempt_count}
+    ))
+    return attempts
+
+
+async def record_skill_stats_db(db: AsyncSession, user_id: int, graded):
+    # graded - пары (вопрос из банка, правильность). Ответы складываются по ячейкам
+    # (уровень, тип) и прибавляются к user_skill_stats одним upsert
+    cells = {}
+    for question, correct in graded:
+        answered, right = cells.get((question.level, question.test_type), (0, 0))
+        cells[(question.level, question.test_type)] = (answered + 1, right + bool(correct))
+    statement = _upsert(db)(UserSkillStat).values([
+        dict(user_id=user_id, level=level, test_type=test_type, answered=answered, correct=correct)
+        for (level, test_type), (answered, correct) in sorted(cells.items(),
+                                                              key=lambda item: (item[0][0].value, item[0][1].value))
+    ])
+    await db.execute(statement.on_conflict_do_update(
+        index_elements=[UserSkillStat.user_id, UserSkillStat.level, UserSkillStat.test_type],
+        set_={'answered': UserSkillStat.answered + statement.excluded.answered,
+              'correct': UserSkillStat.correct + statement.excluded.correct}
+    ))
+
+
+async def user_get_answer_db(db: AsyncSession, user_id: int, test_id: int, timer: int, user_response: str):
     try:
-        with next(get_db()) as db:
-            test = db.query(Test).filter_by(id=test_id).first()
-            if not test:
-                logger.info(f"Тест с ID {test_id} не найден.")
-                return False
-            is_correct = (user_response == test.correct_answer)
-            last_answer = db.query(UserAnswer).filter(UserAnswer.test_id == test_id) \
-                .order_by(UserAnswer.attempt.desc()).first()
-            if last_answer is None:
-                attempt_count = 1
-            else:
-                attempt_count = last_answer.attempt + 1
-            answer = UserAnswer(
-                user_response=user_response,
-                correctness=is_correct,
-                attempt=attempt_count,
-                timer=timer,
-                test_id=test_id
-            )
-            db.add(answer)
-            db.commit()
-            logger.info(f"Сохранен ответ для теста ID {test_id}, попытка {attempt_count}, правильность: {is_correct}.")
-            return True
+        # Для проверки ответа - снимок, сверенный с версией банка в базе
+        bank = await question_bank.current(db)
+        test = bank.by_id.get(test_id)
+        if test is None:
+            logger.info(f"Тест с ID {test_id} не найден.")
+            return False
+        is_correct = (user_response == test.correct_answer)
+        attempt_count = (await reserve_attempts_db(db, user_id, {test_id: 1}, {test_id: is_correct}, bank))[test_id]
+        await record_skill_stats_db(db, user_id, [(test, is_correct)])
+        answer = UserAnswer(
+            user_response=user_response,
+            correctness=is_correct,
+            attempt=attempt_count,
+            timer=timer,
+            user_id=user_id,
+            test_id=test_id
+        )
+        db.add(answer)
+        # Журнал попыток ведётся вставкой, без чтения
+        db.add(TestAttempt(user_id=user_id, test_id=test_id, attempt_number=attempt_count))
+        await db.flush()
+        logger.info(f"Сохранен ответ для теста ID {test_id}, попытка {attempt_count}, правильность: {is_correct}.")
+        return True
     except SQLAlchemyError as e:
         logger.error("Произошла ошибка при сохранении ответа пользователя.", exc_info=True)
-        db.rollback()
+        await db.rollback()
         return False
 
 
-def user_create_test_rating_db():
+async def user_get_answers_db(db: AsyncSession, user_id: int, answers):
+    # Все ответы экзамена за раз: проверка по банку вопросов в памяти,
+    # номера попыток одним upsert, ответы и журнал попыток - executemany. Ответы помечаются
+    # submission_id - по нему рейтинг считается только за этот экзамен
+    try:
+        submission_id = secrets.token_hex(16)
+        test_counts = Counter(answer['test_id'] for answer in answers)
+        bank = await question_bank.current(db)
+        missing = {test_id for test_id in test_counts if test_id not in bank.by_id}
+        if missing:
+            logger.info(f"Тесты с ID {sorted(missing)} не найдены.")
+            return None
+        correctness = [answer['user_response'] == bank.by_id[answer['test_id']].correct_answer for answer in answers]
+        # Для состояния повторения важен последний ответ на каждый тест
+        last_correct = {answer['test_id']: correct for answer, correct in zip(answers, correctness)}
+        # Номер следующей попытки для первого ответа на каждый тест
+        next_attempts = {test_id: last - test_counts[test_id] + 1
+                         for test_id, last in (await reserve_attempts_db(db, user_id, test_counts,
+                                                                         last_correct, bank)).items()}
+        await record_skill_stats_db(db, user_id, [(bank.by_id[answer['test_id']], correct)
+                                                  for answer, correct in zip(answers, correctness)])
+        rows = []
+        for answer, correct in zip(answers, correctness):
+            attempt_count = next_attempts[answer['test_id']]
+            next_attempts[answer['test_id']] += 1
+            rows.append(dict(
+                user_response=answer['user_response'],
+                correctness=correct,
+                attempt=attempt_count,
+                timer=answer['timer'],
+                user_id=user_id,
+                test_id=answer['test_id'],
+                submission_id=submission_id
+            ))
+        await db.execute(insert(UserAnswer), rows)
+        now = datetime.now()
+        await db.execute(insert(TestAttempt), [
+            dict(user_id=user_id, test_id=row['test_id'], attempt_number=row['attempt'], created_at=now)
+            for row in rows
+        ])
+        correct = sum(row['correctness'] for row in rows)
+        logger.info(f"Сохранено ответов: {len(rows)}, правильных: {correct}.")
+        return {
+            'submission_id': submission_id,
+            'saved': len(rows),
+            'correct': correct,
+            'results': [{'test_id': row['test_id'], 'attempt': row['attempt'], 'correctness': row['correctness']}
+                        for row in rows],
+        }
+    except SQLAlchemyError as e:
+        logger.error("Произошла ошибка при сохранении ответов экзамена.", exc_info=True)
+        await db.rollback()
+        return False
+
+
+async def record_rating_totals_db(db: AsyncSession, user_id: int, rating: dict):
+    # Прибавляет значения нового рейтинга к суммам пользователя, обновляет лучшие
+    # результаты и их гистограмму (database/rankingservice.py); вызывается в транзакции,
+    # вставившей рейтинг. Строки по порядку metric - против deadlock.
+    metrics = [metric for metric in sorted(RATING_METRICS) if rating.get(metric) is not None]
+    if not metrics:
+        return
+    # Первые рейтинги пользователя блокировать нечем - строк user_rating_totals ещё нет,
+    # поэтому рейтинги одного пользователя выстраиваются в очередь по строке users.
+    # FOR NO KEY UPDATE не конфликтует с FOR KEY SHARE, который берёт вставка test_rating
+    school_class = await db.scalar(select(User.school_class).where(User.id == user_id)
+                                   .with_for_update(key_share=True))
+    # Прежние лучшие результаты: до конца транзакции их никто другой не изменит
+    previous = dict((await db.execute(
+        select(UserRatingTotal.metric, UserRatingTotal.best).where(UserRatingTotal.user_id == user_id)
+    )).all())
+    rows = [dict(user_id=user_id, metric=metric, total=rating[metric], count=1,
+                 best=rating[metric] if metric in RANKED_METRICS else None, school_class=school_class)
+            for metric in metrics]
+    statement = _upsert(db)(UserRatingTotal).values(rows)
+    await db.execute(statement.on_conflict_do_update(
+        index_elements=[UserRatingTotal.user_id, UserRatingTotal.metric],
+        set_={'total': UserRatingTotal.total + statement.excluded.total,
+              'count': UserRatingTotal.count + statement.excluded.count,
+              'best': case((statement.excluded.best > func.coalesce(UserRatingTotal.best, -1),
+                            statement.excluded.best), else_=UserRatingTotal.best),
+              'school_class': statement.excluded.school_class}
+    ))
+    await shift_score_counts_db(db, best_score_deltas(previous, rating))
+
+
+async def rebuild_rating_totals_db(db: AsyncSession):
+    # Полный пересчёт user_rating_totals и гистограммы лучших результатов из
+    # test_rating (заполнение после миграции или сверка). Вставки рейтингов на это
+    # время блокируются, иначе они прибавились бы к строкам, которые сейчас пересчитываются.
+    if db.bind.dialect.name == 'postgresql':
+        await db.execute(text('LOCK TABLE test_rating IN SHARE MODE'))
+    await db.execute(delete(UserRatingTotal))
+    for metric in RATING_METRICS:
+        column = getattr(TestRating, metric)
+        await db.execute(insert(UserRatingTotal).from_select(
+            ['user_id', 'metric', 'total', 'count', 'best', 'school_class'],
+            select(TestRating.user_id, literal(metric), func.sum(column), func.count(column),
+                   func.max(column) if metric in RANKED_METRICS else null(), User.school_class)
+            .outerjoin(User, User.id == TestRating.user_id)
+            .where(TestRating.user_id.is_not(None), column.is_not(None))
+            .group_by(TestRating.user_id, User.school_class)
+        ))
+    await rebuild_score_counts_db(db)
+    return await db.scalar(select(func.count()).select_from(UserRatingTotal))
+
+
+async def user_create_test_rating_db(db: AsyncSession, user_id: int, submission_id: str):
+    # Рейтинг за один экзамен: ответы, сохранённые user_get_answers_db с этим submission_id.
+    # Тренировочные ответы (POST /ratings/answer) submission_id не получают и сюда не попадают.
+    # Счётчики и time (сумма таймеров правильно решённых тестов) считаются одним агрегатом
+    # с FILTER прямо в INSERT ... SELECT; затем ответы закрепляются за рейтингом одним
+    # UPDATE - при двух одновременных запросах экзамен достанется только одному рейтингу.
     try:
-        with next(get_db()) as db:
-            # Получаем все тесты для правильных ответов, связанных с данным rating_id
-            # Объединяем Test и UserAnswer по test_id
-            correct_tests = (
-                db.query(Test)
-                .join(UserAnswer, Test.id == UserAnswer.test_id)
-                .filter_by(UserAnswer.answered_at)
-                .limit(30)
-                .filter(UserAnswer.correctness is True)
-                .all()
-            )
-
-            # Инициализируем счетчики
-            category_objects_type1 = 0
-            category_objects_type2 = 0
-            category_actions_type1 = 0
-            category_actions_type2 = 0
-            category_actions_type3 = 0
-            category_skills_type1 = 0
-            category_skills_type2 = 0
-            category_skills_type3 = 0
-            total_timer = 0
-
-            # Проходим по всем найденным тестам и накапливаем данные
-            for test in correct_tests:
-                if test.level == TestLevel.LEVEL_1:  # уровень 1: objects
-                    if test.test_type == TestType.TYPE_1:
-                        category_objects_type1 += 1
-                    elif test.test_type == TestType.TYPE_2:
-                        category_objects_type2 += 1
-                elif test.level == TestLevel.LEVEL_2:  # уровень 2: actions
-                    if test.test_type == TestType.TYPE_1:
-                        category_actions_type1 += 1
-                    elif test.test_type == TestType.TYPE_2:
-                        category_actions_type2 += 1
-                    elif test.test_type == TestType.TYPE_3:
-                        category_actions_type3 += 1
-                elif test.level == TestLevel.LEVEL_3:  # уровень 3: skills
-                    if test.test_type == TestType.TYPE_1:
-                        category_skills_type1 += 1
-                    elif test.test_type == TestType.TYPE_2:
-                        category_skills_type2 += 1
-                    elif test.test_type == TestType.TYPE_3:
-                        category_skills_type3 += 1
-                total_timer += test.timer
-            correct_all = len(correct_tests)
-            rating = TestRating(
-                correct_all=correct_all,
-                category_objects_type1=category_objects_type1,
-                category_objects_type2=category_objects_type2,
-                category_actions_type1=category_actions_type1,
-                category_actions_type2=category_actions_type2,
-                category_actions_type3=category_actions_type3,
-                category_skills_type1=category_skills_type1,
-                category_skills_type2=category_skills_type2,
-                category_skills_type3=category_skills_type3,
-                time=total_timer
-            )
-            db.add(rating)
-            db.commit()
-            return True
+        correct = UserAnswer.correctness.is_(True)
+        columns = ['correct_all', 'time', *RATING_CATEGORIES.values()]
+        unclaimed = (UserAnswer.user_id == user_id, UserAnswer.submission_id == submission_id,
+                     UserAnswer.rating_id.is_(None))
+        totals = select(
+            literal(user_id),
+            func.count().filter(correct),
+            func.coalesce(func.sum(Test.timer).filter(correct), 0),
+            *[func.count().filter(correct, Test.level == level, Test.test_type == test_type)
+              for level, test_type in RATING_CATEGORIES]
+        ).select_from(UserAnswer).join(Test, Test.id == UserAnswer.test_id) \
+            .where(*unclaimed).having(func.count() > 0)
+        rating = (await db.execute(
+            insert(TestRating).from_select(['user_id', *columns], totals)
+            .returning(TestRating.id, *[getattr(TestRating, column) for column in columns])
+        )).first()
+        claimed = None
+        if rating is not None:
+            claimed = await db.execute(update(UserAnswer).where(*unclaimed).values(rating_id=rating.id))
+            if claimed.rowcount == 0:
+                # Параллельный запрос успел закрепить эти ответы за своим рейтингом
+                await db.execute(delete(TestRating).where(TestRating.id == rating.id))
+        if claimed is None or claimed.rowcount == 0:
+            msg = f"Экзамен {submission_id} пользователя с ID {user_id} не найден или уже оценён."
+            logger.info(msg)
+            return msg
+        rating = dict(rating._mapping)
+        await record_rating_totals_db(db, user_id, rating)
+        logger.info(f"Создан рейтинг {rating['id']} пользователя с ID {user_id}: ответов {claimed.rowcount}, "
+                    f"правильных {rating['correct_all']}.")
+        return rating
     except SQLAlchemyError as e:
         logger.error("Ошибка при добавлении тестового рейтинга", exc_info=True)
-        db.rollback()
+        await db.rollback()
         return False
 
 
-def user_test_rating_db(user_id: int):
+@replica_read
+async def user_test_rating_db(db: AsyncSession, user_id: int):
     try:
-        with next(get_db()) as db:
-            ratings = db.query(TestRating).filter_by(user_id=user_id).all()
-            if ratings:
-                logger.info(f"Найдено {len(ratings)} записей рейтинга для пользователя с ID {user_id}.")
-                return ratings
-            else:
-                logger.info(f"Рейтингов для пользователя с ID {user_id} не найдено.")
-                return "Ошибка получения статистики о данном тесте"
+        ratings = (await db.scalars(select(TestRating).filter_by(user_id=user_id))).all()
+        if ratings:
+            logger.info(f"Найдено {len(ratings)} записей рейтинга для пользователя с ID {user_id}.")
+            return ratings
+        else:
+            logger.info(f"Рейтингов для пользователя с ID {user_id} не найдено.")
+            return "Ошибка получения статистики о данном тесте"
     except SQLAlchemyError as e:
         logger.error("Ошибка в функции получения рейтинга за тест.", exc_info=True)
         return "Ошибка при выполнении запроса статистики"
 
 
-def user_category_test_rating_db(user_id: int, test_rating_id: int, level: str, test_type: str):
+async def user_category_test_rating_db(db: AsyncSession, user_id: int, test_rating_id: int,
+                                       level: str, test_type: str):
     try:
-        with next(get_db()) as db:
-            rating = db.query(TestRating).filter_by(user_id=user_id, id=test_rating_id).first()
-            if rating:
-                attr_name = f'category_{level}_{test_type}'
-                value = getattr(rating, attr_name, None)
-                if value is not None:
-                    logger.info(f"Для рейтинга ID {test_rating_id} найден атрибут {attr_name} со значением {value}.")
-                    return value
-                else:
-                    logger.info(f"Атрибут {attr_name} не найден в рейтинге с ID {test_rating_id}.")
-                    return None
+        rating = await db.scalar(select(TestRating).filter_by(user_id=user_id, id=test_rating_id))
+        if rating:
+            attr_name = f'category_{level}_{test_type}'
+            value = getattr(rating, attr_name, None)
+            if value is not None:
+                logger.info(f"Для рейтинга ID {test_rating_id} найден атрибут {attr_name} со значением {value}.")
+                return value
             else:
-                logger.info(f"Рейтинг с ID {test_rating_id} для пользователя с ID {user_id} не найден.")
+                logger.info(f"Атрибут {attr_name} не найден в рейтинге с ID {test_rating_id}.")
                 return None
+        else:
+            logger.info(f"Рейтинг с ID {test_rating_id} для пользователя с ID {user_id} не найден.")
+            return None
     except SQLAlchemyError as e:
         logger.error("Ошибка при получении рейтинга по категории.", exc_info=True)
         return None
 
 
-def user_all_tests_rating_db(user_id: int, level: str, test_type: str):
+async def user_all_tests_rating_db(db: AsyncSession, user_id: int, level: str, test_type: str):
+    # Среднее по всем рейтингам пользователя - одна строка user_rating_totals по ключу
     try:
-        with next(get_db()) as db:
-            ratings = db.query(TestRating).filter_by(user_id=user_id).all()
-            if ratings:
-                attr_name = f'category_{level}_{test_type}'
-                values = [getattr(r, attr_name, None) for r in ratings if getattr(r, attr_name, None) is not None]
-                if values:
-                    avg_value = sum(values) / len(values)
-                    logger.info(f"Среднее значение {attr_name} для пользователя с ID {user_id} равно {avg_value}.")
-                    return avg_value
-                else:
-                    logger.info(f"Для пользователя с ID {user_id} не найдено значений атрибута {attr_name}.")
-                    return None
-            else:
-                logger.info(f"У пользователя с ID {user_id} нет записей рейтинга.")
-                return None
+        attr_name = f'category_{level}_{test_type}'
+        if attr_name not in RATING_METRICS:
+            logger.info(f"Атрибут {attr_name} не найден в рейтинге.")
+            return None
+        totals = (await db.execute(select(UserRatingTotal.total, UserRatingTotal.count)
+                                   .filter_by(user_id=user_id, metric=attr_name))).first()
+        if totals and totals.count:
+            avg_value = totals.total / totals.count
+            logger.info(f"Среднее значение {attr_name} для пользователя с ID {user_id} равно {avg_value}.")
+            return avg_value
+        logger.info(f"Для пользователя с ID {user_id} не найдено значений атрибута {attr_name}.")
+        return None
     except SQLAlchemyError as e:
         logger.error("Ошибка при получении рейтинга всех тестов для пользователя.", exc_info=True)
         return None
 
 
-def all_users_tests_rating_db(level: str, test_type: str):
+async def user_rating_averages_db(db: AsyncSession, user_id: int):
+    # Все средние пользователя (категории и время): диапазон первичного ключа, до 9 строк
     try:
-        with next(get_db()) as db:
-            ratings = db.query(TestRating).all()
-            if ratings:
-                attr_name = f'category_{level}_{test_type}'
-                values = [getattr(r, attr_name, None) for r in ratings if getattr(r, attr_name, None) is not None]
-                if values:
-                    avg_value = sum(values) / len(values)
-                    logger.info(f"Среднее значение {attr_name} по всем пользователям равно {avg_value}.")
-                    return avg_value
-                else:
-                    logger.info(f"Для атрибута {attr_name} в рейтингах ничего не найдено.")
-                    return None
-            else:
-                logger.info("Нет записей в рейтинге тестов.")
-                return None
+        averages = {metric: total / count for metric, total, count in await db.execute(
+            select(UserRatingTotal.metric, UserRatingTotal.total, UserRatingTotal.count)
+            .filter_by(user_id=user_id)
+        ) if count}
+        if not averages:
+            logger.info(f"У пользователя с ID {user_id} нет записей рейтинга.")
+            return None
+        return averages
+    except SQLAlchemyError as e:
+        logger.error("Ошибка при получении средних значений рейтинга пользователя.", exc_info=True)
+        return None
+
+
+@replica_read
+async def all_users_tests_rating_db(db: AsyncSession, level: str, test_type: str):
+    # Среднее по всем пользователям из сводки rating_summary (database/rating_summary.py)
+    # вместо чтения всей test_rating; к значению прилагается время пересчёта.
+    # Пока сводка не пересчитана после первых рейтингов, count = 0 и среднее None -
+    # это не ошибка, по freshness видно, когда сводка обновится
+    try:
+        attr_name = f'category_{level}_{test_type}'
+        if attr_name not in RATING_METRICS:
+            logger.info(f"Атрибут {attr_name} не найден в рейтинге.")
+            return None
+        total, count, refreshed_at = (await rating_summary.read(db))[attr_name]
+        if not count:
+            logger.info(f"Для атрибута {attr_name} в сводке рейтингов пока ничего нет.")
+            return {'average': None, 'ratings': 0, 'freshness': rating_summary.freshness(refreshed_at)}
+        avg_value = total / count
+        logger.info(f"Среднее значение {attr_name} по всем пользователям равно {avg_value}.")
+        return {'average': avg_value, 'ratings': count, 'freshness': rating_summary.freshness(refreshed_at)}
     except SQLAlchemyError as e:
         logger.error("Ошибка при получении рейтинга всех пользователей.", exc_info=True)
         return None
 
 
-def change_password_db(user_id, password):
+@replica_read
+async def all_users_rating_averages_db(db: AsyncSession):
+    try:
+        summary = await rating_summary.read(db)
+        # Колонки без рейтингов в сводке - None, как и в all_users_tests_rating_db
+        averages = {metric: total / count if count else None for metric, (total, count, _) in summary.items()}
+        if not any(count for _, count, _ in summary.values()):
+            logger.info("В сводке рейтингов пока нет записей.")
+        refreshed_at = min(refreshed_at for _, _, refreshed_at in summary.values())
+        return {'averages': averages, 'freshness': rating_summary.freshness(refreshed_at)}
+    except SQLAlchemyError as e:
+        logger.error("Ошибка при получении средних значений по всем пользователям.", exc_info=True)
+        return None
+
+
+async def change_password_db(db: AsyncSession, user_id, password):
     pass
@@ -1,5 +1,7 @@
 import logging
 
+from config import slow_query_log_path
+
 logger = logging.getLogger('app_logger')
 logger.setLevel(logging.DEBUG)
 
@@ -11,3 +13,14 @@ file_handler.setFormatter(formatter)
 
 if not logger.hasHandlers():
     logger.addHandler(file_handler)
+
+# Медленные SQL-запросы пишутся отдельно, чтобы их не приходилось искать в app.log.
+# Файл создаётся при первой записи, а не при импорте
+slow_query_logger = logging.getLogger('slow_query_logger')
+slow_query_logger.setLevel(logging.WARNING)
+
+slow_query_handler = logging.FileHandler(slow_query_log_path, encoding='utf-8', delay=True)
+slow_query_handler.setFormatter(formatter)
+
+if not slow_query_logger.hasHandlers():
+    slow_query_logger.addHandler(slow_query_handler)
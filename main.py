@@ -5,18 +5,49 @@ from jose import jwt, JWTError
 from datetime import datetime, timedelta
 from pydantic import BaseModel
 from typing import Optional, List
-from sqlalchemy.orm import Session
-import bcrypt
-
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from contextlib import asynccontextmanager
+import asyncio
+
+from functools import partial
+
+from auth.hashing import password_hasher, verify_password_async, rehash_in_background
+from auth.token_cache import token_cache
+from auth.principal_cache import principal_cache, TokenPrincipal
+from auth.token_versions import token_versions
+from auth.throttle import login_throttle
 from config import algorithm, secret_key, access_token_exp_minutes
-from database import get_db
+from database import get_async_db, unit_of_work
+from database.request_stats import db_request_stats_middleware
+from database.routing import db_routing_middleware, set_actor
+from database.question_bank import question_bank
+from database.rating_summary import rating_summary
+from database.adminservice import rehash_password_db
+from database.tokenservice import create_refresh_token_db, rotate_refresh_token_db
 from database.models import Admin, User
 from logging_config import logger
 from api.user_api.user import user_router
 from api.admin_api.admin import admin_router
 from api.test_api.test import test_router
 
-app = FastAPI(docs_url="/")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    password_hasher.start()
+    token_versions_task = asyncio.create_task(token_versions.run_refresher())
+    question_bank_task = asyncio.create_task(question_bank.run_refresher())
+    rating_summary_task = asyncio.create_task(rating_summary.run_refresher())
+    yield
+    rating_summary_task.cancel()
+    question_bank_task.cancel()
+    token_versions_task.cancel()
+    password_hasher.shutdown()
+
+
+app = FastAPI(docs_url="/", lifespan=lifespan)
+app.middleware("http")(db_routing_middleware)
+app.middleware("http")(db_request_stats_middleware)
 app.include_router(admin_router)
 app.include_router(test_router)
 app.include_router(user_router)
@@ -24,6 +55,11 @@ app.include_router(user_router)
 class Token(BaseModel):
     access_token: str
     token_type: str
+    refresh_token: Optional[str] = None
+
+
+class RefreshRequest(BaseModel):
+    refresh_token: str
 
 
 class TokenData(BaseModel):
@@ -35,17 +71,55 @@ class UserAuth(BaseModel):
     # Для ответа не стоит возвращать пароль
 
 
-def verify_password(password: str, hashed_password: str) -> bool:
-    return bcrypt.checkpw(password.encode('utf-8'), hashed_password.encode('utf-8'))
+async def verify_password(password: str, hashed_password: str) -> bool:
+    return await verify_password_async(password, hashed_password)
 
 
-def get_user(db: Session, number: str):
-    return db.query(User).filter(User.number == number).first()
+async def get_user(db: AsyncSession, number: str):
+    return await db.scalar(select(User).filter(User.number == number))
 
 
-def get_admin(db: Session, number: str):
+async def get_admin(db: AsyncSession, number: str):
     logger.info('')
-    return db.query(Admin).filter(Admin.number == number).first()
+    return await db.scalar(select(Admin).filter(Admin.number == number))
+
+
+def check_not_blocked(principal):
+    if principal.is_blocked:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Пользователь заблокирован")
+
+
+def token_claims(role: str, principal) -> dict:
+    return {"sub": principal.number, "role": role, "uid": principal.id, "ver": principal.token_version}
+
+
+async def principal_from_payload(role: str, payload: dict, db: AsyncSession):
+    # Новые токены содержат роль, id и token_version - достаточно сверить версию
+    # с картой в памяти. Старые токены (только sub) проверяются по снимку из кэша.
+    if "uid" in payload and "ver" in payload:
+        if payload.get("role") != role:
+            return None
+        principal = TokenPrincipal(role, payload["uid"], payload["sub"], payload["ver"])
+        if not await token_versions.is_current(role, principal.id, principal.token_version, db):
+            return None
+        set_actor(f'{role}:{principal.id}')
+        return principal
+    principal = await principal_cache.get(role, payload["sub"], db)
+    if principal is not None:
+        check_not_blocked(principal)
+        set_actor(f'{role}:{principal.id}')
+    return principal
+
+
+async def cached_principal(role: str, token: str, db: AsyncSession):
+    principal = token_cache.get(role, token)
+    if isinstance(principal, TokenPrincipal) and \
+            not await token_versions.is_current(role, principal.id, principal.token_version, db):
+        return None
+    if principal is not None:
+        # Для read-your-writes: запись и последующее чтение одного пользователя
+        set_actor(f'{role}:{principal.id}')
+    return principal
 
 
 def create_access_token(data: dict, expire_date: Optional[timedelta] = None):
@@ -59,49 +133,109 @@ def create_access_token(data: dict, expire_date: Optional[timedelta] = None):
     return encoded_jwt
 
 
-def authenticate_user(db: Session, number: str, password: str):
-    user = get_user(db, number)
-    if user and verify_password(password, user.password):
+async def save_rehashed_password(model, principal_id, old_hash, new_hash):
+    # Перехеширование идёт в фоне после ответа, поэтому у него своя транзакция
+    async with unit_of_work() as db:
+        return await rehash_password_db(db, model, principal_id, old_hash, new_hash)
+
+
+async def authenticate_user(db: AsyncSession, number: str, password: str):
+    user = await get_user(db, number)
+    if user and await verify_password(password, user.password):
+        # Хеш со старой стоимостью bcrypt тихо пересчитывается после входа
+        rehash_in_background(password, user.password, partial(save_rehashed_password, User, user.id))
         return user
     return None
 
 
-def authenticate_admin(db: Session, number: str, password: str):
-    admin = get_admin(db, number)
-    if admin and verify_password(password, admin.password):
+async def authenticate_admin(db: AsyncSession, number: str, password: str):
+    admin = await get_admin(db, number)
+    if admin and await verify_password(password, admin.password):
+        # Хеш со старой стоимостью bcrypt тихо пересчитывается после входа
+        rehash_in_background(password, admin.password, partial(save_rehashed_password, Admin, admin.id))
         return admin
     return None
 
 
+def check_login_throttle(request: Request, role: str, number: str):
+    # Вызывается до bcrypt, чтобы перебор паролей не съедал CPU воркеров
+    ip = request.client.host if request.client else 'unknown'
+    retry_after = login_throttle.check(ip, f'{role}:{number}')
+    if retry_after:
+        logger.info(f"Слишком много попыток входа: {role} {number}, IP {ip}")
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Слишком много попыток входа, попробуйте позже",
+            headers={"Retry-After": str(retry_after)}
+        )
+
+
+def register_login_result(role: str, number: str, success: bool):
+    if success:
+        login_throttle.record_success(f'{role}:{number}')
+    else:
+        login_throttle.record_failure(f'{role}:{number}')
+
+
 oauth_schema = OAuth2PasswordBearer(tokenUrl="/token/user")
 
 
 @app.post("/token/user", response_model=Token)
-async def user_login(form: OAuth2PasswordRequestForm = Depends()):
-    db = next(get_db())
-    user = authenticate_user(db, form.username, form.password)
+async def user_login(request: Request, form: OAuth2PasswordRequestForm = Depends(),
+                     db: AsyncSession = Depends(get_async_db)):
+    check_login_throttle(request, 'user', form.username)
+    user = await authenticate_user(db, form.username, form.password)
+    register_login_result('user', form.username, user is not None)
     if not user:
         logger.info(f"Не найден пользователь или неверный пароль для {form.username}")
         raise HTTPException(status_code=404, detail="Неправильный пароль или username")
+    check_not_blocked(user)
     access_token_exp = timedelta(minutes=access_token_exp_minutes)
-    access_token = create_access_token(data={"sub": user.number}, expire_date=access_token_exp)
-    return {"access_token": access_token, "token_type": "bearer"}
+    access_token = create_access_token(data=token_claims("user", user), expire_date=access_token_exp)
+    refresh_token = await create_refresh_token_db(db, "user", user.id)
+    return {"access_token": access_token, "token_type": "bearer", "refresh_token": refresh_token}
 
 
 @app.post("/token/admin", response_model=Token)
-async def admin_login(form: OAuth2PasswordRequestForm = Depends()):
-    db = next(get_db())
-    admin = authenticate_admin(db, form.username, form.password)
+async def admin_login(request: Request, form: OAuth2PasswordRequestForm = Depends(),
+                      db: AsyncSession = Depends(get_async_db)):
+    check_login_throttle(request, 'admin', form.username)
+    admin = await authenticate_admin(db, form.username, form.password)
+    register_login_result('admin', form.username, admin is not None)
     if not admin:
         logger.info(f"Не найден администратор или неверный пароль для {form.username}")
         raise HTTPException(status_code=404, detail="Неправильный пароль или username")
     access_token_exp = timedelta(minutes=access_token_exp_minutes)
-    access_token = create_access_token(data={"sub": admin.number}, expire_date=access_token_exp)
-    return {"access_token": access_token, "token_type": "bearer"}
+    access_token = create_access_token(data=token_claims("admin", admin), expire_date=access_token_exp)
+    refresh_token = await create_refresh_token_db(db, "admin", admin.id)
+    return {"access_token": access_token, "token_type": "bearer", "refresh_token": refresh_token}
+
+
+@app.post("/token/refresh", response_model=Token)
+async def refresh_access_token(data: RefreshRequest, db: AsyncSession = Depends(get_async_db)):
+    # Новый access-токен без проверки пароля; refresh-токен при этом ротируется
+    exception = HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
+                              detail="Неверный или просроченный refresh-токен")
+    rotated = await rotate_refresh_token_db(db, data.refresh_token)
+    if rotated is None:
+        raise exception
+    role, principal_id, refresh_token = rotated
+    principal = await db.get(User if role == "user" else Admin, principal_id)
+    if principal is None:
+        raise exception
+    if role == "user":
+        check_not_blocked(principal)
+    claims = token_claims(role, principal)
+    access_token_exp = timedelta(minutes=access_token_exp_minutes)
+    access_token = create_access_token(data=claims, expire_date=access_token_exp)
+    return {"access_token": access_token, "token_type": "bearer", "refresh_token": refresh_token}
 
 
-async def get_current_user(token: str = Depends(oauth_schema)):
+async def get_current_user(token: str = Depends(oauth_schema), db: AsyncSession = Depends(get_async_db)):
     exception = HTTPException(status_code=404, detail="Ошибка авторизации")
+    user = await cached_principal('user', token, db)
+    if user is not None:
+        return user
     try:
         payload = jwt.decode(token, secret_key, algorithms=[algorithm])
         number: str = payload.get("sub")
@@ -111,15 +245,18 @@ async def get_current_user(token: str = Depends(oauth_schema)):
     except JWTError:
         logger.error("Ошибка декодирования токена", exc_info=True)
         raise exception
-    with get_db() as db:
-        user = get_user(db, token_data.number)
-        if user is None:
-            raise exception
-        return user
+    user = await principal_from_payload('user', payload, db)
+    if user is None:
+        raise exception
+    token_cache.put('user', token, user, payload.get("exp"))
+    return user
 
 
-async def get_current_admin(token: str = Depends(oauth_schema)):
+async def get_current_admin(token: str = Depends(oauth_schema), db: AsyncSession = Depends(get_async_db)):
     exception = HTTPException(status_code=404, detail="Ошибка авторизации")
+    admin = await cached_principal('admin', token, db)
+    if admin is not None:
+        return admin
     try:
         payload = jwt.decode(token, secret_key, algorithms=[algorithm])
         number: str = payload.get("sub")
@@ -129,11 +266,11 @@ async def get_current_admin(token: str = Depends(oauth_schema)):
     except JWTError:
         logger.error("Ошибка декодирования токена", exc_info=True)
         raise exception
-    with get_db() as db:
-        admin = get_admin(db, token_data.number)
-        if admin is None:
-            raise exception
-        return admin
+    admin = await principal_from_payload('admin', payload, db)
+    if admin is None:
+        raise exception
+    token_cache.put('admin', token, admin, payload.get("exp"))
+    return admin
 
 
 @app.get("/user/me", response_model=UserAuth)
@@ -146,10 +283,8 @@ async def admin_me(current_admin: Admin = Depends(get_current_admin)):
     return UserAuth(number=current_admin.number)
 
 
-async def get_current_user_from_cookie(
-        access_token: str = Cookie(None),
-        db: Session = Depends(get_db)
-):
+async def get_current_user_from_cookie(access_token: str = Cookie(None),
+                                 db: AsyncSession = Depends(get_async_db)):
     if access_token is None:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -158,6 +293,9 @@ async def get_current_user_from_cookie(
     # Если токен начинается с "Bearer ", удаляем префикс
     if access_token.startswith("Bearer "):
         access_token = access_token[len("Bearer "):]
+    user = await cached_principal('user', access_token, db)
+    if user is not None:
+        return user
     try:
         payload = jwt.decode(access_token, secret_key, algorithms=[algorithm])
         login = payload.get("sub")
@@ -171,20 +309,18 @@ async def get_current_user_from_cookie(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Неверный или просроченный токен"
         )
-    with get_db() as db_session:
-        user = get_user(db_session, login)
-        if user is None:
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="Пользователь не найден"
-            )
-        return user
+    user = await principal_from_payload('user', payload, db)
+    if user is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Пользователь не найден"
+        )
+    token_cache.put('user', access_token, user, payload.get("exp"))
+    return user
 
 
-async def get_current_admin_from_cookie(
-        access_token: str = Cookie(None),
-        db: Session = Depends(get_db)
-):
+async def get_current_admin_from_cookie(access_token: str = Cookie(None),
+                                 db: AsyncSession = Depends(get_async_db)):
     if access_token is None:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -193,6 +329,9 @@ async def get_current_admin_from_cookie(
     # Если токен начинается с "Bearer ", удаляем префикс
     if access_token.startswith("Bearer "):
         access_token = access_token[len("Bearer "):]
+    admin = await cached_principal('admin', access_token, db)
+    if admin is not None:
+        return admin
     try:
         payload = jwt.decode(access_token, secret_key, algorithms=[algorithm])
         login = payload.get("sub")
@@ -206,22 +345,22 @@ async def get_current_admin_from_cookie(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Неверный или просроченный токен"
         )
-    with get_db() as db_session:
-        admin = get_admin(db_session, login)
-        if admin is None:
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="Пользователь не найден"
-            )
-        return admin
+    admin = await principal_from_payload('admin', payload, db)
+    if admin is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Пользователь не найден"
+        )
+    token_cache.put('admin', access_token, admin, payload.get("exp"))
+    return admin
 
 
-def get_user_by_login(db: Session, login: str) -> Optional[User]:
-    return db.query(User).filter(User.number == login).first()
+async def get_user_by_login(db: AsyncSession, login: str) -> Optional[User]:
+    return await db.scalar(select(User).filter(User.number == login))
 
 
-def get_admin_by_login(db: Session, login: str) -> Optional[Admin]:
-    return db.query(Admin).filter(Admin.number == login).first()
+async def get_admin_by_login(db: AsyncSession, login: str) -> Optional[Admin]:
+    return await db.scalar(select(Admin).filter(Admin.number == login))
 
 
 @app.get("/login/user", response_class=HTMLResponse)
@@ -276,15 +415,19 @@ async def login_form(request: Request):
 
 @app.post("/login/user")
 async def login(
+        request: Request,
         username: str = Form(...),
         password: str = Form(...),
-        db: Session = Depends(get_db)
+        db: AsyncSession = Depends(get_async_db)
 ):
-    user = get_user_by_login(db, login=username)
-    if not user or not verify_password(password, user.password):
+    check_login_throttle(request, 'user', username)
+    user = await authenticate_user(db, username, password)
+    register_login_result('user', username, user is not None)
+    if not user:
         raise HTTPException(status_code=400, detail="Неверное имя пользователя или пароль")
+    check_not_blocked(user)
     access_token_expires = timedelta(minutes=access_token_exp_minutes)
-    token = create_access_token(data={"sub": user.number}, expire_date=access_token_expires)
+    token = create_access_token(data=token_claims("user", user), expire_date=access_token_expires)
     response = RedirectResponse(url="/home", status_code=status.HTTP_302_FOUND)
     response.set_cookie(key="access_token", value=f"Bearer {token}", httponly=True)
     return response
@@ -292,22 +435,33 @@ async def login(
 
 @app.post("/login/admin")
 async def login(
+        request: Request,
         username: str = Form(...),
         password: str = Form(...),
-        db: Session = Depends(get_db)
+        db: AsyncSession = Depends(get_async_db)
 ):
-    admin = get_admin_by_login(db, login=username)
-    if not admin or not verify_password(password, admin.password):
+    check_login_throttle(request, 'admin', username)
+    admin = await authenticate_admin(db, username, password)
+    register_login_result('admin', username, admin is not None)
+    if not admin:
         raise HTTPException(status_code=400, detail="Неверное имя админа или пароль")
     access_token_expires = timedelta(minutes=access_token_exp_minutes)
-    token = create_access_token(data={"sub": admin.number}, expire_date=access_token_expires)
+    token = create_access_token(data=token_claims("admin", admin), expire_date=access_token_expires)
     response = RedirectResponse(url="/home", status_code=status.HTTP_302_FOUND)
     response.set_cookie(key="access_token", value=f"Bearer {token}", httponly=True)
     return response
 
 
 @app.get("/home/user", response_class=HTMLResponse)
-async def home(request: Request, current_user=Depends(get_current_user_from_cookie)):
+async def home(request: Request, current_user=Depends(get_current_user_from_cookie),
+               db: AsyncSession = Depends(get_async_db)):
+    profile = await principal_cache.get('user', current_user.number, db)
+    if profile is None:
+        # Запись удалили или номер сменили после выдачи токена
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Неавторизованный пользователь"
+        )
     return f"""
     <!DOCTYPE html>
     <html>
@@ -316,7 +470,7 @@ async def home(request: Request, current_user=Depends(get_current_user_from_cook
         <title>Home</title>
       </head>
       <body>
-        <h2>Добро пожаловать, {current_user.first_name}!</h2>
+        <h2>Добро пожаловать, {profile.first_name}!</h2>
         <p>Вы успешно вошли в систему.</p>
         <a href="/logout">Выйти</a>
       </body>
@@ -325,7 +479,15 @@ async def home(request: Request, current_user=Depends(get_current_user_from_cook
 
 
 @app.get("/home/admin", response_class=HTMLResponse)
-async def home(request: Request, current_user=Depends(get_current_admin_from_cookie)):
+async def home(request: Request, current_user=Depends(get_current_admin_from_cookie),
+               db: AsyncSession = Depends(get_async_db)):
+    profile = await principal_cache.get('admin', current_user.number, db)
+    if profile is None:
+        # Запись удалили или номер сменили после выдачи токена
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Неавторизованный пользователь"
+        )
     return f"""
     <!DOCTYPE html>
     <html>
@@ -334,7 +496,7 @@ async def home(request: Request, current_user=Depends(get_current_admin_from_coo
         <title>Home</title>
       </head>
       <body>
-        <h2>Добро пожаловать, {current_user.first_name}!</h2>
+        <h2>Добро пожаловать, {profile.first_name}!</h2>
         <p>Вы успешно вошли в систему.</p>
         <a href="/logout">Выйти</a>
       </body>
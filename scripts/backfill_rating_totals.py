@@ -0,0 +1,24 @@
+# Заполнение user_rating_totals (суммы, лучшие результаты) и гистограммы
+# rating_score_counts по уже сохранённым рейтингам (после миграции) или сверка:
+# таблицы пересчитываются целиком одной транзакцией.
+# Запуск из корня проекта: python -m scripts.backfill_rating_totals
+import asyncio
+import time
+
+from database import unit_of_work
+from database.userservice import rebuild_rating_totals_db
+
+
+async def run():
+    async with unit_of_work() as db:
+        return await rebuild_rating_totals_db(db)
+
+
+def main():
+    started = time.perf_counter()
+    rows = asyncio.run(run())
+    print(f"user_rating_totals: {rows} строк, {time.perf_counter() - started:.1f} с")
+
+
+if __name__ == '__main__':
+    main()
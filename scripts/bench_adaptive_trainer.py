@@ -0,0 +1,170 @@
+# Стоимость обновления состояния повторений при сохранении ответов и подбора тренировки
+# по этому состоянию. База: users пользователей с rows_per_user решёнными вопросами
+# (заполняется напрямую) и heavy пользователей, которые отвечают answers раз через
+# user_get_answers_db пачками по 30, как на экзамене. Для сравнения - тот же подбор
+# через перечитывание истории ответов пользователя (GROUP BY по user_answers).
+# Запуск из корня проекта:
+#   python -m scripts.bench_adaptive_trainer [пользователей] [вопросов_на_пользователя] [тяжёлых] [ответов] [вопросов]
+#   python -m scripts.bench_adaptive_trainer 10000 300 3 50000 20000   - значения по умолчанию
+# Для локального запуска нужен aiosqlite.
+import asyncio
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+from sqlalchemy import create_engine, func, insert, select
+from sqlalchemy.ext.asyncio import create_async_engine
+
+import database
+from database.models import Base, Test, TestAttemptTotal, TestLevel, TestType, UserAnswer
+from database.question_bank import question_bank
+from database.trainerservice import REVIEW_INTERVALS, adaptive_train_tests_db
+from database.userservice import user_get_answers_db
+
+BATCH = 30
+CHUNK = 200000
+CORRECT_SHARE = 0.7
+
+_LEVEL_TYPES = [(level, test_type) for level in TestLevel for test_type in TestType
+                if not (level == TestLevel.LEVEL_1 and test_type == TestType.TYPE_3)]
+
+
+def seed(engine, db_path, users, rows_per_user, questions):
+    rnd = random.Random(1)
+    Base.metadata.create_all(engine)
+    with engine.begin() as conn:
+        created = conn.execute(insert(Test).returning(Test.id, Test.level, Test.test_type), [
+            dict(question=f'Вопрос {i}', var_1='a', var_2='b', var_3='c', var_4='d', correct_answer='a', timer=30,
+                 level=_LEVEL_TYPES[i % len(_LEVEL_TYPES)][0], test_type=_LEVEL_TYPES[i % len(_LEVEL_TYPES)][1])
+            for i in range(questions)
+        ]).all()
+        conn.execute(insert(TestAttemptTotal), [dict(test_id=test_id, level=level) for test_id, level, _ in created])
+    cells = {test_id: (level.name, test_type.name) for test_id, level, test_type in created}
+    test_ids = list(cells)
+    now_ts = int(time.time())
+    connection = sqlite3.connect(db_path)
+    attempts, reviews, skills = [], [], []
+    for user_id in range(1, users + 1):
+        per_cell = {}
+        for test_id in rnd.sample(test_ids, rows_per_user):
+            box = rnd.randint(0, len(REVIEW_INTERVALS) - 1)
+            attempts.append((user_id, test_id, 1))
+            reviews.append((user_id, test_id, box, now_ts + rnd.randint(-REVIEW_INTERVALS[box], REVIEW_INTERVALS[box])))
+            answered, correct = per_cell.get(cells[test_id], (0, 0))
+            per_cell[cells[test_id]] = (answered + 1, correct + (box > 0))
+        skills += [(user_id, level, test_type, answered, correct)
+                   for (level, test_type), (answered, correct) in per_cell.items()]
+        if len(attempts) >= CHUNK:
+            insert_state(connection, attempts, reviews)
+            attempts, reviews = [], []
+    insert_state(connection, attempts, reviews)
+    connection.executemany('INSERT INTO user_skill_stats (user_id, level, test_type, answered, correct) '
+                           'VALUES (?, ?, ?, ?, ?)', skills)
+    connection.commit()
+    connection.execute('ANALYZE')
+    connection.close()
+    return test_ids
+
+
+def insert_state(connection, attempts, reviews):
+    connection.executemany('INSERT INTO user_test_counters (user_id, test_id, attempt_number) VALUES (?, ?, ?)',
+                           attempts)
+    connection.executemany('INSERT INTO user_review_states (user_id, test_id, box, review_due) VALUES (?, ?, ?, ?)',
+                           reviews)
+
+
+def median_ms(samples):
+    return statistics.median(samples) * 1000
+
+
+def history_train_query(user_id, level):
+    # Подбор по истории: доля верных по каждому решённому вопросу уровня - полный
+    # проход по всем ответам пользователя при каждом запросе тренировки
+    return select(UserAnswer.test_id, func.count(), func.sum(UserAnswer.correctness)) \
+        .join(Test, Test.id == UserAnswer.test_id) \
+        .where(UserAnswer.user_id == user_id, Test.level == level) \
+        .group_by(UserAnswer.test_id)
+
+
+async def answer_heavy_users(heavy_ids, answers, test_ids):
+    # Тяжёлые пользователи отвечают по очереди, пачками по BATCH
+    rnd = random.Random(2)
+    batch_samples = []
+    for user_id in heavy_ids:
+        samples = []
+        for _ in range(answers // BATCH):
+            batch = [{'test_id': test_id, 'timer': 20, 'user_response': 'a' if rnd.random() < CORRECT_SHARE else 'b'}
+                     for test_id in rnd.sample(test_ids, BATCH)]
+            started = time.perf_counter()
+            async with database.AsyncSessionLocal() as db:
+                result = await user_get_answers_db(db, user_id, batch)
+                await db.commit()
+            samples.append(time.perf_counter() - started)
+            assert result and result['saved'] == BATCH, result
+        batch_samples.append(samples)
+    return batch_samples
+
+
+async def measure_selection(user_ids, runs, level):
+    samples = []
+    async with database.AsyncSessionLocal() as db:
+        for _ in range(runs):
+            user_id = random.choice(user_ids)
+            started = time.perf_counter()
+            tests = await adaptive_train_tests_db(db, user_id, level)
+            samples.append(time.perf_counter() - started)
+            assert not isinstance(tests, str) and len({test.id for test in tests}) == 30, tests
+    return median_ms(samples)
+
+
+async def measure_history(user_ids, runs, level):
+    samples = []
+    async with database.AsyncSessionLocal() as db:
+        for _ in range(runs):
+            started = time.perf_counter()
+            (await db.execute(history_train_query(random.choice(user_ids), level))).all()
+            samples.append(time.perf_counter() - started)
+    return median_ms(samples)
+
+
+def main(users: int = 10000, rows_per_user: int = 300, heavy: int = 3, answers: int = 50000,
+         questions: int = 20000, runs: int = 200):
+    db_path = os.path.join(tempfile.mkdtemp(), 'trainer.db')
+    engine = create_engine(f'sqlite:///{db_path}')
+    async_engine = create_async_engine(f'sqlite+aiosqlite:///{db_path}')
+    database.AsyncSessionLocal.configure(bind=async_engine)
+    started = time.perf_counter()
+    test_ids = seed(engine, db_path, users, rows_per_user, questions)
+    print(f"Заполнение: {questions} вопросов, {users} пользователей по {rows_per_user} решённых вопросов, "
+          f"{time.perf_counter() - started:.1f} с")
+
+    loop = asyncio.new_event_loop()
+    loop.run_until_complete(question_bank.rebuild())
+    heavy_ids = list(range(users + 1, users + heavy + 1))
+    started = time.perf_counter()
+    batch_samples = loop.run_until_complete(answer_heavy_users(heavy_ids, answers, test_ids))
+    print(f"Ответы: {heavy} пользователей по {answers // BATCH * BATCH} ответов, "
+          f"{time.perf_counter() - started:.1f} с")
+    tenth = max(1, len(batch_samples[0]) // 10)
+    for user_id, samples in zip(heavy_ids, batch_samples):
+        print(f"  пользователь {user_id}: пачка из {BATCH} ответов, медиана первых {tenth} - "
+              f"{median_ms(samples[:tenth]):.2f} мс, последних {tenth} - {median_ms(samples[-tenth:]):.2f} мс")
+
+    light_ids = list(range(1, users + 1))
+    for level in TestLevel:
+        light_ms = loop.run_until_complete(measure_selection(light_ids, runs, level))
+        heavy_ms = loop.run_until_complete(measure_selection(heavy_ids, runs, level))
+        history_ms = loop.run_until_complete(measure_history(heavy_ids, max(1, runs // 20), level))
+        print(f"Подбор тренировки {level.value}: {rows_per_user} решённых - {light_ms:.2f} мс, "
+              f"{answers} ответов - {heavy_ms:.2f} мс; перечитывание истории {answers} ответов - "
+              f"{history_ms:.2f} мс")
+    loop.run_until_complete(async_engine.dispose())
+    loop.close()
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:6]))
@@ -0,0 +1,71 @@
+# Сколько запросов к БД делает один авторизованный запрос к API - без кэшей и с ними.
+# Запуск из корня проекта: python -m scripts.bench_auth_queries [число_запросов]
+# Для локального запуска нужен aiosqlite.
+import os
+import sys
+import tempfile
+import time
+
+import bcrypt
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, event
+from sqlalchemy.ext.asyncio import create_async_engine
+
+import database
+from database.models import Base, User
+from auth.principal_cache import principal_cache
+from auth.token_cache import token_cache
+from config import bcrypt_rounds
+from main import app, create_access_token, token_claims
+
+
+def main(requests_count: int = 300):
+    db_path = os.path.join(tempfile.mkdtemp(), 'bench.db')
+    engine = create_engine(f'sqlite:///{db_path}')
+    async_engine = create_async_engine(f'sqlite+aiosqlite:///{db_path}')
+    database.SessionLocal.configure(bind=engine)
+    database.AsyncSessionLocal.configure(bind=async_engine)
+    Base.metadata.create_all(engine)
+    statements = []
+    event.listen(async_engine.sync_engine, 'before_cursor_execute',
+                 lambda conn, cursor, statement, *args: statements.append(statement))
+
+    with database.SessionLocal() as db:
+        user = User(user_first_name='Bench', user_last_name='User', number='998900000000',
+                    par_first_name='Parent', par_number='998900000001',
+                    password=bcrypt.hashpw(b'bench', bcrypt.gensalt(rounds=bcrypt_rounds)).decode('utf-8'))
+        db.add(user)
+        db.commit()
+        claims = token_claims('user', user)
+    legacy_token = create_access_token(data={"sub": "998900000000"})
+    claims_token = create_access_token(data=claims)
+
+    client = TestClient(app)
+    scenarios = (
+        ('токен с sub, без кэша', legacy_token, 0),
+        ('токен с sub, с кэшем', legacy_token, 10000),
+        ('токен с claims, без кэша', claims_token, 0),
+    )
+    for label, token, cache_size in scenarios:
+        token_cache.max_size = cache_size
+        principal_cache.max_size = cache_size
+        token_cache.clear()
+        principal_cache.clear()
+        statements.clear()
+        started = time.perf_counter()
+        for _ in range(requests_count):
+            response = client.get('/user/me', headers={'Authorization': f'Bearer {token}'})
+            assert response.status_code == 200, response.text
+        elapsed = time.perf_counter() - started
+        print(f"{label}: {len(statements) / requests_count:.3f} запросов к БД на запрос, "
+              f"{elapsed / requests_count * 1000:.3f} мс на запрос")
+
+    # Блокировка должна быть видна сразу, без ожидания ttl
+    client.post(f"/admins/user_block/{claims['uid']}/block")
+    for label, token in (('sub', legacy_token), ('claims', claims_token)):
+        response = client.get('/user/me', headers={'Authorization': f'Bearer {token}'})
+        print(f'после блокировки, токен с {label}:', response.status_code)
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 300)
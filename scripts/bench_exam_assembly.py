@@ -0,0 +1,128 @@
+# Сборка экзамена по бланку из банка вопросов в памяти против ORDER BY random() в БД.
+# Запуск из корня проекта: python -m scripts.bench_exam_assembly [число_вопросов] [число_экзаменов]
+# Для локального запуска нужен aiosqlite.
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import Counter
+from datetime import datetime
+
+from sqlalchemy import create_engine, insert, select, func, text
+from sqlalchemy.ext.asyncio import create_async_engine
+
+import database
+from database.models import Base, Test, TestLevel, TestType, UserTestCounter
+from database.question_bank import question_bank
+from database.testservice import assemble_exam_db, recently_seen_tests_db
+
+USER_ID = 1
+RECENT = 2000
+
+BLUEPRINT = [
+    (TestLevel.LEVEL_1, TestType.TYPE_1, 8), (TestLevel.LEVEL_1, TestType.TYPE_2, 7),
+    (TestLevel.LEVEL_2, TestType.TYPE_1, 4), (TestLevel.LEVEL_2, TestType.TYPE_2, 3),
+    (TestLevel.LEVEL_2, TestType.TYPE_3, 3), (TestLevel.LEVEL_3, None, 5),
+]
+
+_LEVEL_TYPES = [(level, test_type) for level in TestLevel for test_type in TestType
+                if not (level == TestLevel.LEVEL_1 and test_type == TestType.TYPE_3)]
+
+
+def seed(engine, questions_count):
+    rnd = random.Random(1)
+    Base.metadata.create_all(engine)
+    with engine.begin() as conn:
+        rows = []
+        for i in range(1, questions_count + 1):
+            level, test_type = _LEVEL_TYPES[i % len(_LEVEL_TYPES)]
+            rows.append(dict(question=f'Вопрос {i}', var_1='a', var_2='b', var_3='c', var_4='d',
+                             correct_answer='a', timer=30, level=level, test_type=test_type))
+            if len(rows) == 10000:
+                conn.execute(insert(Test), rows)
+                rows = []
+        if rows:
+            conn.execute(insert(Test), rows)
+        now = datetime.now()
+        conn.execute(insert(UserTestCounter), [
+            dict(user_id=USER_ID, test_id=test_id, attempt_number=1, last_attempt_at=now)
+            for test_id in rnd.sample(range(1, questions_count + 1), RECENT)
+        ])
+
+
+def bench_order_by_random(engine, rounds):
+    # Наивный вариант: по запросу на ячейку, каждый читает и сортирует всю ячейку
+    started = time.perf_counter()
+    with engine.connect() as conn:
+        for _ in range(rounds):
+            for level, test_type, count in BLUEPRINT:
+                query = select(Test.id).where(Test.level == level)
+                if test_type is not None:
+                    query = query.where(Test.test_type == test_type)
+                conn.execute(query.order_by(func.random()).limit(count)).all()
+        plan = conn.execute(text('EXPLAIN QUERY PLAN SELECT id FROM tests WHERE level = :level '
+                                 'ORDER BY random() LIMIT 5'), {'level': 'objects'}).all()
+    return (time.perf_counter() - started) * 1000 / rounds, ' | '.join(row[-1] for row in plan)
+
+
+async def bench_bank(rounds):
+    async with database.AsyncSessionLocal() as db:
+        bank = await question_bank.rebuild(db)
+        stats = question_bank.stats()
+        print(f"Загрузка банка: {stats['rebuild_ms_last']:.1f} мс, вопросов {stats['questions']}, "
+              f"~{stats['memory_bytes'] / 1024 / 1024:.1f} МБ")
+
+        started = time.perf_counter()
+        for _ in range(rounds):
+            exam = await assemble_exam_db(db, BLUEPRINT)
+        plain_ms = (time.perf_counter() - started) * 1000 / rounds
+        assert len(exam) == 30 and len({question.id for question in exam}) == 30
+
+        seen = set(await db.scalars(select(UserTestCounter.test_id).where(UserTestCounter.user_id == USER_ID)))
+        started = time.perf_counter()
+        repeats = 0
+        for _ in range(rounds):
+            exam = await assemble_exam_db(db, BLUEPRINT, USER_ID, exclude_recent_days=30)
+            repeats += sum(question.id in seen for question in exam)
+        exclude_ms = (time.perf_counter() - started) * 1000 / rounds
+
+        started = time.perf_counter()
+        for _ in range(rounds):
+            await recently_seen_tests_db(db, USER_ID, 30)
+        recent_ms = (time.perf_counter() - started) * 1000 / rounds
+
+    # Равномерность: как часто выпадает каждый вопрос одной ячейки
+    cell = bank.cell(TestLevel.LEVEL_1, TestType.TYPE_1)
+    draws_per_question = 50
+    frequency = Counter()
+    for _ in range(len(cell) * draws_per_question // 8):
+        frequency.update(question.id for question in bank.sample(TestLevel.LEVEL_1, TestType.TYPE_1, 8))
+    counts = [frequency[question.id] for question in cell]
+    return plain_ms, exclude_ms, recent_ms, repeats, min(counts), max(counts), draws_per_question
+
+
+def main(questions_count: int = 100000, rounds: int = 1000):
+    db_path = os.path.join(tempfile.mkdtemp(), 'exam.db')
+    engine = create_engine(f'sqlite:///{db_path}')
+    async_engine = create_async_engine(f'sqlite+aiosqlite:///{db_path}')
+    database.AsyncSessionLocal.configure(bind=async_engine)
+    started = time.perf_counter()
+    seed(engine, questions_count)
+    print(f"Заполнение: {questions_count} вопросов, {RECENT} недавно виденных, "
+          f"{time.perf_counter() - started:.1f} с")
+
+    random_ms, plan = bench_order_by_random(engine, max(1, rounds // 100))
+    print(f"ORDER BY random(): {random_ms:.2f} мс на экзамен; план: {plan}")
+
+    plain_ms, exclude_ms, recent_ms, repeats, low, high, expected = asyncio.run(bench_bank(rounds))
+    print(f"Банк в памяти: {plain_ms * 1000:.1f} мкс на экзамен")
+    print(f"Банк в памяти с исключением {RECENT} недавних: {exclude_ms * 1000:.1f} мкс на экзамен, "
+          f"из них запрос недавних {recent_ms * 1000:.1f} мкс; повторов: {repeats}")
+    print(f"Частота вопроса в ячейке: от {low} до {high}, ожидаемо около {expected}")
+    asyncio.run(async_engine.dispose())
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:3]))
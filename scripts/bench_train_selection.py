@@ -0,0 +1,112 @@
+# Выбор 30 наименее решаемых тестов уровня: старый GROUP BY по журналу test_attempts
+# против индекса по test_attempt_totals по мере роста истории попыток.
+# Запуск из корня проекта:
+#   python -m scripts.bench_train_selection [попыток_до] [тестов]
+#   python -m scripts.bench_train_selection 20000000   - десятки миллионов строк (долго заполняется)
+# Для локального запуска нужен aiosqlite.
+import asyncio
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+from sqlalchemy import create_engine, func, insert, select
+from sqlalchemy.ext.asyncio import create_async_engine
+
+import database
+from database.models import Base, Test, TestAttempt, TestLevel, TestType, TestAttemptTotal
+from database.question_bank import question_bank
+from database.testservice import get_30_tests_train_db
+
+CHUNK = 500000
+
+
+def old_train_query(level):
+    # Запрос до счётчиков: число попыток по каждому тесту на каждый вызов
+    subq = select(TestAttempt.test_id, func.count(TestAttempt.id).label("attempt_count")) \
+        .group_by(TestAttempt.test_id).subquery()
+    return select(Test.id).outerjoin(subq, Test.id == subq.c.test_id) \
+        .filter(Test.level == TestLevel(level)).order_by(subq.c.attempt_count).limit(30)
+
+
+def seed_tests(engine, tests_count):
+    Base.metadata.create_all(engine)
+    levels = list(TestLevel)
+    with engine.begin() as conn:
+        created = conn.execute(insert(Test).returning(Test.id, Test.level), [
+            dict(question=f'Вопрос {i}', var_1='a', var_2='b', var_3='c', var_4='d', correct_answer='a', timer=30,
+                 level=levels[i % len(levels)], test_type=TestType.TYPE_1)
+            for i in range(tests_count)
+        ]).all()
+        conn.execute(insert(TestAttemptTotal), [dict(test_id=test_id, level=level) for test_id, level in created])
+
+
+def grow_attempts(db_path, start, stop, tests_count, totals, rnd):
+    # Уникальные пары (user_id, test_id) подряд: пара k - пользователь k // тестов, тест k % тестов;
+    # у каждой пары от одной до трёх строк журнала попыток
+    connection = sqlite3.connect(db_path)
+    for chunk_start in range(start, stop, CHUNK):
+        rows = []
+        for pair in range(chunk_start, min(stop, chunk_start + CHUNK)):
+            test_id = pair % tests_count + 1
+            attempts = rnd.randint(1, 3)
+            totals[test_id] = totals.get(test_id, 0) + attempts
+            rows += [(pair // tests_count + 1, test_id, number) for number in range(1, attempts + 1)]
+        connection.executemany('INSERT INTO test_attempts (user_id, test_id, attempt_number) VALUES (?, ?, ?)', rows)
+    # Так счётчики ведёт reserve_attempts_db при каждом ответе; здесь - разом после пачки
+    connection.executemany('UPDATE test_attempt_totals SET attempt_count = ? WHERE test_id = ?',
+                           [(count, test_id) for test_id, count in totals.items()])
+    connection.commit()
+    connection.execute('ANALYZE')
+    connection.close()
+
+
+def median_ms(samples):
+    return statistics.median(samples) * 1000
+
+
+async def measure(engine_sync, runs):
+    old_samples = []
+    with engine_sync.connect() as conn:
+        for _ in range(max(1, runs // 20)):
+            started = time.perf_counter()
+            conn.execute(old_train_query('objects')).all()
+            old_samples.append(time.perf_counter() - started)
+    new_samples = []
+    async with database.AsyncSessionLocal() as db:
+        await question_bank.rebuild(db)
+        for _ in range(runs):
+            started = time.perf_counter()
+            result = await get_30_tests_train_db(db, 'objects')
+            new_samples.append(time.perf_counter() - started)
+            assert len(result) == 30, result
+    return median_ms(old_samples), median_ms(new_samples)
+
+
+def main(max_attempts: int = 2000000, tests_count: int = 10000, runs: int = 100):
+    db_path = os.path.join(tempfile.mkdtemp(), 'train.db')
+    engine = create_engine(f'sqlite:///{db_path}')
+    async_engine = create_async_engine(f'sqlite+aiosqlite:///{db_path}')
+    database.AsyncSessionLocal.configure(bind=async_engine)
+    seed_tests(engine, tests_count)
+    rnd = random.Random(1)
+    totals = {}
+    sizes = [size for size in (10000, 100000, 1000000, 10000000, 30000000) if size < max_attempts] + [max_attempts]
+    print(f"Тестов: {tests_count}, замеров на точку: {runs}")
+    print(f"{'попыток':>12} {'GROUP BY, мс':>14} {'индекс, мс':>12}")
+    loop = asyncio.new_event_loop()
+    done = 0
+    for size in sizes:
+        grow_attempts(db_path, done, size, tests_count, totals, rnd)
+        done = size
+        old_ms, new_ms = loop.run_until_complete(measure(engine, runs))
+        print(f"{size:>12} {old_ms:>14.2f} {new_ms:>12.3f}")
+    loop.run_until_complete(async_engine.dispose())
+    loop.close()
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:3]))
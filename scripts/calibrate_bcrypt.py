@@ -0,0 +1,21 @@
+# Подбор стоимости bcrypt под железо сервера. Запускается один раз на машине, где
+# работают воркеры API; найденное значение записывается в .env как BCRYPT_ROUNDS и
+# одно для всех воркеров, поэтому хеши не пересчитываются туда и обратно.
+# Запуск из корня проекта:
+#   python -m scripts.calibrate_bcrypt              - цель и границы из .env
+#   python -m scripts.calibrate_bcrypt 250          - своя цель, мс на один хеш
+import sys
+
+from auth.hashing import calibrate_rounds
+from config import bcrypt_rounds, bcrypt_target_ms, bcrypt_min_rounds, bcrypt_max_rounds
+
+
+def main(target_ms: float = bcrypt_target_ms):
+    rounds, probe_ms = calibrate_rounds(target_ms, bcrypt_min_rounds, bcrypt_max_rounds)
+    print(f"Замер: {probe_ms:.2f} мс на стоимости {bcrypt_min_rounds}, цель {target_ms} мс")
+    print(f"Сейчас в .env: BCRYPT_ROUNDS={bcrypt_rounds}")
+    print(f"BCRYPT_ROUNDS={rounds}")
+
+
+if __name__ == '__main__':
+    main(*(float(arg) for arg in sys.argv[1:2]))
@@ -0,0 +1,110 @@
+# Проверка маршрутизации чтения на реплику и read-your-writes на двух файлах SQLite.
+# Основная база и «реплика» - разные файлы с разными данными (time в test_rating),
+# поэтому по ответу видно, откуда прочитана статистика. Тесты читаются из кэша
+# в памяти, поэтому чтение проверяется на get_full_statistic_db.
+# Запуск из корня проекта: python -m scripts.check_replica_routing
+# Для локального запуска нужен aiosqlite.
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, func, select
+from sqlalchemy.ext.asyncio import create_async_engine
+
+import database
+from database import routing, unit_of_work
+from database.models import Base, Test, TestRating
+from database.adminservice import get_full_statistic_db
+from database.testservice import add_test_db
+from main import app
+
+STICKY_SECONDS = 0.5
+
+
+PRIMARY, REPLICA = 1, 2
+
+
+def make_database(path, marker):
+    engine = create_engine(f'sqlite:///{path}')
+    Base.metadata.create_all(engine)
+    with database.SessionLocal(bind=engine) as db:
+        db.add(TestRating(correct_all=0, time=marker))
+        db.commit()
+    return engine
+
+
+async def read_markers(actor):
+    routing.set_actor(actor)
+    async with unit_of_work() as db:
+        return {stat['time'] for stat in await get_full_statistic_db(db)}
+
+
+async def write_test(actor):
+    routing.set_actor(actor)
+    async with unit_of_work() as db:
+        return await add_test_db(db, 'written', '1', '2', '3', '4', '1', 30, 'objects', 'type1')
+
+
+def count_tests(engine):
+    with engine.connect() as connection:
+        return connection.scalar(select(func.count(Test.id)))
+
+
+def main():
+    directory = tempfile.mkdtemp()
+    primary = make_database(os.path.join(directory, 'primary.db'), PRIMARY)
+    replica = make_database(os.path.join(directory, 'replica.db'), REPLICA)
+    primary_async = create_async_engine(f'sqlite+aiosqlite:///{os.path.join(directory, "primary.db")}')
+    replica_async = create_async_engine(f'sqlite+aiosqlite:///{os.path.join(directory, "replica.db")}')
+    database.SessionLocal.configure(bind=primary)
+    database.AsyncSessionLocal.configure(bind=primary_async)
+    routing.replica_engines[:] = [replica_async.sync_engine]
+    routing.sticky_writes.sticky_seconds = STICKY_SECONDS
+
+    failures = []
+
+    def check(label, actual, expected):
+        ok = actual == expected
+        print(f"{'OK  ' if ok else 'FAIL'} {label}: {actual}")
+        if not ok:
+            failures.append(label)
+
+    loop = asyncio.new_event_loop()
+    check('чтение без записей идёт на реплику', loop.run_until_complete(read_markers('user:1')), {REPLICA})
+    check('запись идёт в основную базу', loop.run_until_complete(write_test('user:1')), True)
+    check('тестов в основной базе', count_tests(primary), 1)
+    check('тестов в реплике', count_tests(replica), 0)
+    check('после записи тот же пользователь читает основную базу',
+          loop.run_until_complete(read_markers('user:1')), {PRIMARY})
+    check('другой пользователь читает реплику', loop.run_until_complete(read_markers('user:2')), {REPLICA})
+    time.sleep(STICKY_SECONDS + 0.1)
+    check('по истечении окна снова реплика', loop.run_until_complete(read_markers('user:1')), {REPLICA})
+    loop.run_until_complete(primary_async.dispose())
+    loop.run_until_complete(replica_async.dispose())
+    loop.close()
+
+    # То же через HTTP: без авторизации пользователь для read-your-writes - IP клиента
+    with TestClient(app) as client:
+        check('GET /admins/full читает реплику',
+              {stat['time'] for stat in client.get('/admins/full').json()['data']}, {REPLICA})
+        response = client.post('/tests/', json={'question': 'http', 'var_1': '1', 'var_2': '2', 'var_3': '3',
+                                                'var_4': '4', 'correct_answer': '1', 'timer': 30,
+                                                'level': 'objects', 'test_type': 'type1'})
+        check('POST /tests/', response.status_code, 200)
+        check('GET /admins/full после записи читает основную базу',
+              {stat['time'] for stat in client.get('/admins/full').json()['data']}, {PRIMARY})
+        check('GET /tests/ видит записанные тесты сразу',
+              {test['question'] for test in client.get('/tests/').json()['message']}, {'written', 'http'})
+        print(client.get('/admins/metrics/db_routing').json()['data'])
+
+    if failures:
+        print(f"Ошибок: {len(failures)}")
+        sys.exit(1)
+    print("Маршрутизация работает")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+# Импорт списка учеников из файла в обход HTTP (например, при подключении школы).
+# Те же проверки и тот же отчёт, что у POST /admins/user_registration/bulk.
+# Запуск из корня проекта:
+#   python -m scripts.import_roster students.csv
+#   python -m scripts.import_roster students.ndjson --mode chunked --batch-size 500 --workers 8
+import argparse
+import asyncio
+import json
+import os
+import sys
+
+from fastapi import HTTPException
+
+from api.admin_api.admin import import_roster
+from api.bulk_upload import FORMATS, iter_records
+from auth.hashing import password_hasher
+from database import unit_of_work
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Импорт учеников из CSV/NDJSON')
+    parser.add_argument('path')
+    parser.add_argument('--format', choices=FORMATS, default=None,
+                        help='по умолчанию определяется по расширению файла')
+    parser.add_argument('--mode', choices=('atomic', 'chunked'), default='atomic')
+    parser.add_argument('--batch-size', type=int, default=200)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help='процессов для bcrypt (по умолчанию все ядра)')
+    return parser.parse_args()
+
+
+async def run(args, file_format):
+    password_hasher.workers = max(1, args.workers)
+    # Стоимость хеша та же, что у сервера: BCRYPT_ROUNDS из .env
+    password_hasher.start()
+    try:
+        with open(args.path, 'rb') as binary_file:
+            async with unit_of_work() as db:
+                report = await import_roster(db, iter_records(binary_file, file_format),
+                                             args.mode, args.batch_size)
+                if args.mode == 'atomic' and report.failed:
+                    await db.rollback()
+        return report.as_dict()
+    finally:
+        password_hasher.shutdown()
+
+
+def main():
+    args = parse_args()
+    file_format = args.format
+    if file_format is None:
+        extension = os.path.splitext(args.path)[1].lower()
+        file_format = 'csv' if extension == '.csv' else 'ndjson' if extension in ('.ndjson', '.jsonl') else None
+    if file_format is None:
+        sys.exit('Не удалось определить формат файла, укажите --format csv|ndjson')
+    try:
+        report = asyncio.run(run(args, file_format))
+    except HTTPException as e:
+        sys.exit(f'Импорт отменён: {e.detail}')
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    if report['failed']:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()